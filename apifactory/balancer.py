@@ -0,0 +1,153 @@
+"""
+Client side load balancing across multiple backend hosts.
+
+LoadBalancingTransport sends each request to one of a list of (host, port)
+addresses, chosen by a balancer (RoundRobin, LeastOutstanding or
+PowerOfTwoChoices). A host which fails `eject_after` requests in a row, with
+an exception or with a response the error strategy rejects with
+ServiceNotAvailable, is ejected for `eject_time` seconds.
+
+The requests built by the transport remember the hosts they were sent to,
+so a retry of the same call goes to a different host when one is available.
+"""
+import itertools
+import random
+import threading
+import time
+
+from apifactory import http
+
+
+class Host(object):
+    """The state of a backend host."""
+
+    def __init__(self, address, transport):
+        self.address        = address
+        self.transport      = transport
+        self.outstanding    = 0
+        self.failures       = 0
+        self.ejected_until  = None
+
+    def is_ejected(self, now):
+        return self.ejected_until is not None and self.ejected_until > now
+
+    def __repr__(self):
+        return 'Host(%s:%s)' % self.address
+
+
+class RoundRobin(object):
+    """Choose each host in turn."""
+
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def choose(self, hosts):
+        return hosts[next(self.counter) % len(hosts)]
+
+
+class LeastOutstanding(object):
+    """Choose the host with the fewest requests in flight. Ties are broken
+    randomly.
+    """
+
+    def choose(self, hosts):
+        return min(hosts, key=lambda host: (host.outstanding, random.random()))
+
+
+class PowerOfTwoChoices(object):
+    """Choose two hosts at random, and use the one with fewer requests in
+    flight. Spreads load almost as well as LeastOutstanding, without every
+    client sending to the same least loaded host.
+    """
+
+    def choose(self, hosts):
+        if len(hosts) == 1:
+            return hosts[0]
+        left, right = random.sample(hosts, 2)
+        return left if left.outstanding <= right.outstanding else right
+
+
+class BalancedRequest(object):
+    """A request built by a LoadBalancingTransport. Records the hosts it has
+    been sent to, so that retries can be sent to a different host.
+    """
+
+    def __init__(self, request):
+        self.request    = request
+        self.hosts      = []
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+
+class LoadBalancingTransport(object):
+    """An ITransport which spreads requests across several hosts.
+
+    param addresses: list of (host, port)
+    param transport_factory: called with (host, port) to create the transport
+        for each host. Defaults to http.PooledHTTPTransport
+    param balancer: chooses a host for each request, defaults to RoundRobin
+    param error_strategy: an IErrorStrategy used to check responses. A
+        response it rejects with ServiceNotAvailable is a failure of the
+        host. Defaults to http.HTTPErrorStrategy
+    param eject_after: number of consecutive failures which eject a host
+    param eject_time: seconds an ejected host is not sent requests
+    """
+
+    def __init__(self, addresses, transport_factory=None, balancer=None,
+                 error_strategy=None, eject_after=5, eject_time=30):
+        transport_factory = transport_factory or http.PooledHTTPTransport
+        self.hosts          = [Host((host, port), transport_factory(host, port))
+                               for host, port in addresses]
+        self.balancer       = balancer or RoundRobin()
+        self.error_strategy = error_strategy or http.HTTPErrorStrategy()
+        self.eject_after    = eject_after
+        self.eject_time     = eject_time
+        self.lock           = threading.Lock()
+        if not self.hosts:
+            raise ValueError("At least one address is required")
+
+    def build(self, api_spec, request_data):
+        return BalancedRequest(self.hosts[0].transport.build(api_spec, request_data))
+
+    def receive(self, api_spec, response):
+        return self.hosts[0].transport.receive(api_spec, response)
+
+    def choose(self, exclude=()):
+        """Choose a host which is not ejected and not in exclude. If there is
+        no such host, ejected hosts are used, then excluded hosts.
+        """
+        now = time.time()
+        with self.lock:
+            available = [host for host in self.hosts if not host.is_ejected(now)]
+            candidates = ([host for host in available if host not in exclude]
+                          or available or self.hosts)
+            host = self.balancer.choose(candidates)
+            host.outstanding += 1
+            return host
+
+    def send(self, request, deadline=None):
+        tried = getattr(request, 'hosts', None)
+        host = self.choose(tried or ())
+        if tried is not None:
+            tried.append(host)
+            request = request.request
+
+        return http.send_checked(
+            host.transport, request, deadline, self.error_strategy,
+            lambda available: self.finish(host, available))
+
+    def finish(self, host, succeeded):
+        """Record the outcome of a request, and eject the host once it has
+        failed eject_after times in a row.
+        """
+        with self.lock:
+            host.outstanding -= 1
+            if succeeded:
+                host.failures = 0
+                host.ejected_until = None
+                return
+            host.failures += 1
+            if host.failures >= self.eject_after:
+                host.failures = 0
+                host.ejected_until = time.time() + self.eject_time
@@ -0,0 +1,142 @@
+"""
+Collect single item calls into bulk requests.
+
+A spec.BatchSpec, as the `batch_spec` of a RequestSpec, links a single item
+APISpec (for example `translate`, which takes an `id`) to a bulk APISpec
+(`translate/multi`, which takes a list of `ids`). Calls to the client method
+which arrive within `window` seconds of the first, or until `max_items`
+calls have arrived, are sent as one call of the bulk APISpec, and its result
+is split into the result of each call:
+
+    api_translate_multi = http.GET('translate/multi', ids_schema, map_schema)
+    batch_spec = spec.BatchSpec(api_translate_multi,
+                                combine=collect_values('id', 'ids'),
+                                split=split_by_key('id'),
+                                max_items=100,
+                                window=0.005)
+    request_spec = spec.RequestSpec(retry_strategy, error_strategy,
+                                    batch_spec=batch_spec)
+    client = factory.build_client({
+        'translate': spec.ClientSpec(api_translate, request_spec),
+    }, transport)
+
+Each caller blocks until the bulk call has completed, so batches are only
+formed by calls from different threads (for example APIClient.batch()).
+"""
+import sys
+import threading
+import time
+
+from apifactory import strategy
+
+
+def collect_values(key, bulk_key):
+    """Return a `combine` function which builds the kwargs of a bulk call,
+    {bulk_key: [values]}, from the `key` kwarg of each call. Repeated values
+    are only sent once.
+    """
+    def combine(kwargs_list):
+        values = []
+        seen = set()
+        for kwargs in kwargs_list:
+            value = kwargs[key]
+            if value not in seen:
+                seen.add(value)
+                values.append(value)
+        return {bulk_key: values}
+    return combine
+
+
+def split_by_key(key, default=None):
+    """Return a `split` function for a bulk result which is a dict keyed by
+    the `key` kwarg of each call. Calls whose value is missing from the
+    result get `default`.
+    """
+    def split(kwargs_list, result):
+        return [result.get(kwargs[key], default) for kwargs in kwargs_list]
+    return split
+
+
+class Batch(object):
+    """The calls collected for one bulk call, and its results."""
+
+    def __init__(self):
+        self.calls      = []
+        self.full       = threading.Event()
+        self.done       = threading.Event()
+        self.results    = None
+        self.exc_info   = None
+
+    def result(self, index):
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        result = self.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class BatchingCall(object):
+    """A client method which collects calls into calls of `bulk_call`.
+
+    The first call of a batch waits up to `window` seconds for more calls
+    (or until there are `max_items`), then makes the bulk call with
+    combine(kwargs_list), and returns split(kwargs_list, result)[index] to
+    each caller. A result which is an Exception is raised to its caller
+    instead. If the bulk call fails, every call of the batch fails with the
+    same error.
+
+    A `_deadline` kwarg limits how long a call waits for its batch. The time
+    which remains of the deadline of the first call of a batch, once it has
+    waited for the window, is passed on to the bulk call.
+    """
+
+    def __init__(self, bulk_call, batch_spec):
+        self.bulk_call  = bulk_call
+        self.combine    = batch_spec.combine
+        self.split      = batch_spec.split
+        self.max_items  = batch_spec.max_items
+        self.window     = batch_spec.window
+        self.lock       = threading.Lock()
+        self.batch      = None
+
+    def __call__(self, **request_kwargs):
+        timeout = request_kwargs.pop('_deadline', None)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            batch = self.batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self.batch = Batch()
+            index = len(batch.calls)
+            batch.calls.append(request_kwargs)
+            if len(batch.calls) >= self.max_items:
+                self.batch = None
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(self.window)
+            with self.lock:
+                if self.batch is batch:
+                    self.batch = None
+            self.dispatch(batch, deadline)
+        elif not batch.done.wait(timeout):
+            raise strategy.DeadlineExceeded()
+        return batch.result(index)
+
+    def dispatch(self, batch, deadline=None):
+        try:
+            kwargs = self.combine(batch.calls)
+            if deadline is not None:
+                kwargs['_deadline'] = strategy.remaining(deadline)
+            results = self.split(batch.calls, self.bulk_call(**kwargs))
+            if len(results) != len(batch.calls):
+                raise ValueError("Expected %d results from the bulk call, got %d"
+                                 % (len(batch.calls), len(results)))
+            batch.results = results
+        except:
+            # Also BaseExceptions, so that the other calls of the batch
+            # never find the results missing
+            batch.exc_info = sys.exc_info()
+        finally:
+            batch.done.set()
@@ -0,0 +1,89 @@
+"""
+Response caching for clients created by factory.build_client().
+
+A CacheStrategy is set as the `cache_strategy` of a RequestSpec. Responses
+are stored in an ICache, keyed by the request built by the transport.
+"""
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+
+CacheStats = namedtuple('CacheStats', 'hits misses evictions')
+
+
+_missing = object()
+
+
+class LRUCache(object):
+    """A thread-safe ICache which holds up to `max_size` values. When it is
+    full the least recently used value is evicted. Each value expires after
+    the ttl it was stored with.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size   = max_size
+        self.values     = OrderedDict()
+        self.lock       = threading.Lock()
+        self._hits      = 0
+        self._misses    = 0
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value, expires_at = self.values.pop(key, (_missing, None))
+            if value is _missing or expires_at <= time.time():
+                self._misses += 1
+                return default
+            # Re-insert to mark as the most recently used
+            self.values[key] = value, expires_at
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value, time.time() + ttl
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def stats(self):
+        with self.lock:
+            return CacheStats(self._hits, self._misses, self._evictions)
+
+
+class CacheStrategy(object):
+    """An ICacheStrategy which caches responses for `ttl` seconds.
+
+    param cache: the ICache used to store responses. It can be shared by
+        the CacheStrategy of many RequestSpecs.
+    param ttl: seconds to cache a response
+    param key_func: function which returns a hashable cache key for a request,
+        or None if the response to the request should not be cached.
+        Defaults to using the request as the key.
+    """
+
+    def __init__(self, cache, ttl, key_func=None):
+        self.cache      = cache
+        self.ttl        = ttl
+        self.key_func   = key_func or (lambda request: request)
+
+    def fetch(self, request, func):
+        key = self.key_func(request)
+        if key is None:
+            return func()
+
+        response = self.cache.get(key, _missing)
+        if response is _missing:
+            response = func()
+            self.cache.set(key, response, self.ttl)
+        return response
@@ -0,0 +1,106 @@
+"""
+Codecs which encode request bodies and decode response bodies.
+
+Codecs are registered by name, and an APISpec or a transport selects one with
+the name (or an ICodec). The 'json' codec uses the fastest json library which
+is installed: ujson, simplejson, or the stdlib json module, imported when it
+is first used. A 'msgpack' codec is registered if msgpack is installed, and
+msgpack is also imported when it is first used.
+"""
+import functools
+
+from apifactory import compat
+
+
+class Codec(object):
+    """An ICodec built from a pair of functions.
+
+    param name: the name the codec is registered with
+    param content_type: the http Content-Type of encoded values
+    param encode: function which returns a value encoded as a string
+    param decode: function which returns the value decoded from a string
+    """
+
+    def __init__(self, name, content_type, encode, decode):
+        self.name           = name
+        self.content_type   = content_type
+        self.encode         = encode
+        self.decode         = decode
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.name, self.content_type)
+
+
+class LazyCodec(Codec):
+    """A Codec whose encode and decode functions come from the Codec
+    returned by `load`, which is called the first time either is used. This
+    defers importing the library of the codec until it is needed.
+    """
+
+    def __init__(self, name, content_type, load):
+        self.name           = name
+        self.content_type   = content_type
+        self.load           = load
+
+    def __getattr__(self, attr):
+        if attr not in ('encode', 'decode'):
+            raise AttributeError(attr)
+        codec = self.load()
+        self.encode = codec.encode
+        self.decode = codec.decode
+        return getattr(self, attr)
+
+
+_registry = {}
+
+
+def register(codec):
+    """Register an ICodec by its name, replacing any codec with the same
+    name.
+    """
+    _registry[codec.name] = codec
+    return codec
+
+
+def get_codec(codec):
+    """Return the registered ICodec for a name. ICodecs are returned
+    unchanged. Raises ValueError for an unknown name.
+    """
+    if not isinstance(codec, basestring):
+        return codec
+    try:
+        return _registry[codec]
+    except KeyError:
+        raise ValueError("Unknown codec: %s" % codec)
+
+
+# Json libraries in order of preference
+json_modules = ['ujson', 'simplejson', 'json']
+
+
+def find_json_codec(module_names=json_modules):
+    """Return a json Codec using the first of module_names which can be
+    imported.
+    """
+    for module_name in module_names:
+        try:
+            module = __import__(module_name)
+        except ImportError:
+            continue
+        return Codec('json', 'application/json', module.dumps, module.loads)
+    raise ImportError("None of %s are installed" % ', '.join(module_names))
+
+
+json_codec = register(LazyCodec('json', 'application/json', find_json_codec))
+
+
+def build_msgpack_codec():
+    import msgpack
+    return Codec('msgpack',
+                 'application/msgpack',
+                 functools.partial(msgpack.packb, use_bin_type=True),
+                 functools.partial(msgpack.unpackb, raw=False))
+
+
+if compat.is_installed('msgpack'):
+    register(LazyCodec('msgpack', 'application/msgpack', build_msgpack_codec))
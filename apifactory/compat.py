@@ -1,7 +1,42 @@
+import pkgutil
 
 
-try:
-    import colander.drop as drop
-except ImportError:
-    class _drop(object): pass
-    drop = _drop()
\ No newline at end of file
+# `import colander.drop` always failed (drop is not a module), so drop has
+# always been this sentinel. It is defined here without importing colander.
+class _drop(object): pass
+drop = _drop()
+
+
+def get_null():
+    """Return colander.null, or a sentinel which is never a serialized value
+    if colander is not installed. Imports colander on first use.
+    """
+    try:
+        import colander
+    except ImportError:
+        return _drop()
+    return colander.null
+
+
+def is_future(value):
+    """Return True if value is a Future (of tornado or concurrent.futures)."""
+    return hasattr(value, 'add_done_callback')
+
+
+def when_done(result, callback):
+    """Call callback(error) when result is complete: immediately for a plain
+    value, or once a Future has completed. error is None on success.
+    """
+    if is_future(result):
+        result.add_done_callback(lambda future: callback(future.exception()))
+    else:
+        callback(None)
+    return result
+
+
+def is_installed(module_name):
+    """Return True if a module can be imported, without importing it."""
+    try:
+        return pkgutil.find_loader(module_name) is not None
+    except ImportError:
+        return False
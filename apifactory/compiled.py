@@ -0,0 +1,368 @@
+"""
+Compile colander schemas into plain python functions.
+
+colander's SchemaNode.serialize/deserialize are generic, and relatively slow
+for small payloads. compile_meta_schema() returns a copy of an HttpMetaSchema
+where each colander schema built only from String, Integer, Boolean, Mapping
+and Sequence nodes is replaced by specialized functions which produce the
+same output.
+
+Compiled functions are checked against colander with a set of sample values
+when they are compiled, and a schema which does not produce identical output
+is not compiled. If a compiled function raises an error (for example on
+invalid data) the call is repeated with colander, so errors are always the
+colander errors.
+"""
+import colander
+
+from apifactory import http
+
+
+null = colander.null
+
+
+def get_default(node):
+    if isinstance(node.default, colander.deferred):
+        return null
+    return node.default
+
+
+# Options of a colander type which the compiled functions support. Any other
+# option set to a non-default value prevents the node from being compiled.
+supported_options = {
+    colander.Mapping:   ('_unknown',),
+    colander.Sequence:  ('accept_scalar',),
+}
+
+
+def has_default_options(typ):
+    """Return True if the options of the colander type typ, other than the
+    supported_options, all have their default values.
+    """
+    try:
+        default_typ = type(typ)()
+    except TypeError:
+        return False
+    supported = supported_options.get(type(typ), ())
+    options = lambda t: dict(
+        (key, value) for key, value in vars(t).iteritems()
+        if key not in supported)
+    return options(typ) == options(default_typ)
+
+
+def get_builder(builders, node):
+    if not has_default_options(node.typ):
+        return None
+    return builders.get(type(node.typ))
+
+
+def compile_serializer(node):
+    """Return a function equivalent to node.serialize(appstruct), or None if
+    the node can not be compiled.
+    """
+    builder = get_builder(serializer_builders, node)
+    return builder and builder(node, get_default(node))
+
+
+def serialize_string(node, default):
+    def serialize(appstruct):
+        if appstruct is null:
+            appstruct = default
+            if appstruct is null:
+                return null
+        return unicode(appstruct)
+    return serialize
+
+
+def serialize_integer(node, default):
+    def serialize(appstruct):
+        if appstruct is null:
+            appstruct = default
+            if appstruct is null:
+                return null
+        return str(int(appstruct))
+    return serialize
+
+
+def serialize_boolean(node, default):
+    def serialize(appstruct):
+        if appstruct is null:
+            appstruct = default
+            if appstruct is null:
+                return null
+        return appstruct and 'true' or 'false'
+    return serialize
+
+
+def serialize_mapping(node, default):
+    children = [(child.name, compile_serializer(child))
+                for child in node.children]
+    if not all(func for _, func in children):
+        return None
+    unknown = node.typ.unknown
+
+    def serialize(appstruct):
+        if appstruct is null:
+            appstruct = default
+            if appstruct is null:
+                appstruct = {}
+        value = dict(appstruct)
+        result = {}
+        for name, func in children:
+            result[name] = func(value.pop(name, null))
+        if value:
+            check_unknown(unknown, value, result)
+        return result
+    return serialize
+
+
+def check_unknown(unknown, value, result):
+    """Handle keys in value which are not part of the mapping schema."""
+    if unknown == 'raise':
+        raise ValueError("Unrecognized keys %s" % value.keys())
+    if unknown == 'preserve':
+        result.update(value)
+
+
+def serialize_sequence(node, default):
+    func = compile_serializer(node.children[0])
+    if not func:
+        return None
+    accept_scalar = node.typ.accept_scalar
+
+    def serialize(appstruct):
+        if appstruct is null:
+            appstruct = default
+            if appstruct is null:
+                return null
+        return [func(item) for item in as_list(appstruct, accept_scalar)]
+    return serialize
+
+
+def as_list(value, accept_scalar):
+    if hasattr(value, '__iter__') and not hasattr(value, 'get'):
+        return value
+    if accept_scalar:
+        return [value]
+    raise ValueError("%r is not iterable" % (value,))
+
+
+serializer_builders = {
+    colander.String:    serialize_string,
+    colander.Integer:   serialize_integer,
+    colander.Boolean:   serialize_boolean,
+    colander.Mapping:   serialize_mapping,
+    colander.Sequence:  serialize_sequence,
+}
+
+
+# Marks a node which has no missing value. A deferred missing value is also
+# treated as required.
+required = object()
+
+
+def compile_deserializer(node):
+    """Return a function equivalent to node.deserialize(cstruct), or None if
+    the node can not be compiled.
+    """
+    builder = get_builder(deserializer_builders, node)
+    if builder is None or isinstance(node.validator, colander.deferred):
+        return None
+    deserialize_type = builder(node)
+    if deserialize_type is None:
+        return None
+
+    preparer, validator, missing = node.preparer, node.validator, node.missing
+    if missing is colander.required or isinstance(missing, colander.deferred):
+        missing = required
+
+    def deserialize(cstruct):
+        appstruct = deserialize_type(cstruct)
+        if preparer is not None:
+            appstruct = preparer(appstruct)
+        if appstruct is null:
+            if missing is required:
+                raise ValueError("Required")
+            return missing
+        if validator is not None:
+            validator(node, appstruct)
+        return appstruct
+    return deserialize
+
+
+def deserialize_string(node):
+    def deserialize(cstruct):
+        if not cstruct:
+            return null
+        return unicode(cstruct)
+    return deserialize
+
+
+def deserialize_integer(node):
+    def deserialize(cstruct):
+        if cstruct != 0 and not cstruct:
+            return null
+        return int(cstruct)
+    return deserialize
+
+
+def deserialize_boolean(node):
+    def deserialize(cstruct):
+        if cstruct is null:
+            return null
+        return str(cstruct).lower() not in ('false', '0')
+    return deserialize
+
+
+def deserialize_mapping(node):
+    children = [(child.name, compile_deserializer(child))
+                for child in node.children]
+    if not all(func for _, func in children):
+        return None
+    unknown = node.typ.unknown
+
+    def deserialize(cstruct):
+        if cstruct is null:
+            return null
+        value = dict(cstruct)
+        result = {}
+        for name, func in children:
+            result[name] = func(value.pop(name, null))
+        if value:
+            check_unknown(unknown, value, result)
+        return result
+    return deserialize
+
+
+def deserialize_sequence(node):
+    func = compile_deserializer(node.children[0])
+    if not func:
+        return None
+    accept_scalar = node.typ.accept_scalar
+
+    def deserialize(cstruct):
+        if cstruct is null:
+            return null
+        return [func(item) for item in as_list(cstruct, accept_scalar)]
+    return deserialize
+
+
+deserializer_builders = {
+    colander.String:    deserialize_string,
+    colander.Integer:   deserialize_integer,
+    colander.Boolean:   deserialize_boolean,
+    colander.Mapping:   deserialize_mapping,
+    colander.Sequence:  deserialize_sequence,
+}
+
+
+# Values used to check compiled leaf nodes against colander
+sample_values = [
+    null, None, u'text', 'bytes', u'', '', u'\xe9', 0, 1, -12, '7', 'x7',
+    1.5, True, False, 'false', 'True', '0', [], [1, 'two'], {}, {'a': 1},
+]
+
+
+def build_samples(node):
+    """Return sample appstructs/cstructs for a schema node."""
+    if isinstance(node.typ, colander.Mapping):
+        child_samples = [(child.name, build_samples(child))
+                         for child in node.children]
+        count = max([len(samples) for _, samples in child_samples] or [0])
+        return [null, {}, {'unknown': 1}] + [
+            dict((name, samples[i % len(samples)])
+                 for name, samples in child_samples)
+            for i in xrange(count)]
+    if isinstance(node.typ, colander.Sequence):
+        child_samples = build_samples(node.children[0])
+        return [null, [], 'scalar', {'a': 1}, child_samples[1:], child_samples]
+    return sample_values
+
+
+def is_identical(left, right):
+    """Compare values by type as well as equality, so that u'1' and '1'
+    are not identical.
+    """
+    if type(left) is not type(right):
+        return False
+    if isinstance(left, dict):
+        return (set(left) == set(right) and
+                all(is_identical(left[key], right[key]) for key in left))
+    if isinstance(left, list):
+        return (len(left) == len(right) and
+                all(is_identical(l, r) for l, r in zip(left, right)))
+    return left == right
+
+
+def verify(func, colander_func, samples):
+    """Return True if func returns output identical to colander_func for all
+    samples. func may raise on samples which colander accepts, since those
+    calls fall back to colander.
+    """
+    for sample in samples:
+        try:
+            expected = colander_func(sample)
+        except Exception:
+            expected = _error
+        try:
+            actual = func(sample)
+        except Exception:
+            continue
+        if not is_identical(actual, expected):
+            return False
+    return True
+
+
+# The expected value of a sample which colander raises an error for
+_error = object()
+
+
+def with_fallback(func, colander_func):
+    def call(value):
+        try:
+            return func(value)
+        except Exception:
+            return colander_func(value)
+    return call
+
+
+class CompiledSchema(object):
+    """An ISchema which uses compiled functions for a colander schema node.
+    Exposes the children of the node, so that it can be used in an
+    HttpMetaSchema.
+    """
+
+    def __init__(self, node, serialize, deserialize):
+        self.node           = node
+        self.serialize      = with_fallback(serialize, node.serialize)
+        self.deserialize    = with_fallback(deserialize, node.deserialize)
+
+    def __getattr__(self, name):
+        return getattr(self.node, name)
+
+
+def compile_schema(schema):
+    """Return a CompiledSchema for a colander schema node, or the schema
+    unchanged if it can not be compiled.
+    """
+    if not isinstance(schema, colander.SchemaNode):
+        return schema
+    serialize = compile_serializer(schema)
+    deserialize = compile_deserializer(schema)
+    if not serialize or not deserialize:
+        return schema
+
+    samples = build_samples(schema)
+    if not (verify(serialize, schema.serialize, samples) and
+            verify(deserialize, schema.deserialize, samples)):
+        return schema
+    return CompiledSchema(schema, serialize, deserialize)
+
+
+def compile_meta_schema(meta_schema):
+    """Return a new HttpMetaSchema with each of the schemas of meta_schema
+    compiled with compile_schema().
+    """
+    schemas = dict((field, compile_schema(schema))
+                   for field, schema in meta_schema.schemas.iteritems())
+    return http.HttpMetaSchema(meta_schema.field_to_key_mapper, **schemas)
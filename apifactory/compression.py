@@ -0,0 +1,204 @@
+"""
+Compression of http request and response bodies.
+
+gzip and deflate are always available, zstd if the zstandard package is
+installed (it is imported when zstd is first used). A Compression is the policy for compressing bodies: which
+encoding, and the minimum size of a body worth compressing. It can be set
+on an APISpec, a transport, or a servlet.
+
+Responses are decompressed as they are read, by a decompressor, so a
+streamed response is never held in memory compressed or uncompressed.
+"""
+import zlib
+
+from apifactory import compat
+
+
+class Encoding(object):
+    """A content encoding.
+
+    param name: the name used in Content-Encoding and Accept-Encoding
+    param compress: function of (data, level) which returns compressed data
+    param decompressor: function which returns a new object with
+        decompress(data) and flush() methods
+    """
+
+    def __init__(self, name, compress, decompressor):
+        self.name           = name
+        self.compress       = compress
+        self.decompressor   = decompressor
+
+
+def build_zlib_encoding(name, wbits):
+    def compress(data, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        return compressor.compress(data) + compressor.flush()
+    return Encoding(name, compress, lambda: zlib.decompressobj(wbits))
+
+
+class DeflateDecompressor(object):
+    """Decompress deflate data with a zlib header, or raw deflate data which
+    some servers send instead.
+    """
+
+    def __init__(self):
+        self.decompressor = None
+
+    def decompress(self, data):
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+            try:
+                return self.decompressor.decompress(data)
+            except zlib.error:
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return self.decompressor.flush() if self.decompressor else ''
+
+
+def zstd_compress(data, level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+class ZstdDecompressor(object):
+
+    def __init__(self):
+        import zstandard
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return ''
+
+
+encodings = {}
+
+
+def register(encoding):
+    encodings[encoding.name] = encoding
+
+
+register(build_zlib_encoding('gzip', 16 + zlib.MAX_WBITS))
+register(Encoding('deflate',
+                  build_zlib_encoding('deflate', zlib.MAX_WBITS).compress,
+                  DeflateDecompressor))
+
+if compat.is_installed('zstandard'):
+    register(Encoding('zstd', zstd_compress, ZstdDecompressor))
+
+
+def get_accept_encoding():
+    """Return an Accept-Encoding header value for the supported encodings."""
+    preferred = ['zstd', 'gzip', 'deflate']
+    return ', '.join(name for name in preferred if name in encodings)
+
+
+def get_decompressor(content_encoding):
+    """Return a decompressor for a Content-Encoding header value, or None if
+    the content is not encoded (or the encoding is not supported).
+    """
+    encoding = encodings.get((content_encoding or '').strip().lower())
+    return encoding.decompressor() if encoding else None
+
+
+def decompress(data, content_encoding):
+    """Return data decoded from content_encoding. Data with an unsupported
+    encoding is returned unchanged.
+    """
+    decompressor = get_decompressor(content_encoding)
+    if decompressor is None:
+        return data
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def choose_encoding(accept_encoding, preferred):
+    """Return the first of the preferred encoding names which is supported
+    and accepted by an Accept-Encoding header value, or None.
+    """
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for name in preferred:
+        if name in encodings and (name in accepted or '*' in accepted):
+            return name
+    return None
+
+
+class Compression(object):
+    """Compress bodies of at least `min_size` bytes with an encoding.
+
+    param encoding: name of the encoding: 'gzip', 'deflate' or 'zstd'
+    param min_size: bodies smaller than this are sent uncompressed, since
+        compressing them costs more than it saves
+    param level: compression level
+    """
+
+    def __init__(self, encoding='gzip', min_size=1024, level=6):
+        if encoding not in encodings:
+            raise ValueError("Unsupported encoding: %s" % encoding)
+        self.encoding   = encodings[encoding]
+        self.min_size   = min_size
+        self.level      = level
+
+    def compress(self, body, headers):
+        """Return a tuple of (body, headers). If the body is large enough it
+        is compressed, and headers is a copy with a Content-Encoding. Only str
+        bodies are compressed; buffers and stream bodies are sent as they are.
+        """
+        if not isinstance(body, str) or len(body) < self.min_size:
+            return body, headers
+        headers = dict(headers or {})
+        headers['Content-Encoding'] = self.encoding.name
+        return self.encoding.compress(body, self.level), headers
+
+    def compress_response(self, body, accept_encoding):
+        """Return a tuple of (body, content_encoding). The body is compressed
+        if it is large enough, and the Accept-Encoding of the request accepts
+        the encoding. Otherwise content_encoding is None.
+        """
+        name = self.encoding.name
+        if (len(body) < self.min_size or
+                choose_encoding(accept_encoding, [name]) is None):
+            return body, None
+        return self.encoding.compress(body, self.level), name
+
+
+class DecompressingBody(object):
+    """A file like body which decompresses a file like body (such as an
+    http.StreamingBody) as it is read.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, body, decompressor):
+        self.body           = body
+        self.decompressor   = decompressor
+        self.finished       = False
+
+    def read(self, size=None):
+        """Return the next decompressed data. An empty string is only
+        returned once the body has been read completely.
+        """
+        while not self.finished:
+            data = self.body.read(size or self.chunk_size)
+            if not data:
+                self.finished = True
+                return self.decompressor.flush()
+            data = self.decompressor.decompress(data)
+            if data:
+                return data
+        return ''
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), '')
+
+    def close(self):
+        self.finished = True
+        self.body.close()
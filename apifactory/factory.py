@@ -1,7 +1,123 @@
 """
 Factory for creating clientlibs and generic servlets.
 """
-import functools
+from collections import namedtuple
+import Queue
+import threading
+import time
+
+from apifactory import spec, strategy
+from apifactory.batching import BatchingCall
+from apifactory.metrics import instrument_call_builder
+
+
+BatchResult = namedtuple('BatchResult', 'value error')
+
+
+def build_call(api_spec, request_spec, transport):
+    """Compile an api_spec and request_spec into a function which performs
+    the request. Everything which does not change between calls (strategy
+    and transport methods) is looked up once, here, instead of on each call,
+    and optional steps are only included if the request_spec uses them.
+
+    The function accepts a `_deadline` keyword argument, the number of
+    seconds the call may take, which defaults to request_spec.deadline.
+
+    A request_spec.hedge_strategy is only used for APISpecs with an
+    idempotent method (spec.IDEMPOTENT_METHODS), which are not `stream`.
+
+    Requests which are not repeatable (see is_repeatable()) are sent once,
+    without the retry or hedge strategy.
+
+    With a request_spec.batch_spec, calls are collected into calls of the
+    bulk APISpec of the BatchSpec (see apifactory.batching).
+    """
+    if request_spec.batch_spec:
+        batch_spec = request_spec.batch_spec
+        bulk_call = build_call(batch_spec.bulk_api_spec,
+                               request_spec._replace(batch_spec=None),
+                               transport)
+        return BatchingCall(bulk_call, batch_spec)
+
+    build       = transport.build
+    send        = transport.send
+    receive     = transport.receive
+    retry       = request_spec.retry_strategy.retry
+    handle      = strategy.for_name(
+        request_spec.error_strategy, api_spec.name).handle
+
+    # A RequestSpec may be shared with APISpecs which are not idempotent,
+    # whose requests must not be sent twice, or which stream their response,
+    # where the losing response would hold its connection
+    if (request_spec.hedge_strategy and not api_spec.stream and
+            api_spec.method in spec.IDEMPOTENT_METHODS):
+        send = with_hedging(request_spec.hedge_strategy, send)
+
+    def perform(request, deadline):
+        attempt = retry if is_repeatable(request) else call_once
+        if deadline is None:
+            return attempt(lambda: handle(lambda: send(request)))
+        return attempt(
+            lambda: handle(lambda: send(request, deadline), deadline),
+            deadline)
+
+    if request_spec.concurrency_limiter:
+        perform = with_concurrency_limit(
+            request_spec.concurrency_limiter, api_spec.name, perform)
+
+    if request_spec.cache_strategy:
+        perform = with_cache(request_spec.cache_strategy, perform)
+
+    default_timeout = request_spec.deadline
+
+    def call(**request_kwargs):
+        timeout = request_kwargs.pop('_deadline', default_timeout)
+        deadline = time.time() + timeout if timeout is not None else None
+        request = build(api_spec, request_kwargs)
+        return receive(api_spec, perform(request, deadline))
+    return call
+
+
+def is_repeatable(request):
+    """Return False for a request which can only be sent once, such as an
+    http.HTTPRequest with a stream body.
+    """
+    return getattr(request, 'repeatable', True)
+
+
+def call_once(func, deadline=None):
+    """Used instead of the retry strategy for requests which are not
+    repeatable.
+    """
+    return func()
+
+
+def with_hedging(hedge_strategy, send):
+    hedge = hedge_strategy.hedge
+
+    def hedged_send(request, deadline=None):
+        if not is_repeatable(request):
+            return send(request) if deadline is None else send(request, deadline)
+        if deadline is None:
+            return hedge(lambda: send(request))
+        return hedge(lambda: send(request, deadline), deadline)
+    return hedged_send
+
+
+def with_concurrency_limit(concurrency_limiter, name, perform):
+    limit = concurrency_limiter.limit
+
+    def limited_perform(request, deadline):
+        return limit(name, lambda: perform(request, deadline))
+    return limited_perform
+
+
+def with_cache(cache_strategy, perform):
+    fetch = cache_strategy.fetch
+
+    def cached_perform(request, deadline):
+        return fetch(request, lambda: perform(request, deadline))
+    return cached_perform
 
 
 class APIClient(object):
@@ -13,34 +129,78 @@ class APIClient(object):
     Each request is wrapped in a IRetryStrategy and IErrorStrategy
     specified in the request_spec associated with the method name in
     the ClientSpec.
+
+    The methods are compiled by `call_builder` when the client is created
+    and stored as attributes of the client, so calling a method does not
+    go through __getattr__.
     """
 
-    def __init__(self, client_mapping, transport):
+    def __init__(self, client_mapping, transport, call_builder=build_call):
+        for name, (api_spec, request_spec) in client_mapping.iteritems():
+            setattr(self, name, call_builder(api_spec, request_spec, transport))
         self.client_mapping  = client_mapping
         self.transport       = transport
 
-    def __getattr__(self, item):
-        if item not in self.client_mapping:
-            raise AttributeError(item)
+    def batch(self, name, kwargs_list, concurrency=10):
+        """Call the method `name` once for each dict of kwargs in kwargs_list,
+        using up to `concurrency` threads. See call_batch().
+        """
+        return call_batch(getattr(self, name), kwargs_list, concurrency)
 
-        api_spec, request_spec = self.client_mapping[item]
-        def make_call(**request_kwargs):
-            request = self.transport.build(api_spec, request_kwargs)
-            response = request_spec.retry_strategy.retry(
-                functools.partial(request_spec.error_strategy.handle,
-                    functools.partial(self.transport.send, request)))
-            return self.transport.receive(api_spec, response)
 
-        return make_call
+def call_batch(func, kwargs_list, concurrency=10):
+    """Call func(**kwargs) for each kwargs in kwargs_list using a pool of up
+    to `concurrency` worker threads.
+
+    Returns a list of BatchResult in the same order as kwargs_list. An
+    exception raised by a call is returned as the `error` of its result
+    instead of being raised, so one failure does not lose the other results.
+    """
+    queue = Queue.Queue()
+    for item in enumerate(kwargs_list):
+        queue.put(item)
+    results = [None] * queue.qsize()
 
+    def worker():
+        while True:
+            try:
+                index, kwargs = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = BatchResult(func(**kwargs), None)
+            except Exception, e:
+                results[index] = BatchResult(None, e)
 
-def build_client(client_mapping, transport):
+    workers = [threading.Thread(target=worker)
+               for _ in xrange(min(concurrency, len(results)) - 1)]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    # The calling thread works through the queue as well
+    worker()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+def build_client(client_mapping, transport, call_builder=build_call,
+                 metrics=None):
     """
     param client_mapping: specification used to construct a client
     type client_mapping: a dict of string to ClientSpec objects
 
     param transport: transport class used to communicate with the server
     type transport: ITransport
+
+    param call_builder: function which compiles an (api_spec, request_spec,
+        transport) into a client method
+
+    param metrics: records latency, retries, errors and calls in flight for
+        each APISpec (see apifactory.metrics)
+    type metrics: IMetrics
     """
-    client = APIClient(client_mapping, transport)
+    if metrics is not None:
+        call_builder = instrument_call_builder(call_builder, metrics)
+    client = APIClient(client_mapping, transport, call_builder)
     return client
@@ -1,25 +1,48 @@
-import colander
+"""
+Http clients, transports and schemas.
+
+Heavier optional dependencies are imported when they are first used, so that
+importing this module stays cheap for short lived processes: colander by
+HttpMetaSchema, requests by HTTPTransport.send(), and json by
+iter_json_list(). httplib and urlparse are already imported by urllib and
+apifactory.pool.
+"""
 from collections import namedtuple
 import httplib
 import functools
 import itertools
+import re
+import socket
+import sys
+import threading
+import time
 import urllib
+import urlparse
 
-try:
-    import requests
-except ImportError:
-    requests = None
+from apifactory import strategy, spec, compat, pool, cache
+from apifactory.codec import get_codec
+from apifactory.compat import is_future
+from apifactory.compression import (
+    DecompressingBody, get_accept_encoding, get_decompressor)
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
 
-import urlparse
-from apifactory import strategy, spec, compat
+class HTTPRequest(namedtuple('HTTPRequest',
+        'path method query data headers stream codec compression')):
+    __slots__ = ()
+
+    @property
+    def repeatable(self):
+        """False if the body is a stream body, which is read as it is sent
+        and so can only be sent once. Calls of a request which is not
+        repeatable are not retried or hedged (see factory.build_call).
+        """
+        return not is_stream_body(self.data)
 
+HTTPRequest.__new__.__defaults__ = (False, None, None)
 
-HTTPRequest = namedtuple('HTTPRequest', 'path method query data headers')
+HTTPResponse = namedtuple('HTTPResponse', 'status_code headers body')
+
+IDEMPOTENT_METHODS = spec.IDEMPOTENT_METHODS
 
 class HTTPNotFound(strategy.ClientError):
     """404"""
@@ -39,15 +62,71 @@ def build_http_request(api_spec, request_data):
                        api_spec.method,
                        request_data.get('query'),
                        request_data.get('body'),
-                       request_data.get('headers'))
+                       request_data.get('headers'),
+                       api_spec.stream,
+                       api_spec.codec,
+                       api_spec.compression)
+
+
+def freeze_params(params):
+    """Return a hashable, order independent, version of a dict of query
+    params.
+    """
+    if not params:
+        return None
+    return frozenset(
+        (key, tuple(value) if isinstance(value, list) else value)
+        for key, value in params.iteritems())
+
+
+def build_request_key(http_request):
+    """Return a hashable key which identifies a GET HTTPRequest by its path,
+    method and query. Returns None for any other method, so that only
+    idempotent GET requests are cached, and for streamed responses.
+    """
+    if http_request.method != 'GET' or http_request.stream:
+        return None
+    return (http_request.path,
+            http_request.method,
+            freeze_params(http_request.query))
+
+
+def build_flight_key(http_request):
+    """Return a hashable key for an HTTPRequest with an idempotent method.
+    Requests with equal keys are equal. Returns None if the request is not
+    idempotent, its response is streamed, or the key can not be hashed.
+    """
+    if http_request.method not in IDEMPOTENT_METHODS or http_request.stream:
+        return None
+    data = http_request.data
+    try:
+        key = (http_request.path,
+               http_request.method,
+               freeze_params(http_request.query),
+               freeze_params(data) if isinstance(data, dict) else data,
+               freeze_params(http_request.headers))
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 
 class HTTPTransport(object):
-    """Simple synchronous HTTP transport using requests library."""
+    """Simple synchronous HTTP transport using requests library.
+
+    param codec: the ICodec (or name of a registered codec) used to encode
+        request bodies and decode response bodies, unless the APISpec has a
+        codec. Without a codec request bodies are sent as form data, and
+        responses are passed to the response schema as they are.
+    param compression: the compression.Compression for request bodies,
+        unless the APISpec has one. Responses are always decompressed.
+    """
 
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
+    def __init__(self, host, port, codec=None, compression=None):
+        self.host           = host
+        self.port           = port
+        self.codec          = codec
+        self.compression    = compression
 
     build = staticmethod(build_http_request)
 
@@ -55,26 +134,477 @@ class HTTPTransport(object):
         parts = 'http', '%s:%s' % (self.host, self.port), path, None, None, None
         return urlparse.urlunparse(parts)
 
-    def send(self, http_request):
-        return requests.request(
-            http_request.method,
-            self.build_url(http_request.path),
-            params=http_request.query,
-            data=http_request.data,
-            headers=http_request.headers)
+    def build_path(self, http_request):
+        path = '/' + http_request.path.lstrip('/')
+        if http_request.query:
+            path += '?' + urllib.urlencode(http_request.query, doseq=True)
+        return path
+
+    def get_codec(self, codec):
+        """Return the ICodec for a request or APISpec codec, which defaults to
+        the codec of the transport. Returns None if neither has one.
+        """
+        codec = codec or self.codec
+        return codec and get_codec(codec)
+
+    def encode(self, http_request):
+        """Return a tuple of (body, headers) for an HTTPRequest. The body is
+        encoded with the codec, or as form data, and compressed if the
+        request or transport has a compression.
+        """
+        codec = self.get_codec(http_request.codec)
+        if codec:
+            body, headers = encode_body(
+                http_request.data, http_request.headers, codec)
+            headers = dict(headers or {})
+        else:
+            body, content_type = encode_form_data(http_request.data)
+            headers = dict(http_request.headers or {})
+            if content_type:
+                headers.setdefault('Content-Type', content_type)
+        compression = http_request.compression or self.compression
+        if compression:
+            body, headers = compression.compress(body, headers)
+        return body, headers
+
+    def send(self, http_request, deadline=None):
+        kwargs = {}
+        if deadline is not None:
+            kwargs['timeout'] = strategy.remaining(deadline)
+        if http_request.stream:
+            kwargs['stream'] = True
+        data, headers = self.encode(http_request)
+        import requests
+        try:
+            return requests.request(
+                http_request.method,
+                self.build_url(http_request.path),
+                params=http_request.query,
+                data=data,
+                headers=headers,
+                **kwargs)
+        except requests.Timeout:
+            raise strategy.DeadlineExceeded()
 
     def receive(self, api_spec, response):
+        codec = self.get_codec(api_spec.codec)
+        if codec and not api_spec.stream:
+            response = JsonHttpResponse(response, codec)
         return api_spec.response_schema.deserialize(response)
 
 
+def is_stream_body(data):
+    """Return True for a request body which is read as it is sent: a file
+    object, or an iterator (such as a generator) of encoded chunks.
+    """
+    return hasattr(data, 'read') or (
+        hasattr(data, '__iter__') and hasattr(data, 'next'))
+
+
+def is_raw_body(data):
+    """Return True for a request body which is already encoded, and is sent
+    unchanged: a str, bytearray, buffer or memoryview, or a stream body.
+    """
+    return (isinstance(data, (str, bytearray, buffer, memoryview)) or
+            is_stream_body(data))
+
+
+def iter_body_chunks(body, chunk_size=64 * 1024):
+    """Return an iterator of the chunks of a stream body."""
+    if hasattr(body, 'read'):
+        return iter(lambda: body.read(chunk_size), '')
+    return body
+
+
+def encode_body(data, headers, codec):
+    """Encode a request body with codec, and set its Content-Type. Returns a
+    tuple of (data, headers), which are unchanged if there is no codec or
+    body, or the body is a raw body which is already encoded.
+    """
+    if codec is None or data is None or is_raw_body(data):
+        return data, headers
+    headers = dict(headers or {})
+    headers.setdefault('Content-Type', codec.content_type)
+    return codec.encode(data), headers
+
+
+def encode_form_data(data):
+    """Encode a dict request body as form data, the same way requests does.
+    Returns a tuple of (body, content_type).
+    """
+    if isinstance(data, dict):
+        return (urllib.urlencode(data, doseq=True),
+                'application/x-www-form-urlencoded')
+    return data, None
+
+
+class PooledHTTPTransport(HTTPTransport):
+    """Synchronous HTTP transport which reuses persistent (keep-alive)
+    connections from a pool.ConnectionPool.  Unless a pool is given, the
+    process wide pool from pool.get_default_pool() is used, so the connections
+    are shared by all clients using this transport.
+
+    Returns HTTPResponse objects. The body of a successful response to a
+    `stream` request is a StreamingBody. Compressed response bodies are
+    decompressed, a streamed body as it is read.
+    """
+
+    accept_encoding = get_accept_encoding()
+
+    def __init__(self, host, port, connection_pool=None, pool_timeout=None,
+                 codec=None, compression=None):
+        super(PooledHTTPTransport, self).__init__(
+            host, port, codec, compression)
+        self.pool = connection_pool or pool.get_default_pool()
+        self.pool_timeout = pool_timeout
+
+    def send(self, http_request, deadline=None):
+        path = self.build_path(http_request)
+        body, headers = self.encode(http_request)
+        headers.setdefault('Accept-Encoding', self.accept_encoding)
+        request = http_request.method, path, body, headers
+        stream = http_request.stream
+
+        conn = self.acquire(deadline)
+        reused = conn.sock is not None
+        try:
+            return self._send_before_deadline(conn, request, stream, deadline)
+        except (socket.error, httplib.HTTPException):
+            # A reused connection may have been closed by the server while it
+            # was idle. Idempotent requests are retried once on a new
+            # connection, unless their body has already been (partly) read.
+            if (not reused or http_request.method not in IDEMPOTENT_METHODS
+                    or is_stream_body(body)):
+                raise
+        conn = self.acquire(deadline)
+        conn.close()
+        return self._send_before_deadline(conn, request, stream, deadline)
+
+    def _send_before_deadline(self, conn, request, stream, deadline):
+        try:
+            return self._send(conn, request, stream, deadline)
+        except socket.timeout:
+            raise strategy.DeadlineExceeded()
+
+    def acquire(self, deadline):
+        timeout = strategy.remaining(deadline)
+        if self.pool_timeout is not None and (
+                timeout is None or timeout > self.pool_timeout):
+            timeout = self.pool_timeout
+        try:
+            return self.pool.acquire(self.host, self.port, timeout)
+        except pool.PoolTimeout:
+            if deadline is not None and time.time() >= deadline:
+                raise strategy.DeadlineExceeded()
+            raise
+
+    def _send(self, conn, request, stream, deadline):
+        # The timeout applies to each socket operation, so it is reset to
+        # the time remaining before each step of the request.
+        def set_timeout():
+            timeout = strategy.remaining(deadline)
+            if timeout is None:
+                timeout = socket.getdefaulttimeout()
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+
+        try:
+            set_timeout()
+            send_request(conn, *request)
+            set_timeout()
+            response = conn.getresponse()
+            headers = dict(response.getheaders())
+            decompressor = pop_decompressor(headers)
+            if stream and response.status == httplib.OK:
+                body = StreamingBody(response, functools.partial(
+                    self._finish, conn, response))
+                if decompressor:
+                    body = DecompressingBody(body, decompressor)
+                return HTTPResponse(response.status, headers, body)
+            set_timeout()
+            content = response.read()
+        except:
+            self.pool.discard(self.host, self.port, conn)
+            raise
+
+        self._finish(conn, response, True)
+        if decompressor:
+            content = decompressor.decompress(content) + decompressor.flush()
+        return HTTPResponse(response.status, headers, content)
+
+    def _finish(self, conn, response, complete):
+        """Return the connection to the pool once the response is complete."""
+        if complete and not response.will_close:
+            self.pool.release(self.host, self.port, conn)
+        else:
+            self.pool.discard(self.host, self.port, conn)
+
+
+def pop_decompressor(headers):
+    """Return a decompressor for the content-encoding of the (lower case)
+    response headers, or None if it is not supported. When there is one, the
+    content-encoding and content-length are removed from headers, because
+    they do not describe the decompressed body.
+    """
+    decompressor = get_decompressor(headers.get('content-encoding'))
+    if decompressor:
+        headers.pop('content-encoding')
+        headers.pop('content-length', None)
+    return decompressor
+
+
+def send_request(conn, method, path, body, headers):
+    """Send a request on an httplib connection. A body which is a file
+    object or an iterator is sent with chunked transfer encoding as it is
+    read, anything else with a Content-Length.
+    """
+    if not is_stream_body(body):
+        conn.request(method, path, body, headers)
+        return
+
+    names = set(name.lower() for name in headers)
+    conn.putrequest(method, path,
+                    skip_host='host' in names,
+                    skip_accept_encoding='accept-encoding' in names)
+    for name, value in headers.iteritems():
+        conn.putheader(name, value)
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    # The chunk framing is written separately from each chunk, so that the
+    # chunks are not copied. Without TCP_NODELAY these small writes would
+    # wait for the server to acknowledge the previous chunk.
+    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for chunk in iter_body_chunks(body):
+        if len(chunk):
+            conn.send('%x\r\n' % len(chunk))
+            conn.send(chunk)
+            conn.send('\r\n')
+    conn.send('0\r\n\r\n')
+
+
+class StreamingBody(object):
+    """The body of a response which is read as it is consumed, instead of
+    being read into memory by the transport. Iterating returns chunks of the
+    body.
+
+    `on_finish` is called once, with True when the body has been read
+    completely, or with False if it is closed (or fails) before then. Read
+    the whole body or call close() so that the connection can be released.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, response, on_finish):
+        self.response   = response
+        self.on_finish  = on_finish
+        self.finished   = False
+
+    def read(self, size=None):
+        if self.finished:
+            return ''
+        try:
+            data = self.response.read(size) if size else self.response.read()
+        except:
+            self._finish(False)
+            raise
+        if not data or self.response.isclosed():
+            self._finish(True)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), '')
+
+    def close(self):
+        if not self.finished:
+            self._finish(False)
+
+    def _finish(self, complete):
+        self.finished = True
+        self.on_finish(complete)
+
+
+SingleFlightStats = namedtuple('SingleFlightStats', 'calls collapsed')
+
+
+class _Flight(object):
+    """A request which is in flight, and its result once it has completed."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.exc_info = None
+
+    def wait(self, deadline=None):
+        if not self.done.wait(strategy.remaining(deadline)):
+            raise strategy.DeadlineExceeded()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.response
+
+
+class SingleFlightTransport(object):
+    """Wrap an ITransport so that concurrent identical requests share a
+    single call to the wrapped transport's send(). The first caller sends the
+    request, callers which arrive while it is in flight wait for and receive
+    the same response (or exception). A caller which is waiting stops
+    waiting at its own deadline.
+
+    param transport: the wrapped ITransport
+    param key_func: function which returns a hashable key for a request, or
+        None if the request should always be sent
+    """
+
+    def __init__(self, transport, key_func=build_flight_key):
+        self.transport  = transport
+        self.key_func   = key_func
+        self.lock       = threading.Lock()
+        self.in_flight  = {}
+        self._calls     = 0
+        self._collapsed = 0
+
+    def send(self, request, deadline=None):
+        args = (request,) if deadline is None else (request, deadline)
+        key = self.key_func(request)
+        if key is None:
+            return self.transport.send(*args)
+
+        with self.lock:
+            self._calls += 1
+            flight = self.in_flight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.in_flight[key] = _Flight()
+            else:
+                self._collapsed += 1
+
+        if not is_leader:
+            return flight.wait(deadline)
+        return self._send(key, flight, args)
+
+    def _send(self, key, flight, args):
+        try:
+            flight.response = self.transport.send(*args)
+            return flight.response
+        except:
+            # Also BaseExceptions (such as a gevent Timeout), so that waiting
+            # callers never receive a None response
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight.done.set()
+
+    @property
+    def stats(self):
+        with self.lock:
+            return SingleFlightStats(self._calls, self._collapsed)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+def is_available(error_strategy, response):
+    """Return False if error_strategy rejects a response with
+    ServiceNotAvailable. Other errors are not the fault of the service.
+    """
+    try:
+        error_strategy.handle(lambda: response)
+    except strategy.ServiceNotAvailable:
+        return False
+    except Exception:
+        pass
+    return True
+
+
+def send_checked(transport, request, deadline, error_strategy, finish):
+    """Send a request with transport, and call finish(available) once the
+    response has arrived (when its Future completes, for a transport which
+    returns Futures). `available` is False if the send failed, or if
+    is_available() is False for the response. Returns the response.
+    """
+    try:
+        if deadline is None:
+            response = transport.send(request)
+        else:
+            response = transport.send(request, deadline)
+    except:
+        finish(False)
+        raise
+
+    if is_future(response):
+        response.add_done_callback(lambda future: finish(
+            future.exception() is None and
+            is_available(error_strategy, future.result())))
+    else:
+        finish(is_available(error_strategy, response))
+    return response
+
+
+class LimitedRequest(object):
+    """A request built by a ConcurrencyLimitedTransport, which remembers the
+    name of its APISpec.
+    """
+
+    def __init__(self, request, name):
+        self.request    = request
+        self.name       = name
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+
+class ConcurrencyLimitedTransport(object):
+    """Wrap an ITransport so that each send() is limited by an
+    IConcurrencyLimiter, such as a strategy.AdaptiveConcurrencyLimiter, for
+    the APISpec name of the request. Unlike the `concurrency_limiter` of a
+    RequestSpec, which limits whole calls, each attempt is limited. An
+    attempt whose response the error strategy rejects with
+    ServiceNotAvailable is counted as dropped.
+
+    param transport: the wrapped ITransport
+    param concurrency_limiter: a strategy.AdaptiveConcurrencyLimiter (it
+        must have acquire() and release() methods)
+    param error_strategy: an IErrorStrategy used to check responses,
+        defaults to HTTPErrorStrategy
+    """
+
+    def __init__(self, transport, concurrency_limiter, error_strategy=None):
+        self.transport              = transport
+        self.concurrency_limiter    = concurrency_limiter
+        self.error_strategy         = error_strategy or HTTPErrorStrategy()
+
+    def build(self, api_spec, request_data):
+        return LimitedRequest(
+            self.transport.build(api_spec, request_data), api_spec.name)
+
+    def send(self, request, deadline=None):
+        limiter = self.concurrency_limiter
+        name = request.name
+        start = limiter.acquire(name)
+        return send_checked(
+            self.transport, request.request, deadline, self.error_strategy,
+            lambda available: limiter.release(name, start, not available))
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
 class HTTPErrorStrategy(object):
+    """Raise an error for a response which does not have a 200 status.
+
+    param status_code_attr: the attribute of a response which is its status
+        code. Defaults to `status_code` (HTTPResponse and requests) or, if a
+        response has no such attribute, `code` (tornado)
+    """
 
-    def __init__(self, status_code_attr='status_code'):
+    def __init__(self, status_code_attr=None):
         self.status_code_attr = status_code_attr
 
-    def handle(self, func):
+    def handle(self, func, deadline=None):
         response = func()
-        status_code = getattr(response, self.status_code_attr)
+        status_code = self.get_status_code(response)
         if status_code == httplib.OK:
             return response
         if status_code == httplib.NOT_FOUND:
@@ -83,32 +613,98 @@ class HTTPErrorStrategy(object):
             raise HTTPBadRequest(response.body)
         raise strategy.ServiceNotAvailable()
 
+    def get_status_code(self, response):
+        if self.status_code_attr:
+            return getattr(response, self.status_code_attr)
+        return getattr(response, 'status_code', getattr(response, 'code', None))
+
 
 class HTTPRetryStrategy(object):
+    """Retry a request when it fails with ServiceNotAvailable.
+
+    param retry_count: maximum number of attempts
+    param backoff: object with a delay(attempt) method (such as a
+        strategy.ExponentialBackoff) which returns the seconds to wait before
+        each retry. Defaults to retrying immediately.
+    param deadline: seconds from the start of a call after which no more
+        retries are attempted. Retries also stop at the deadline of the call.
+    param budget: a strategy.RetryBudget which limits the number of retries
+    """
 
-    def __init__(self, retry_count=3):
-        self.retry_count = retry_count
+    def __init__(self, retry_count=3, backoff=None, deadline=None, budget=None):
+        self.retry_count    = retry_count
+        self.backoff        = backoff
+        self.deadline       = deadline
+        self.budget         = budget
 
-    def retry(self, func):
-        for _ in xrange(self.retry_count):
+    def retry(self, func, deadline=None):
+        deadline = self.start(deadline)
+        for attempt in itertools.count():
             try:
                 return func()
             except strategy.ServiceNotAvailable:
-                continue
-        raise
+                delay = self.next_delay(attempt, deadline)
+                if delay is None:
+                    raise
+            if delay:
+                time.sleep(delay)
+
+    def start(self, deadline=None):
+        """Called at the start of each call with the deadline of the call.
+        Returns the deadline for retries, the earlier of the call deadline and
+        the deadline of this strategy.
+        """
+        if self.budget:
+            self.budget.deposit()
+        if not self.deadline:
+            return deadline
+        own_deadline = time.time() + self.deadline
+        return own_deadline if deadline is None else min(deadline, own_deadline)
+
+    def next_delay(self, attempt, deadline):
+        """Return the seconds to wait before retrying after `attempt` failed,
+        or None if the request should not be retried.
+        """
+        if attempt >= self.retry_count - 1:
+            return None
+        delay = self.backoff.delay(attempt) if self.backoff else 0
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        if self.budget and not self.budget.withdraw():
+            return None
+        return delay
 
 
 DEFAULT_GET = spec.RequestSpec(HTTPRetryStrategy(), HTTPErrorStrategy())
 
 
-def GET(name, request_schema, response_schema):
-    """Factory method for creating APISpecs with the GET method."""
-    return spec.APISpec(name, 'GET', request_schema, response_schema)
+def build_cache_strategy(response_cache, ttl):
+    """Create a CacheStrategy for GET requests which stores responses in
+    response_cache (an ICache) for `ttl` seconds.
+    """
+    return cache.CacheStrategy(response_cache, ttl, build_request_key)
+
+
+def GET(name, request_schema, response_schema, stream=False, codec=None,
+        compression=None):
+    """Factory method for creating APISpecs with the GET method. With
+    `stream`, the response body is not read by the transport; use a
+    streaming response schema such as JsonStreamSchema. `codec` is the name
+    of a registered codec (or an ICodec) for the response body.
+    `compression` is used by a servlet to compress the response body.
+    """
+    return spec.APISpec(name, 'GET', request_schema, response_schema,
+                        stream, codec, compression)
 
 
-def POST(name, request_schema, response_schema):
-    """Factory method for creating APISpecs with the POST method."""
-    return spec.APISpec(name, 'POST', request_schema, response_schema)
+def POST(name, request_schema, response_schema, codec=None, compression=None):
+    """Factory method for creating APISpecs with the POST method. `codec` is
+    the name of a registered codec (or an ICodec) for the request and
+    response bodies. `compression` (a compression.Compression) compresses
+    request bodies above its size threshold.
+    """
+    return spec.APISpec(name, 'POST', request_schema, response_schema,
+                        False, codec, compression)
 
 
 class Async(object):
@@ -118,24 +714,29 @@ class Async(object):
     def __init__(self, wrapped):
         self.wrapped = wrapped
 
+    def for_name(self, name):
+        return Async(strategy.for_name(self.wrapped, name))
+
     def __getattr__(self, item):
         if not hasattr(self.wrapped, item):
             raise AttributeError(item)
 
-        def make_call(func):
+        def make_call(func, *args):
             resp_future = func()
             def future_wrapper(timeout=None):
                 func = functools.partial(resp_future, timeout=timeout)
-                return getattr(self.wrapped, item)(func)
+                return getattr(self.wrapped, item)(func, *args)
             return future_wrapper
         return make_call
 
 
 def make_async(request_spec):
-    """Convert a RequestSpec to use async strategies."""
-    return spec.RequestSpec(
-        Async(request_spec.retry_strategy),
-        Async(request_spec.error_strategy))
+    """Convert a RequestSpec to use async strategies. The other fields of
+    the RequestSpec are kept.
+    """
+    return request_spec._replace(
+        retry_strategy=Async(request_spec.retry_strategy),
+        error_strategy=Async(request_spec.error_strategy))
 
 
 def build_map_from_keys(source, keys):
@@ -157,6 +758,15 @@ def get_colander_keys(schema):
     return [node.name for node in schema.children]
 
 
+def build_key_to_field(field_to_keys):
+    """Invert a mapping of field to keys into a mapping of key to field.
+    Used to route request data to the schema for each field.
+    """
+    return dict((key, field)
+                for field, keys in field_to_keys.iteritems()
+                for key in keys)
+
+
 def filter_optional(output, optional_sentinel):
     """Filter a dictionary by removing items with value of 'optional_sentinel'.
     Returns a iterable of pairs.
@@ -177,17 +787,30 @@ class HttpMetaSchema(object):
     def __init__(self, field_to_key_mapper=get_colander_keys, **schemas):
         self.schemas = schemas
         self.field_to_key_mapper = field_to_key_mapper
-        self.verify_schema_uniqueness()
+        self.null = compat.get_null()
+        field_to_keys = self._get_field_to_keys()
+        self.verify_schema_uniqueness(field_to_keys)
+        self._key_to_field = build_key_to_field(field_to_keys)
 
     def serialize(self, request_data):
         """Accepts a blob dict, and returns a dict of fields."""
-        def get_values(field, keys):
-            source = build_map_from_keys(request_data, keys)
-            value = self.schemas[field].serialize(source)
-            return field, dict(filter_optional(value, colander.null))
-
-        seq = (get_values(*item) for item in self._get_field_to_keys().iteritems())
-        return filter_dict(seq)
+        key_to_field = self._key_to_field
+        sources = dict((field, {}) for field in self.schemas)
+        for key, value in request_data.iteritems():
+            field = key_to_field.get(key)
+            if field is not None:
+                sources[field][key] = value
+
+        return dict(
+            (field, self._serialize_field(schema, sources[field]))
+            for field, schema in self.schemas.iteritems())
+
+    def _serialize_field(self, schema, values):
+        value = schema.serialize(values)
+        # A raw body (see schemas.RawBodySchema) is passed on unchanged
+        if value is None or is_raw_body(value):
+            return value
+        return dict(filter_optional(value, self.null))
 
     # TODO: maybe make this take a dict of fields as well?
     def deserialize(self, response):
@@ -202,8 +825,8 @@ class HttpMetaSchema(object):
         return dict((field, self.field_to_key_mapper(schema))
                     for field, schema in self.schemas.iteritems())
 
-    def verify_schema_uniqueness(self):
-        field_to_keys = self._get_field_to_keys()
+    def verify_schema_uniqueness(self, field_to_keys=None):
+        field_to_keys = field_to_keys or self._get_field_to_keys()
         for left, right in itertools.combinations(field_to_keys.itervalues(), 2):
             if set(left) & set(right):
                 msg = "Schemas have overlapping keys: %s"
@@ -215,14 +838,20 @@ class JsonHttpRequest(object):
     dict to the proper format. Some http clients (requests) will do this
     for you. Others (tornado) will not.  This is to be used with the tornado
     brand of requests.
+
+    The data is encoded with codec, which defaults to the 'json' codec.
     """
 
-    def __init__(self, request):
+    def __init__(self, request, codec=None):
         self.request = request
+        self.codec = get_codec(codec or 'json')
 
     @property
     def data(self):
-        return json.dumps(self.request.data) if self.request.data else None
+        data = self.request.data
+        if not data or is_raw_body(data):
+            return data or None
+        return self.codec.encode(data)
 
     @property
     def query(self):
@@ -233,15 +862,160 @@ class JsonHttpRequest(object):
 
 
 class JsonHttpResponse(object):
-    """A thin adapter over HttpResponse to convert body to a dict.
+    """A thin adapter over HttpResponse to convert body to a dict. The body
+    is decoded with codec (the 'json' codec by default) the first time it is
+    accessed. The body of a requests response is its `content`.
+
+    For large responses which are a json list, iter_items() decodes the
+    items one at a time as the response is read, instead of reading the
+    whole body.
     """
 
-    def __init__(self, response):
+    _not_decoded = object()
+
+    def __init__(self, response, codec=None):
         self.response = response
+        self.codec = get_codec(codec or 'json')
+        self._body = self._not_decoded
 
     @property
     def body(self):
-        return json.loads(self.response.body)
+        if self._body is self._not_decoded:
+            self._body = self.codec.decode(get_body(self.response))
+        return self._body
+
+    def iter_items(self, chunk_size=64 * 1024):
+        """Return an iterator of the items of a json list body. The response
+        is closed when the iterator is exhausted, fails, or is abandoned.
+        """
+        chunks = iter_response_chunks(self.response, chunk_size)
+        try:
+            for item in iter_json_list(chunks):
+                yield item
+            # Read anything after the end of the list (whitespace), so that
+            # the connection is complete and can be reused.
+            for _ in chunks:
+                pass
+        finally:
+            close_response(self.response)
 
     def __getattr__(self, name):
-        return getattr(self.response, name)
\ No newline at end of file
+        return getattr(self.response, name)
+
+
+def get_body(response):
+    try:
+        return response.body
+    except AttributeError:
+        return response.content
+
+
+def close_response(response):
+    """Close a response, or its body if it is file like."""
+    body = getattr(response, 'body', response)
+    if hasattr(body, 'close'):
+        body.close()
+
+
+def iter_response_chunks(response, chunk_size):
+    """Return an iterator of the chunks of a response body. Supports requests
+    responses (iter_content), file like responses (read) and responses with
+    a body attribute, which may be a file like StreamingBody.
+    """
+    if hasattr(response, 'iter_content'):
+        return response.iter_content(chunk_size)
+    body = response if hasattr(response, 'read') else response.body
+    if hasattr(body, 'read'):
+        return iter(lambda: body.read(chunk_size), '')
+    return iter([body])
+
+
+class JsonStreamSchema(object):
+    """A response schema for `stream` APISpecs whose body is a json list.
+    deserialize() returns a generator which decodes the items as the body is
+    read, and deserializes each one with item_schema (if one is given). The
+    response is closed once the generator is exhausted or abandoned.
+    """
+
+    def __init__(self, item_schema=None, chunk_size=64 * 1024):
+        self.item_schema = item_schema
+        self.chunk_size = chunk_size
+
+    def serialize(self, items):
+        return list(items)
+
+    def deserialize(self, response):
+        items = JsonHttpResponse(response).iter_items(self.chunk_size)
+        if self.item_schema is None:
+            return items
+        return itertools.imap(self.item_schema.deserialize, items)
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_list(chunks):
+    """Decode a json list from an iterable of string chunks, and yield each
+    item as soon as it has been read. Only the unread part of the current
+    chunk and the current item are kept in memory.
+
+    Raises ValueError if the chunks are not a valid json list.
+    """
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos = '', 0
+    expect = '['
+
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+        if pos == len(buf):
+            buf, pos = read_more(chunks, buf, pos), 0
+            continue
+
+        char = buf[pos]
+        if expect == '[':
+            if char != '[':
+                raise ValueError("Expected a json list")
+            pos, expect = pos + 1, 'first'
+            continue
+        if expect in ('first', ',') and char == ']':
+            return
+        if expect == ',':
+            if char != ',':
+                raise ValueError("Expected , or ] at %r" % buf[pos:pos + 20])
+            pos, expect = pos + 1, 'item'
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # The item may be incomplete (for example a number which continues
+        # in the next chunk) unless it is followed by a delimiter.
+        if end is None or end == len(buf) or buf[end] not in ' \t\n\r,]':
+            buf, pos = read_more(chunks, buf, pos), 0
+            continue
+        yield item
+        pos, expect = end, ','
+
+
+def read_more(chunks, buf, pos):
+    """Return the unread part of buf joined with the next chunks, read until
+    its length has at least doubled (or the chunks end). An item which spans
+    many chunks is then only decoded a logarithmic number of times.
+    """
+    unread = buf[pos:]
+    parts, size = [unread], len(unread)
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > len(unread) and size >= 2 * len(unread):
+            return ''.join(parts)
+    if size > len(unread):
+        return ''.join(parts)
+    raise ValueError("Unexpected end of json list")
\ No newline at end of file
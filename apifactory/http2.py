@@ -0,0 +1,393 @@
+"""
+HTTP/2 transport which multiplexes many concurrent requests over a few
+connections to each host.
+
+HTTP2Transport.send() returns a ResponseFuture as soon as the request has
+been written, so a single thread can have many requests in flight without a
+connection for each of them. Responses are read by a thread for each
+connection. The futures follow the contract of http.Async: they are called
+with an optional `timeout` and return the response. Build a client with:
+
+    transport = HTTP2Transport(host, port)
+    client = factory.build_client(
+        {'search': spec.ClientSpec(api_search, http.make_async(http.DEFAULT_GET))},
+        transport)
+    response = client.search(q='stars')(timeout=3)
+
+Connections use HTTP/2 with prior knowledge (h2c, without TLS or an upgrade
+request), so the server must accept HTTP/2 on the port. Requires the h2
+package.
+"""
+import logging
+import socket
+import sys
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.errors
+import h2.events
+
+from apifactory import http, strategy
+from apifactory.compression import get_accept_encoding
+
+
+log = logging.getLogger(__name__)
+
+
+class ResponseFuture(object):
+    """The result of a request which has been sent. Calling the future
+    waits for, and returns, the http.HTTPResponse, or raises the error of
+    the request. Waiting longer than `timeout`, or past the deadline of the
+    request, raises DeadlineExceeded and cancels the request.
+    """
+
+    def __init__(self, deadline=None, on_timeout=None):
+        self.deadline       = deadline
+        self.on_timeout     = on_timeout
+        self.lock           = threading.Lock()
+        self.finished       = threading.Event()
+        self.callbacks      = []
+        self.response       = None
+        self.exc_info       = None
+
+    def set_result(self, response):
+        self._finish(response, None)
+
+    def set_exception(self, exc_info):
+        """Fail the request with a sys.exc_info() tuple."""
+        self._finish(None, exc_info)
+
+    def _finish(self, response, exc_info):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.response = response
+            self.exc_info = exc_info
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        # Callbacks run on the reader thread of the connection, where an
+        # error would fail every other request on the connection
+        try:
+            callback(self)
+        except Exception:
+            log.exception("Error in done callback of %r", self)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def wait(self, timeout=None):
+        """Wait up to `timeout` seconds, and no later than the deadline,
+        for the request to finish. A request which has not finished by then
+        fails with DeadlineExceeded. Never raises.
+        """
+        if self.finished.is_set():
+            return
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.time(), 0)
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        if not self.finished.wait(timeout):
+            if self.on_timeout:
+                try:
+                    self.on_timeout()
+                except Exception:
+                    log.exception("Error cancelling %r", self)
+            self.set_exception(
+                (strategy.DeadlineExceeded, strategy.DeadlineExceeded(), None))
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.response
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        return self.exc_info and self.exc_info[1]
+
+    __call__ = result
+
+
+def build_error(error_type, *args):
+    """Return an exc_info tuple for an error which was not raised."""
+    return error_type, error_type(*args), None
+
+
+class Stream(object):
+    """The state of one request on a connection."""
+
+    def __init__(self, future, headers, body):
+        self.future             = future
+        self.request_headers    = headers
+        self.outbound           = body or ''
+        self.headers            = None
+        self.chunks             = []
+
+    def build_response(self):
+        headers = dict((name, value) for name, value in self.headers
+                       if not name.startswith(':'))
+        body = ''.join(self.chunks)
+        decompressor = http.pop_decompressor(headers)
+        if decompressor:
+            body = decompressor.decompress(body) + decompressor.flush()
+        return http.HTTPResponse(
+            int(dict(self.headers)[':status']), headers, body)
+
+
+class HTTP2Connection(object):
+    """A client HTTP/2 connection. Requests are submitted from any thread,
+    responses are read by a background thread which completes their futures.
+    Requests over the concurrent stream limit of the server wait for a
+    stream to finish.
+    """
+
+    read_size = 64 * 1024
+
+    def __init__(self, host, port, connect_timeout=None):
+        self.authority          = '%s:%s' % (host, port)
+        self.lock               = threading.Lock()
+        self.streams            = {}
+        self.pending            = []
+        self.closed             = False
+        self.settings_received  = threading.Event()
+        self.conn               = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=True, header_encoding=None))
+
+        self.sock = socket.create_connection((host, port), connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(None)
+        with self.lock:
+            self.conn.initiate_connection()
+            self._flush()
+        self.reader = threading.Thread(target=self._read_loop)
+        self.reader.daemon = True
+        self.reader.start()
+        # Wait for the settings of the server, so that its limit on
+        # concurrent streams is known before the first request
+        self.settings_received.wait(connect_timeout)
+
+    @property
+    def active(self):
+        """The number of requests in flight, or waiting for a stream."""
+        return len(self.streams) + len(self.pending)
+
+    def submit(self, method, path, headers, body, future):
+        request_headers = [
+            (':method', method),
+            (':scheme', 'http'),
+            (':authority', self.authority),
+            (':path', path),
+        ]
+        request_headers.extend(
+            (str(name).lower(), str(value)) for name, value in headers.iteritems())
+        if body:
+            request_headers.append(('content-length', str(len(body))))
+
+        with self.lock:
+            if self.closed:
+                raise strategy.ServiceNotAvailable("Connection closed")
+            self.pending.append(Stream(future, request_headers, body))
+            self._start_pending()
+            self._flush()
+
+    def cancel(self, future):
+        """Reset the stream of a request which is no longer wanted."""
+        with self.lock:
+            self.pending = [stream for stream in self.pending
+                            if stream.future is not future]
+            for stream_id, stream in self.streams.items():
+                if stream.future is future:
+                    del self.streams[stream_id]
+                    if not self.closed:
+                        self.conn.reset_stream(
+                            stream_id, h2.errors.ErrorCodes.CANCEL)
+                        self._flush()
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.conn.close_connection()
+                self._flush()
+        self._close(build_error(
+            strategy.ServiceNotAvailable, "Connection closed"))
+
+    def _start_pending(self):
+        max_streams = self.conn.remote_settings.max_concurrent_streams
+        while self.pending and self.conn.open_outbound_streams < max_streams:
+            stream = self.pending.pop(0)
+            stream_id = self.conn.get_next_available_stream_id()
+            self.conn.send_headers(stream_id, stream.request_headers,
+                                   end_stream=not stream.outbound)
+            self.streams[stream_id] = stream
+            self._send_body(stream_id, stream)
+
+    def _send_body(self, stream_id, stream):
+        """Send as much of the body of a request as flow control allows."""
+        while stream.outbound:
+            size = min(self.conn.local_flow_control_window(stream_id),
+                       self.conn.max_outbound_frame_size)
+            if size <= 0:
+                return
+            chunk, stream.outbound = (stream.outbound[:size],
+                                      stream.outbound[size:])
+            self.conn.send_data(stream_id, chunk, end_stream=not stream.outbound)
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def _read_loop(self):
+        try:
+            while True:
+                data = self.sock.recv(self.read_size)
+                if not data:
+                    raise socket.error("Connection closed by server")
+                with self.lock:
+                    events = self.conn.receive_data(data)
+                    finished = self._handle_events(events)
+                    self._flush()
+                for future, response, exc_info in finished:
+                    if exc_info:
+                        future.set_exception(exc_info)
+                    else:
+                        future.set_result(response)
+        except Exception:
+            self._close(sys.exc_info())
+
+    def _handle_events(self, events):
+        """Update the streams for the events received. Returns a list of
+        (future, response, exc_info) for the requests which have finished.
+        """
+        finished = []
+        for event in events:
+            stream = self.streams.get(getattr(event, 'stream_id', None))
+            if isinstance(event, h2.events.ResponseReceived) and stream:
+                stream.headers = event.headers
+            elif isinstance(event, h2.events.DataReceived):
+                self.conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+                if stream:
+                    stream.chunks.append(event.data)
+            elif isinstance(event, h2.events.StreamEnded) and stream:
+                del self.streams[event.stream_id]
+                finished.append(self._finish_stream(stream))
+            elif isinstance(event, h2.events.StreamReset) and stream:
+                del self.streams[event.stream_id]
+                finished.append((stream.future, None, build_error(
+                    strategy.ServiceNotAvailable,
+                    "Stream reset: %s" % event.error_code)))
+            elif isinstance(event, h2.events.WindowUpdated):
+                for stream_id, stream in self.streams.items():
+                    self._send_body(stream_id, stream)
+            elif isinstance(event, h2.events.RemoteSettingsChanged):
+                self.settings_received.set()
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.closed = True
+        self._start_pending()
+        return finished
+
+    def _finish_stream(self, stream):
+        # A response which can not be built (for example a corrupt compressed
+        # body) fails its own request, not the connection.
+        try:
+            return stream.future, stream.build_response(), None
+        except Exception:
+            return stream.future, None, sys.exc_info()
+
+    def _close(self, exc_info):
+        """Fail every request which has not finished."""
+        self.settings_received.set()
+        with self.lock:
+            self.closed = True
+            streams = self.streams.values() + self.pending
+            self.streams, self.pending = {}, []
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+        for stream in streams:
+            stream.future.set_exception(exc_info)
+
+
+class HTTP2Transport(http.HTTPTransport):
+    """An ITransport which sends requests over HTTP/2 connections. Up to
+    `max_connections` connections are opened to the host, a new one only
+    once every connection has `max_streams` requests in flight. Each request
+    is sent on the connection with the fewest requests in flight.
+
+    send() returns a ResponseFuture of an http.HTTPResponse, and receive()
+    returns a future of the deserialized response, so use the strategies of
+    http.make_async(). Compressed response bodies are decompressed.
+    Responses are always read completely, including for `stream` APISpecs.
+
+    param connect_timeout: seconds to wait for a new connection
+    """
+
+    accept_encoding = get_accept_encoding()
+
+    def __init__(self, host, port, max_connections=2, max_streams=100,
+                 connect_timeout=None, codec=None, compression=None):
+        super(HTTP2Transport, self).__init__(host, port, codec, compression)
+        self.max_connections    = max_connections
+        self.max_streams        = max_streams
+        self.connect_timeout    = connect_timeout
+        self.lock               = threading.Lock()
+        self.connections        = []
+
+    def get_connection(self):
+        with self.lock:
+            self.connections = [conn for conn in self.connections
+                                if not conn.closed]
+            conn = min(self.connections, key=lambda conn: conn.active) \
+                if self.connections else None
+            if conn is None or (conn.active >= self.max_streams and
+                                len(self.connections) < self.max_connections):
+                conn = HTTP2Connection(
+                    self.host, self.port, self.connect_timeout)
+                self.connections.append(conn)
+            return conn
+
+    def send(self, http_request, deadline=None):
+        # Raises DeadlineExceeded if the deadline has already passed
+        strategy.remaining(deadline)
+        body, headers = self.encode(http_request)
+        headers.setdefault('Accept-Encoding', self.accept_encoding)
+        if http.is_stream_body(body):
+            # Frames are sent from the buffered body as flow control allows
+            body = ''.join(http.iter_body_chunks(body))
+        elif body is not None and not isinstance(body, str):
+            body = memoryview(body).tobytes()
+        conn = self.get_connection()
+        future = ResponseFuture(deadline)
+        future.on_timeout = lambda: conn.cancel(future)
+        conn.submit(http_request.method, self.build_path(http_request),
+                    headers, body, future)
+        return future
+
+    def receive(self, api_spec, response):
+        receive = super(HTTP2Transport, self).receive
+
+        def future(timeout=None):
+            return receive(api_spec, response(timeout=timeout))
+        return future
+
+    def close(self):
+        """Close every connection. Requests in flight fail."""
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
@@ -14,9 +14,13 @@ class ITransport(object):
         """
         pass
 
-    def send(self, request):
+    def send(self, request, deadline=None):
         """Passed a request object created by the IRequestBuilder, should
         return a response object.
+
+        If the call has a deadline it is passed as `deadline`, a time.time()
+        value. The transport should not wait past it, and raise
+        strategy.DeadlineExceeded instead.
         """
         pass
 
@@ -29,24 +33,120 @@ class ITransport(object):
 
 class IRetryStrategy(object):
 
-    def retry(self, func):
+    def retry(self, func, deadline=None):
         """Called with an IErrorStrategy.handle callable. Should call func()
         and retry on appropriate exceptions, or raise the current exception.
         Return the result of func() on success.
+
+        If the call has a deadline it is passed as `deadline`, a time.time()
+        value. No retry should be attempted after the deadline.
         """
         pass
 
 
 class IErrorStrategy(object):
 
-    def handle(self, func):
+    def handle(self, func, deadline=None):
         """Called with an Itransport.send callable. Should call func() handle
         exceptions (or error responses derived from the response of func())
         and return the result of func() on success. Raise appropriate exceptions
         on errors. Raised errors will be handled by an IRetryStrategy.
+
+        If the call has a deadline it is passed as `deadline`, a time.time()
+        value.
+        """
+        pass
+
+
+class IHedgeStrategy(object):
+
+    def hedge(self, func, deadline=None):
+        """Called with an ITransport.send callable. Should call func(), and
+        may call it again if the first call is slow. Return the result of the
+        first call which completes.
+
+        If the call has a deadline it is passed as `deadline`, a time.time()
+        value.
+        """
+        pass
+
+
+class IConcurrencyLimiter(object):
+
+    def limit(self, name, func):
+        """Called with the name of an APISpec and a callable which performs a
+        call. Should call func() and return its result if another call for
+        the name is allowed, or raise strategy.ConcurrencyLimitExceeded
+        without calling it.
+        """
+        pass
+
+
+class ICacheStrategy(object):
+
+    def fetch(self, request, func):
+        """Called with the request object created by ITransport.build() and a
+        callable which performs the request (an IRetryStrategy.retry
+        callable). Should return a cached response for the request, or call
+        func() and return (and possibly cache) its result.
+        """
+        pass
+
+
+class ICache(object):
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default if there is no value
+        or it has expired.
+        """
+        pass
+
+    def set(self, key, value, ttl):
+        """Store value for key for ttl seconds."""
+        pass
+
+
+class ICodec(object):
+    """Encodes request bodies and decodes response bodies. `name` is the name
+    the codec is registered with, and `content_type` the http Content-Type
+    of encoded values.
+    """
+
+    name = None
+    content_type = None
+
+    def encode(self, value):
+        """Return value encoded as a string."""
+        pass
+
+    def decode(self, data):
+        """Return the value decoded from a string."""
+        pass
+
+
+class IMetrics(object):
+    """Receives the metrics of the calls of a client. Each metric is for an
+    APISpec, identified by its name.
+    """
+
+    def record_latency(self, name, phase, seconds):
+        """Record the seconds taken by a phase of a call: 'serialize',
+        'send', 'deserialize' or 'call'.
         """
         pass
 
+    def record_retry(self, name):
+        """Record a retry of a request."""
+        pass
+
+    def record_error(self, name, error_class):
+        """Record the name of the class of an error raised by a call."""
+        pass
+
+    def add_in_flight(self, name, delta):
+        """Add delta (1 or -1) to the number of calls in flight."""
+        pass
+
 
 class ISchema(object):
 
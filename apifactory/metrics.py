@@ -0,0 +1,230 @@
+"""
+Instrumentation for clients created by factory.build_client().
+
+Pass an IMetrics as the `metrics` of build_client() to record, for each
+APISpec name:
+
+* the latency of each phase of a call: `serialize` (transport.build),
+  `send` (each attempt of transport.send), `deserialize` (transport.receive)
+  and the whole `call`
+* the number of retries
+* the class of each error raised by a call
+* the number of calls in flight
+
+MetricsRecorder is an in-memory IMetrics which keeps latencies in
+Histograms.
+"""
+import threading
+import time
+
+from apifactory.compat import when_done
+
+
+class Histogram(object):
+    """An HDR-style histogram of non-negative integer values. Values up to
+    2 ** significant_bits are counted exactly, larger values in buckets
+    whose width grows with the value, so the error of any value read from
+    the histogram is less than 1 part in 2 ** (significant_bits - 1), and
+    memory is bounded by the range of the values, not their number.
+    """
+
+    def __init__(self, significant_bits=8):
+        self.significant_bits   = significant_bits
+        self.counts             = {}
+        self.count              = 0
+        self.total              = 0
+        self.min                = None
+        self.max                = None
+
+    def _shift(self, value):
+        return max(0, value.bit_length() - self.significant_bits)
+
+    def record(self, value):
+        shift = self._shift(value)
+        # Buckets are keyed by their lowest value
+        key = value >> shift << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def value_at_percentile(self, percentile):
+        """Return the highest value in the bucket which contains the value
+        at percentile (0 to 100). Returns None if there are no values.
+        """
+        if not self.count:
+            return None
+        target = max(1, self.count * percentile / 100.0)
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= target:
+                return min(self.max, key + (1 << self._shift(key)) - 1)
+        return self.max
+
+    @property
+    def mean(self):
+        return float(self.total) / self.count if self.count else None
+
+
+class MetricsRecorder(object):
+    """A thread-safe, in-memory, IMetrics. Latencies are recorded in a
+    Histogram of microseconds for each (name, phase).
+    """
+
+    percentiles = (50, 90, 99, 99.9)
+
+    def __init__(self, significant_bits=8):
+        self.significant_bits   = significant_bits
+        self.lock               = threading.Lock()
+        self.histograms         = {}
+        self.retries            = {}
+        self.errors             = {}
+        self.in_flight          = {}
+
+    def record_latency(self, name, phase, seconds):
+        key = name, phase
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(
+                    self.significant_bits)
+            histogram.record(int(seconds * 1e6))
+
+    def record_retry(self, name):
+        with self.lock:
+            self.retries[name] = self.retries.get(name, 0) + 1
+
+    def record_error(self, name, error_class):
+        key = name, error_class
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def add_in_flight(self, name, delta):
+        with self.lock:
+            self.in_flight[name] = self.in_flight.get(name, 0) + delta
+
+    def snapshot(self):
+        """Return a dict of the metrics for each name. Latencies are in
+        microseconds.
+        """
+        with self.lock:
+            names = (set(name for name, _ in self.histograms) |
+                     set(self.retries) |
+                     set(name for name, _ in self.errors) |
+                     set(self.in_flight))
+            snapshot = dict((name, {
+                'latency':      {},
+                'retries':      self.retries.get(name, 0),
+                'errors':       {},
+                'in_flight':    self.in_flight.get(name, 0),
+            }) for name in names)
+            for (name, phase), histogram in self.histograms.iteritems():
+                snapshot[name]['latency'][phase] = self._summarize(histogram)
+            for (name, error_class), count in self.errors.iteritems():
+                snapshot[name]['errors'][error_class] = count
+            return snapshot
+
+    def _summarize(self, histogram):
+        summary = {
+            'count':    histogram.count,
+            'min':      histogram.min,
+            'max':      histogram.max,
+            'mean':     histogram.mean,
+        }
+        for percentile in self.percentiles:
+            summary['p%s' % percentile] = histogram.value_at_percentile(
+                percentile)
+        return summary
+
+
+class TimedTransport(object):
+    """Wraps an ITransport to record the latency of build (serialize), each
+    send, and receive (deserialize) for one APISpec name. Sends which return
+    a Future are timed until the Future completes.
+    """
+
+    def __init__(self, transport, name, metrics):
+        self.transport  = transport
+        self.name       = name
+        self.metrics    = metrics
+
+    def _record(self, phase, start):
+        self.metrics.record_latency(self.name, phase, time.time() - start)
+
+    def build(self, api_spec, request_data):
+        start = time.time()
+        request = self.transport.build(api_spec, request_data)
+        self._record('serialize', start)
+        return request
+
+    def send(self, request, *args):
+        start = time.time()
+        try:
+            response = self.transport.send(request, *args)
+        except:
+            self._record('send', start)
+            raise
+        return when_done(response, lambda error: self._record('send', start))
+
+    def receive(self, api_spec, response):
+        start = time.time()
+        result = self.transport.receive(api_spec, response)
+        self._record('deserialize', start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+class CountingRetryStrategy(object):
+    """Wraps an IRetryStrategy to count the retries of each call."""
+
+    def __init__(self, wrapped, name, metrics):
+        self.wrapped    = wrapped
+        self.name       = name
+        self.metrics    = metrics
+
+    def retry(self, func, *args):
+        attempts = []
+
+        def attempt():
+            if attempts:
+                self.metrics.record_retry(self.name)
+            attempts.append(1)
+            return func()
+        return self.wrapped.retry(attempt, *args)
+
+
+def instrument_call_builder(call_builder, metrics):
+    """Return a call_builder which builds calls with call_builder, and
+    records their metrics in an IMetrics.
+    """
+    def build_instrumented_call(api_spec, request_spec, transport):
+        name = api_spec.name
+        request_spec = request_spec._replace(
+            retry_strategy=CountingRetryStrategy(
+                request_spec.retry_strategy, name, metrics))
+        call = call_builder(
+            api_spec, request_spec, TimedTransport(transport, name, metrics))
+
+        def finish(start, error):
+            metrics.add_in_flight(name, -1)
+            metrics.record_latency(name, 'call', time.time() - start)
+            if error is not None:
+                metrics.record_error(name, type(error).__name__)
+
+        def instrumented_call(**request_kwargs):
+            start = time.time()
+            metrics.add_in_flight(name, 1)
+            try:
+                result = call(**request_kwargs)
+            except BaseException, e:
+                finish(start, e)
+                raise
+            return when_done(result, lambda error: finish(start, error))
+        return instrumented_call
+    return build_instrumented_call
@@ -0,0 +1,139 @@
+"""
+A thread-safe pool of persistent (keep-alive) http connections.
+
+Connections are pooled per (host, port). A connection is checked out of the
+pool for the duration of a single request/response and returned once the
+response body has been read. Idle connections are evicted after
+`idle_timeout` seconds.
+"""
+from collections import namedtuple
+import httplib
+import threading
+import time
+
+
+PoolStats = namedtuple('PoolStats', 'hits new_connections waits evictions')
+
+
+class PoolTimeout(Exception):
+    """Raised when a connection could not be acquired before the timeout."""
+
+
+class ConnectionPool(object):
+    """A pool of httplib connections, keyed by (host, port).
+
+    param max_size: maximum number of connections (idle and in use) per host
+    param idle_timeout: seconds a connection may sit idle before it is closed
+    param connection_class: factory for new connections, called with
+        (host, port)
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60,
+                 connection_class=httplib.HTTPConnection):
+        self.max_size           = max_size
+        self.idle_timeout       = idle_timeout
+        self.connection_class   = connection_class
+        self.lock               = threading.Condition(threading.Lock())
+        self.idle               = {}
+        self.in_use             = {}
+        self._hits              = 0
+        self._new_connections   = 0
+        self._waits             = 0
+        self._evictions         = 0
+
+    def acquire(self, host, port, timeout=None):
+        """Return a connection for host:port. Reuses an idle connection if
+        one is available, opens a new one if the pool is not full, otherwise
+        waits up to `timeout` seconds for a connection to be released.
+        """
+        key = host, port
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            waited = False
+            while True:
+                self._evict_idle(key)
+                idle = self.idle.get(key)
+                if idle:
+                    conn, _ = idle.pop()
+                    self._hits += 1
+                    break
+                if self.in_use.get(key, 0) < self.max_size:
+                    conn = None
+                    self._new_connections += 1
+                    break
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout("No connection available for %s:%s" % key)
+                self.lock.wait(remaining)
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+
+        if conn is None:
+            conn = self.connection_class(host, port)
+        return conn
+
+    def release(self, host, port, conn):
+        """Return a connection to the pool so it can be reused."""
+        key = host, port
+        with self.lock:
+            self.in_use[key] -= 1
+            self.idle.setdefault(key, []).append((conn, time.time()))
+            self.lock.notify()
+
+    def discard(self, host, port, conn):
+        """Close a connection which can not be reused (error, or the server
+        asked to close it) and free its slot in the pool.
+        """
+        conn.close()
+        key = host, port
+        with self.lock:
+            self.in_use[key] -= 1
+            self.lock.notify()
+
+    def _evict_idle(self, key):
+        idle = self.idle.get(key)
+        if not idle:
+            return
+        oldest_allowed = time.time() - self.idle_timeout
+        # idle connections are appended as they are released, so the oldest
+        # are at the front of the list
+        expired = 0
+        for _, released_at in idle:
+            if released_at >= oldest_allowed:
+                break
+            expired += 1
+        for conn, _ in idle[:expired]:
+            conn.close()
+        del idle[:expired]
+        self._evictions += expired
+
+    def clear(self):
+        """Close all idle connections."""
+        with self.lock:
+            for idle in self.idle.itervalues():
+                for conn, _ in idle:
+                    conn.close()
+            self.idle.clear()
+
+    @property
+    def stats(self):
+        with self.lock:
+            return PoolStats(self._hits, self._new_connections,
+                             self._waits, self._evictions)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Return the process wide ConnectionPool shared by transports which are
+    not given an explicit pool.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
@@ -23,4 +23,24 @@ class RawSchema(object):
 
     @classmethod
     def deserialize(cls, response):
-        return response
\ No newline at end of file
+        return response
+
+
+class RawBodySchema(object):
+    """A request schema for a body which is already encoded: a str, buffer,
+    file object or iterator of chunks (see http.is_raw_body). The body is
+    passed to the transport unchanged, and sent with chunked transfer
+    encoding if its length is not known.
+
+    param key: the key of the body in the request data
+    """
+
+    def __init__(self, key='body'):
+        self.key = key
+        self.validates_keys = [key]
+
+    def serialize(self, request_data):
+        return request_data.get(self.key)
+
+    def deserialize(self, body):
+        return {self.key: body}
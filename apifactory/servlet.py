@@ -0,0 +1,314 @@
+"""
+Serve APISpecs from a WSGI application.
+
+The same APISpecs which are used to build a client are paired with a handler
+in a spec.ViewSpec. build_servlet() compiles a routing table, and a pipeline
+for each endpoint, once. Serving a request is then a route lookup, the
+request_schema.deserialize() of the APISpec, the handler, and the
+response_schema.serialize() of the result encoded with the codec of the
+APISpec.
+
+    app = servlet.build_servlet([spec.ViewSpec(api_translate, translate)])
+
+The request schema is passed a ServletRequest, which has the same `path`,
+`query`, `body` and `headers` fields as an http.HttpMetaSchema.
+
+Compressed request bodies are decompressed. Response bodies are compressed
+with the compression of the APISpec (or of the servlet) when the client
+accepts its encoding.
+"""
+import httplib
+import re
+import urlparse
+
+import colander
+
+from apifactory import compiled, compression, http, strategy
+from apifactory.codec import get_codec
+
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+def parse_query(query_string):
+    """Parse a query string into a dict. Repeated keys have a list of
+    values.
+    """
+    query = {}
+    for key, value in urlparse.parse_qsl(query_string, keep_blank_values=True):
+        if key not in query:
+            query[key] = value
+        elif isinstance(query[key], list):
+            query[key].append(value)
+        else:
+            query[key] = [query[key], value]
+    return query
+
+
+def get_header_name(environ_key):
+    """Convert a WSGI environ key (HTTP_X_REQUEST_ID) to a header name
+    (X-Request-Id).
+    """
+    return environ_key[5:].replace('_', '-').title()
+
+
+class ServletRequest(object):
+    """The request passed to the request schema of an APISpec. The query,
+    body and headers are only parsed if they are accessed, and only once.
+
+    param environ: the WSGI environ
+    param path: dict of the parameters matched from the path
+    param codec: the ICodec used to decode the body
+    """
+
+    _not_read = object()
+
+    def __init__(self, environ, path, codec):
+        self.environ    = environ
+        self.path       = path
+        self.codec      = codec
+        self._query     = None
+        self._headers   = None
+        self._body      = self._not_read
+
+    @property
+    def method(self):
+        return self.environ['REQUEST_METHOD']
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = parse_query(self.environ.get('QUERY_STRING', ''))
+        return self._query
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = self._read_headers()
+        return self._headers
+
+    def _read_headers(self):
+        headers = dict((get_header_name(key), value)
+                       for key, value in self.environ.iteritems()
+                       if key.startswith('HTTP_'))
+        if self.environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = self.environ['CONTENT_TYPE']
+        return headers
+
+    @property
+    def body(self):
+        """The decoded body, or None if the request has no body. The body is
+        decompressed, then form data is decoded as a query string, anything
+        else with the codec.
+        """
+        if self._body is self._not_read:
+            self._body = self._read_body()
+        return self._body
+
+    def _read_body(self):
+        length = int(self.environ.get('CONTENT_LENGTH') or 0)
+        if not length:
+            return None
+        data = self.environ['wsgi.input'].read(length)
+        content_encoding = self.environ.get('HTTP_CONTENT_ENCODING')
+        if content_encoding:
+            data = self._decompress(data, content_encoding)
+        if self.environ.get('CONTENT_TYPE', '').startswith(FORM_CONTENT_TYPE):
+            return parse_query(data)
+        try:
+            return self.codec.decode(data)
+        except ValueError, e:
+            raise http.HTTPBadRequest("Invalid body: %s" % e)
+
+    def _decompress(self, data, content_encoding):
+        if content_encoding.strip().lower() == 'identity':
+            return data
+        if compression.get_decompressor(content_encoding) is None:
+            raise http.HTTPBadRequest(
+                "Unsupported Content-Encoding: %s" % content_encoding)
+        try:
+            return compression.decompress(data, content_encoding)
+        except Exception, e:
+            raise http.HTTPBadRequest("Invalid compressed body: %s" % e)
+
+
+def build_path_pattern(name):
+    """Return a regex which matches the paths of an APISpec name with
+    %(key)s parameters, or None if the name has no parameters.
+    """
+    parts = re.split(r'%\((\w+)\)[sd]', name)
+    if len(parts) == 1:
+        return None
+    # split() alternates literal text and parameter names
+    pattern = ''.join(
+        '(?P<%s>[^/]+)' % part if i % 2 else re.escape(part)
+        for i, part in enumerate(parts))
+    return re.compile(pattern + '$')
+
+
+class Router(object):
+    """Maps a path to the endpoints for each method. Names without
+    parameters are found with a dict lookup, others by matching each pattern
+    in the order they were added.
+    """
+
+    def __init__(self):
+        self.static     = {}
+        self.patterns   = []
+
+    def add(self, api_spec, endpoint):
+        name = api_spec.name.lstrip('/')
+        pattern = build_path_pattern(name)
+        if pattern is None:
+            endpoints = self.static.setdefault(name, {})
+        else:
+            endpoints = self.get_pattern_endpoints(pattern)
+        if api_spec.method in endpoints:
+            raise ValueError("Duplicate route: %s %s" % (api_spec.method, name))
+        endpoints[api_spec.method] = endpoint
+
+    def get_pattern_endpoints(self, pattern):
+        for existing, endpoints in self.patterns:
+            if existing.pattern == pattern.pattern:
+                return endpoints
+        endpoints = {}
+        self.patterns.append((pattern, endpoints))
+        return endpoints
+
+    def match(self, path):
+        """Return a tuple of (endpoints by method, path parameters), or
+        (None, None) if no route matches the path.
+        """
+        endpoints = self.static.get(path)
+        if endpoints is not None:
+            return endpoints, {}
+        for pattern, endpoints in self.patterns:
+            match = pattern.match(path)
+            if match:
+                return endpoints, match.groupdict()
+        return None, None
+
+
+def get_status(status_code):
+    return '%d %s' % (status_code, httplib.responses[status_code])
+
+
+def build_response(status_code, body, content_type, content_encoding=None,
+                   vary=None):
+    headers = [('Content-Type', content_type),
+               ('Content-Length', str(len(body)))]
+    if content_encoding:
+        headers.append(('Content-Encoding', content_encoding))
+    if vary:
+        headers.append(('Vary', vary))
+    return get_status(status_code), headers, body
+
+
+# Exceptions raised by a request schema or handler which are returned as an
+# error response. Any other exception is left to the WSGI server.
+error_status_codes = [
+    (colander.Invalid,              httplib.BAD_REQUEST),
+    (http.HTTPBadRequest,           httplib.BAD_REQUEST),
+    (http.HTTPNotFound,             httplib.NOT_FOUND),
+    (strategy.ServiceNotAvailable,  httplib.SERVICE_UNAVAILABLE),
+]
+
+
+def build_error_response(error, codec):
+    for error_type, status_code in error_status_codes:
+        if isinstance(error, error_type):
+            break
+    if isinstance(error, colander.Invalid):
+        detail = error.asdict()
+    else:
+        detail = str(error)
+    body = codec.encode({'error': type(error).__name__, 'detail': detail})
+    return build_response(status_code, body, codec.content_type)
+
+
+def build_endpoint(view_spec, codec=None, compile_schemas=False,
+                   response_compression=None):
+    """Return a function which serves a request for the APISpec of a
+    ViewSpec. It is called with the WSGI environ and the path parameters,
+    and returns a tuple of (status, headers, body).
+    """
+    api_spec, handler = view_spec
+    codec = get_codec(api_spec.codec or codec or 'json')
+    response_compression = api_spec.compression or response_compression
+    request_schema = api_spec.request_schema
+    response_schema = api_spec.response_schema
+    if compile_schemas:
+        if isinstance(request_schema, http.HttpMetaSchema):
+            request_schema = compiled.compile_meta_schema(request_schema)
+        response_schema = compiled.compile_schema(response_schema)
+
+    deserialize     = request_schema.deserialize
+    serialize       = response_schema.serialize
+    encode          = codec.encode
+    content_type    = codec.content_type
+    error_types     = tuple(error_type for error_type, _ in error_status_codes)
+
+    def endpoint(environ, path):
+        try:
+            response = handler(deserialize(ServletRequest(environ, path, codec)))
+        except error_types, e:
+            return build_error_response(e, codec)
+        body = encode(serialize(response))
+        if not response_compression:
+            return build_response(httplib.OK, body, content_type)
+        # The response depends on the Accept-Encoding of the request even
+        # when it is not compressed, which caches must know
+        body, content_encoding = response_compression.compress_response(
+            body, environ.get('HTTP_ACCEPT_ENCODING'))
+        return build_response(httplib.OK, body, content_type, content_encoding,
+                              vary='Accept-Encoding')
+    return endpoint
+
+
+class Servlet(object):
+    """A WSGI application which routes requests to the endpoints of a
+    Router. Responds with 404 if no route matches the path, and 405 if the
+    route has no endpoint for the method.
+    """
+
+    def __init__(self, router):
+        self.router = router
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '').lstrip('/')
+        endpoints, path_params = self.router.match(path)
+        if endpoints is None:
+            return self.respond_empty(start_response, httplib.NOT_FOUND)
+
+        endpoint = endpoints.get(environ['REQUEST_METHOD'])
+        if endpoint is None:
+            allow = ', '.join(sorted(endpoints))
+            return self.respond_empty(
+                start_response, httplib.METHOD_NOT_ALLOWED, [('Allow', allow)])
+
+        status, headers, body = endpoint(environ, path_params)
+        start_response(status, headers)
+        return [body]
+
+    def respond_empty(self, start_response, status_code, headers=()):
+        start_response(get_status(status_code),
+                       [('Content-Length', '0')] + list(headers))
+        return ['']
+
+
+def build_servlet(view_specs, codec=None, compile_schemas=False,
+                  compression=None):
+    """Build a WSGI application which serves a list of spec.ViewSpec.
+
+    param codec: the codec for APISpecs which do not have one, defaults to
+        json
+    param compile_schemas: when True colander schemas are compiled with
+        compiled.compile_schema()
+    param compression: the compression.Compression for response bodies of
+        APISpecs which do not have one
+    """
+    router = Router()
+    for view_spec in view_specs:
+        router.add(view_spec.api_spec, build_endpoint(
+            view_spec, codec, compile_schemas, compression))
+    return Servlet(router)
@@ -1,8 +1,23 @@
 
 from collections import namedtuple
 
-APISpec = namedtuple('APISpec', 'name method request_schema response_schema')
+APISpec = namedtuple('APISpec',
+    'name method request_schema response_schema stream codec compression')
+APISpec.__new__.__defaults__ = (False, None, None)
 
-RequestSpec = namedtuple('RequestSpec', 'retry_strategy error_strategy')
+RequestSpec = namedtuple('RequestSpec',
+    'retry_strategy error_strategy cache_strategy deadline hedge_strategy '
+    'concurrency_limiter batch_spec')
+RequestSpec.__new__.__defaults__ = (None, None, None, None, None)
 
 ClientSpec = namedtuple('ClientSpec', 'api_spec request_spec')
+
+# Methods of APISpecs which can safely be sent more than once
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+ViewSpec = namedtuple('ViewSpec', 'api_spec handler')
+
+# Links a single item APISpec to a bulk APISpec. See apifactory.batching
+BatchSpec = namedtuple('BatchSpec',
+                       'bulk_api_spec combine split max_items window')
+BatchSpec.__new__.__defaults__ = (100, 0.005)
@@ -2,6 +2,16 @@
 Generic IRetryStrategy and IErrorStrategy objects that will work with
 any Transport.
 """
+import collections
+import math
+import Queue
+import random
+import sys
+import threading
+import time
+
+from apifactory.compat import when_done
+
 
 class ClientError(Exception):
     """Base class for error strategy exceptions."""
@@ -16,14 +26,522 @@ class ServiceNotAvailable(ClientError):
     """
 
 
+class DeadlineExceeded(ServiceNotAvailable):
+    """Raised when a request could not be completed before its deadline."""
+
+
+def remaining(deadline):
+    """Return the seconds left until deadline (a time.time() value), or None
+    if there is no deadline. Raises DeadlineExceeded if it has passed.
+    """
+    if deadline is None:
+        return None
+    seconds = deadline - time.time()
+    if seconds <= 0:
+        raise DeadlineExceeded()
+    return seconds
+
+
 class NoRetryStrategy(object):
     """Do not attempt any retries."""
 
-    def retry(self, func):
+    def retry(self, func, deadline=None):
         return func()
 
 
 class NoErrorStrategy(object):
 
-    def handle(self, func):
-        return func()
\ No newline at end of file
+    def handle(self, func, deadline=None):
+        return func()
+
+
+class ExponentialBackoff(object):
+    """Delays between retries which grow exponentially with each attempt,
+    starting at `base` seconds and capped at `max_delay`. With `jitter` the
+    delay is chosen uniformly between 0 and the exponential delay, so that
+    clients which failed at the same time do not retry at the same time.
+    """
+
+    def __init__(self, base=0.05, max_delay=2.0, jitter=True):
+        self.base       = base
+        self.max_delay  = max_delay
+        self.jitter     = jitter
+
+    def delay(self, attempt):
+        """Return the delay in seconds before retrying after `attempt`
+        (starting from 0) failed.
+        """
+        delay = min(self.max_delay, self.base * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class RetryBudget(object):
+    """A token bucket which limits retries to a fraction of requests. Each
+    request deposits `ratio` tokens and each retry withdraws one, so over time
+    retries are capped at `ratio` of the traffic. Up to `max_tokens` can be
+    saved, which allows short bursts of retries.
+
+    Share a RetryBudget between the retry strategies of a client to give the
+    client a single budget.
+    """
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio      = ratio
+        self.max_tokens = max_tokens
+        self.tokens     = max_tokens
+        self.lock       = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Return True if there is a token available for a retry."""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitOpen(ClientError):
+    """Raised without making a request while a circuit breaker is open."""
+
+
+class RollingWindow(object):
+    """Counts of successes and failures over the last `window` seconds,
+    kept in `bucket_count` buckets which expire one at a time.
+    """
+
+    def __init__(self, window=10, bucket_count=10):
+        self.bucket_width   = float(window) / bucket_count
+        self.bucket_count   = bucket_count
+        self.reset()
+
+    def reset(self):
+        # Each bucket is [bucket_start, successes, failures]
+        self.buckets = []
+
+    def _current(self, now):
+        start = now - now % self.bucket_width
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append([start, 0, 0])
+            oldest = start - self.bucket_width * (self.bucket_count - 1)
+            while self.buckets[0][0] < oldest:
+                self.buckets.pop(0)
+        return self.buckets[-1]
+
+    def add(self, now, failed):
+        self._current(now)[2 if failed else 1] += 1
+
+    def totals(self, now):
+        """Return a tuple of (requests, failures) in the window."""
+        self._current(now)
+        failures = sum(bucket[2] for bucket in self.buckets)
+        return sum(bucket[1] for bucket in self.buckets) + failures, failures
+
+
+class CircuitBreaker(object):
+    """The circuit of one APISpec name, see CircuitBreakerErrorStrategy.
+    An IErrorStrategy.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, name, wrapped, failure_ratio=0.5, min_requests=20,
+                 window=10, reset_timeout=5):
+        self.name           = name
+        self.wrapped        = wrapped
+        self.failure_ratio  = failure_ratio
+        self.min_requests   = min_requests
+        self.reset_timeout  = reset_timeout
+        self.rolling_window = RollingWindow(window)
+        self.lock           = threading.Lock()
+        self.state          = self.CLOSED
+        self.opened_at      = None
+
+    def handle(self, func, deadline=None):
+        is_probe = self._before_request()
+        try:
+            if deadline is None:
+                response = self.wrapped.handle(func)
+            else:
+                response = self.wrapped.handle(func, deadline)
+        except ClientError, e:
+            self._after_request(is_probe, isinstance(e, ServiceNotAvailable))
+            raise
+        except Exception:
+            self._after_request(is_probe, True)
+            raise
+        self._after_request(is_probe, False)
+        return response
+
+    def _before_request(self):
+        """Raise CircuitOpen if the request should not be sent. Returns True
+        if this request is the probe for a half-open circuit.
+        """
+        now = time.time()
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            # Also sends a new probe if the last one did not complete in time
+            if now - self.opened_at < self.reset_timeout:
+                raise CircuitOpen(self.name)
+            self._set_state(self.HALF_OPEN, now)
+            return True
+
+    def _after_request(self, is_probe, failed):
+        now = time.time()
+        with self.lock:
+            if is_probe:
+                self._set_state(self.OPEN if failed else self.CLOSED, now)
+                return
+            if self.state != self.CLOSED:
+                return
+            self.rolling_window.add(now, failed)
+            if not failed:
+                return
+            requests, failures = self.rolling_window.totals(now)
+            if (requests >= self.min_requests and
+                    failures >= self.failure_ratio * requests):
+                self._set_state(self.OPEN, now)
+
+    def _set_state(self, state, now):
+        self.state = state
+        self.opened_at = None if state == self.CLOSED else now
+        if state == self.CLOSED:
+            self.rolling_window.reset()
+
+
+class CircuitBreakerErrorStrategy(object):
+    """An IErrorStrategy which stops sending requests to a service which is
+    failing. Wraps another IErrorStrategy and counts the requests which fail
+    with ServiceNotAvailable (or an error which is not a ClientError).
+
+    While the circuit is closed requests are sent as normal. When at least
+    `failure_ratio` of the requests in the last `window` seconds fail (and
+    there were at least `min_requests`) the circuit opens, and requests fail
+    immediately with CircuitOpen. After `reset_timeout` seconds the circuit
+    is half-open and a single probe request is sent. The circuit closes if it
+    succeeds, otherwise it opens again.
+
+    Each APISpec name has its own circuit, so one strategy can be shared by
+    the RequestSpec of many APISpecs: factory.build_call uses the circuit
+    from for_name(api_spec.name). Calls to handle() directly share the
+    circuit named None.
+    """
+
+    def __init__(self, wrapped, failure_ratio=0.5, min_requests=20,
+                 window=10, reset_timeout=5):
+        self.wrapped        = wrapped
+        self.failure_ratio  = failure_ratio
+        self.min_requests   = min_requests
+        self.window         = window
+        self.reset_timeout  = reset_timeout
+        self.lock           = threading.Lock()
+        self.circuits       = {}
+
+    def for_name(self, name):
+        """Return the CircuitBreaker for an APISpec name."""
+        with self.lock:
+            circuit = self.circuits.get(name)
+            if circuit is None:
+                circuit = self.circuits[name] = CircuitBreaker(
+                    name, self.wrapped, self.failure_ratio,
+                    self.min_requests, self.window, self.reset_timeout)
+            return circuit
+
+    def get_state(self, name):
+        """Return the state of the circuit of an APISpec name."""
+        return self.for_name(name).state
+
+    def handle(self, func, deadline=None):
+        return self.for_name(None).handle(func, deadline)
+
+
+def for_name(strategy, name):
+    """Return the strategy to use for calls of the APISpec `name`. A
+    strategy which tracks each APISpec separately provides a for_name(name)
+    method, other strategies are returned unchanged.
+    """
+    if hasattr(strategy, 'for_name'):
+        return strategy.for_name(name)
+    return strategy
+
+
+class LatencyWindow(object):
+    """The last `size` latencies, and a percentile of them which is updated
+    every `update_every` samples (sorting on every request would cost more
+    than it saves).
+    """
+
+    def __init__(self, percentile=95, size=1000, update_every=100):
+        self.percentile     = percentile
+        self.update_every   = update_every
+        self.samples        = collections.deque(maxlen=size)
+        self.count          = 0
+        self.value          = None
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self.count += 1
+        if self.count % self.update_every == 0:
+            samples = sorted(self.samples)
+            index = int(len(samples) * self.percentile / 100.0)
+            self.value = samples[min(index, len(samples) - 1)]
+
+
+class WorkerPool(object):
+    """Runs functions on up to `max_workers` daemon threads. Threads are
+    started as they are needed, and reused. A function submitted while every
+    worker is busy waits in a queue.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers    = max_workers
+        self.tasks          = Queue.Queue()
+        self.lock           = threading.Lock()
+        self.workers        = 0
+        self.busy           = 0
+
+    def submit(self, func, *args):
+        with self.lock:
+            self.busy += 1
+            if self.busy > self.workers and self.workers < self.max_workers:
+                self.workers += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+        self.tasks.put((func, args))
+
+    def _work(self):
+        while True:
+            func, args = self.tasks.get()
+            try:
+                func(*args)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+
+class HedgingStrategy(object):
+    """An IHedgeStrategy which sends a second, identical, request if the
+    first has not completed within the `percentile` latency of recent
+    requests, and returns the response which arrives first. factory.build_call
+    only hedges APISpecs with an idempotent method.
+
+    Hedges are limited by a RetryBudget to `max_ratio` of requests. Until
+    enough latencies have been recorded `initial_delay` is used. Both
+    requests are sent from a WorkerPool of up to `max_workers` threads, and
+    the response which loses is discarded. factory.build_call does not hedge
+    `stream` APISpecs, whose responses hold a connection until they are read.
+
+    With a balancer.LoadBalancingTransport the hedge is sent to a different
+    host than the first request.
+    """
+
+    def __init__(self, percentile=95, initial_delay=0.1, min_delay=0.005,
+                 max_ratio=0.05, max_tokens=10, window_size=1000,
+                 max_workers=32):
+        self.initial_delay  = initial_delay
+        self.min_delay      = min_delay
+        self.latencies      = LatencyWindow(percentile, window_size)
+        self.budget         = RetryBudget(max_ratio, max_tokens)
+        self.workers        = WorkerPool(max_workers)
+        self.lock           = threading.Lock()
+        self.hedges         = 0
+
+    @property
+    def delay(self):
+        if self.latencies.value is None:
+            return self.initial_delay
+        return max(self.min_delay, self.latencies.value)
+
+    def hedge(self, func, deadline=None):
+        self.budget.deposit()
+        results = Queue.Queue()
+        self._start(func, results, True)
+
+        delay = self.delay
+        timeout = remaining(deadline)
+        if timeout is not None and timeout <= delay:
+            return self._wait(results, 1, deadline)
+        try:
+            return self._unpack(results.get(timeout=delay))
+        except Queue.Empty:
+            pass
+
+        if not self.budget.withdraw():
+            return self._wait(results, 1, deadline)
+        with self.lock:
+            self.hedges += 1
+        self._start(func, results, False)
+        return self._wait(results, 2, deadline)
+
+    def _start(self, func, results, is_first):
+        self.workers.submit(self._run, func, results, is_first)
+
+    def _run(self, func, results, is_first):
+        start = time.time()
+        try:
+            result = True, func()
+        except:
+            result = False, sys.exc_info()
+        if is_first:
+            with self.lock:
+                self.latencies.add(time.time() - start)
+        results.put(result)
+
+    def _wait(self, results, pending, deadline):
+        """Return the first successful result, or raise the error of the
+        first request if they all fail.
+        """
+        first_error = None
+        for _ in xrange(pending):
+            try:
+                succeeded, value = results.get(timeout=remaining(deadline))
+            except Queue.Empty:
+                raise DeadlineExceeded()
+            if succeeded:
+                return value
+            first_error = first_error or value
+        raise first_error[0], first_error[1], first_error[2]
+
+    def _unpack(self, result):
+        succeeded, value = result
+        if succeeded:
+            return value
+        raise value[0], value[1], value[2]
+
+
+class ConcurrencyLimitExceeded(ClientError):
+    """Raised without making a request when a concurrency limiter already
+    has as many calls in flight as its limit allows.
+    """
+
+
+class AIMDLimit(object):
+    """An additive increase, multiplicative decrease concurrency limit. The
+    limit grows by one for each call which completes in time while at least
+    half of the limit is in use, and is multiplied by `backoff_ratio` when a
+    call is dropped or takes longer than `latency_threshold` seconds.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=1000,
+                 backoff_ratio=0.9, latency_threshold=None):
+        self.limit              = initial_limit
+        self.min_limit          = min_limit
+        self.max_limit          = max_limit
+        self.backoff_ratio      = backoff_ratio
+        self.latency_threshold  = latency_threshold
+
+    def update(self, latency, in_flight, dropped):
+        if dropped or (self.latency_threshold is not None and
+                       latency > self.latency_threshold):
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1)
+
+
+class GradientLimit(object):
+    """A concurrency limit which follows the ratio of the lowest latency seen
+    (the latency without queueing) to the current latency. While latency is
+    within `tolerance` times the lowest, the limit grows by its square root
+    (the queue allowed for). Once requests start queueing the limit shrinks
+    in proportion. The lowest latency is forgotten every `reset_every`
+    samples, so it follows changes in the service.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=1000,
+                 tolerance=2.0, smoothing=0.2, reset_every=1000):
+        self.limit          = initial_limit
+        self.min_limit      = min_limit
+        self.max_limit      = max_limit
+        self.tolerance      = tolerance
+        self.smoothing      = smoothing
+        self.reset_every    = reset_every
+        self.min_latency    = None
+        self.count          = 0
+
+    def update(self, latency, in_flight, dropped):
+        self.count += 1
+        if self.count % self.reset_every == 0:
+            self.min_latency = None
+        if not dropped and (self.min_latency is None or
+                            latency < self.min_latency):
+            self.min_latency = latency
+        if dropped:
+            gradient = 0.5
+        else:
+            gradient = max(0.5, min(1.0, self.tolerance * self.min_latency /
+                                    max(latency, 1e-9)))
+        # Do not grow a limit which is not being used
+        if gradient == 1.0 and in_flight * 2 < self.limit:
+            return
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = (1 - self.smoothing) * self.limit + self.smoothing * new_limit
+        self.limit = max(self.min_limit, min(self.max_limit, new_limit))
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """An IConcurrencyLimiter which limits the calls in flight for each
+    APISpec name, and adjusts each limit from the latency of completed
+    calls. Calls over the limit fail immediately with
+    ConcurrencyLimitExceeded, instead of queueing behind a slow service.
+    Calls which fail with ServiceNotAvailable are counted as dropped.
+
+    param limit_factory: called with no arguments to create the limit for
+        each name, an object with a `limit` and an
+        update(latency, in_flight, dropped) method. Defaults to AIMDLimit.
+    """
+
+    def __init__(self, limit_factory=None):
+        self.limit_factory  = limit_factory or AIMDLimit
+        self.lock           = threading.Lock()
+        self.limits         = {}
+        self.in_flight      = collections.defaultdict(int)
+        self.rejected       = collections.defaultdict(int)
+
+    def get_limit(self, name):
+        """Return the current limit for a name."""
+        with self.lock:
+            return int(self._get_limit(name).limit)
+
+    def _get_limit(self, name):
+        limit = self.limits.get(name)
+        if limit is None:
+            limit = self.limits[name] = self.limit_factory()
+        return limit
+
+    def acquire(self, name):
+        """Start a call. Returns the start time of the call, or raises
+        ConcurrencyLimitExceeded if the limit has been reached.
+        """
+        with self.lock:
+            if self.in_flight[name] >= int(self._get_limit(name).limit):
+                self.rejected[name] += 1
+                raise ConcurrencyLimitExceeded(name)
+            self.in_flight[name] += 1
+        return time.time()
+
+    def release(self, name, start, dropped):
+        """Finish a call which was started at `start`."""
+        latency = time.time() - start
+        with self.lock:
+            in_flight = self.in_flight[name]
+            self.in_flight[name] -= 1
+            self.limits[name].update(latency, in_flight, dropped)
+
+    def limit(self, name, func):
+        start = self.acquire(name)
+        try:
+            result = func()
+        except ServiceNotAvailable:
+            self.release(name, start, True)
+            raise
+        except:
+            self.release(name, start, False)
+            raise
+
+        return when_done(result, lambda error: self.release(
+            name, start, isinstance(error, ServiceNotAvailable)))
@@ -0,0 +1,185 @@
+"""
+Non-blocking HTTP transport and strategies for the tornado IOLoop.
+
+Requests are sent with tornado's AsyncHTTPClient, and the client methods
+return Futures, so a single thread can have many requests in flight. Build
+a client with:
+
+    factory.build_client(client_mapping, TornadoHTTPTransport(host, port),
+                         call_builder=build_coroutine_call)
+
+or the equivalent `tornado_http.build_client()`.
+"""
+import itertools
+import time
+
+from tornado import gen, httpclient
+
+from apifactory import factory, http, spec, strategy
+
+
+class TornadoHTTPTransport(http.HTTPTransport):
+    """HTTP transport which sends requests with a tornado AsyncHTTPClient.
+    send() returns a Future of a tornado HTTPResponse. The body of a request
+    is encoded as json, the query as a url encoded string. Responses are
+    decompressed by the AsyncHTTPClient.
+
+    param http_client: an AsyncHTTPClient, defaults to the shared client for
+        the current IOLoop
+    param codec: the codec for request bodies, when the APISpec does not
+        have one. Defaults to json.
+    param compression: the compression.Compression for request bodies, when
+        the APISpec does not have one
+    """
+
+    def __init__(self, host, port, http_client=None, request_timeout=None,
+                 codec=None, compression=None):
+        super(TornadoHTTPTransport, self).__init__(
+            host, port, codec, compression)
+        self.http_client = http_client
+        self.request_timeout = request_timeout
+
+    def build_url(self, path, query=None):
+        url = super(TornadoHTTPTransport, self).build_url(path)
+        return '%s?%s' % (url, query) if query else url
+
+    def send(self, http_request, deadline=None):
+        request_timeout = self.request_timeout
+        if deadline is not None:
+            request_timeout = strategy.remaining(deadline)
+        request = http.JsonHttpRequest(
+            http_request, self.get_codec(http_request.codec))
+        data, headers = request.data, request.headers
+        if data is None and request.method in ('POST', 'PUT', 'PATCH'):
+            data = ''
+        elif data is not None:
+            headers = dict(headers or {})
+            if not http.is_raw_body(request.request.data):
+                headers.setdefault('Content-Type', request.codec.content_type)
+            compression = request.compression or self.compression
+            if compression:
+                data, headers = compression.compress(data, headers)
+
+        body_kwargs = {'body': data}
+        if http.is_stream_body(data):
+            # Sent with chunked transfer encoding as it is read
+            body_kwargs = {'body_producer': build_body_producer(data)}
+        elif isinstance(data, (bytearray, buffer, memoryview)):
+            body_kwargs = {'body': memoryview(data).tobytes()}
+        http_client = self.http_client or httpclient.AsyncHTTPClient()
+        return http_client.fetch(
+            self.build_url(request.path, request.query),
+            method=request.method,
+            headers=headers,
+            request_timeout=request_timeout,
+            raise_error=False,
+            **body_kwargs)
+
+
+def build_body_producer(body):
+    """Return a tornado body_producer which writes the chunks of a stream
+    body.
+    """
+    @gen.coroutine
+    def body_producer(write):
+        for chunk in http.iter_body_chunks(body):
+            if chunk:
+                yield write(chunk)
+    return body_producer
+
+
+class CoroutineErrorStrategy(object):
+    """Adapt an IErrorStrategy to handle the result of a Future. The wrapped
+    strategy is called with the response once the Future has completed.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def for_name(self, name):
+        return CoroutineErrorStrategy(strategy.for_name(self.wrapped, name))
+
+    @gen.coroutine
+    def handle(self, func, deadline=None):
+        response = yield func()
+        if deadline is None:
+            raise gen.Return(self.wrapped.handle(lambda: response))
+        raise gen.Return(self.wrapped.handle(lambda: response, deadline))
+
+
+class CoroutineRetryStrategy(http.HTTPRetryStrategy):
+    """The coroutine version of http.HTTPRetryStrategy. func() should return
+    a Future, which is retried if it fails with ServiceNotAvailable. Waiting
+    between retries does not block the IOLoop.
+    """
+
+    @gen.coroutine
+    def retry(self, func, deadline=None):
+        deadline = self.start(deadline)
+        for attempt in itertools.count():
+            try:
+                response = yield func()
+                raise gen.Return(response)
+            except strategy.ServiceNotAvailable:
+                delay = self.next_delay(attempt, deadline)
+                if delay is None:
+                    raise
+            if delay:
+                yield gen.sleep(delay)
+
+
+DEFAULT_GET = spec.RequestSpec(
+    CoroutineRetryStrategy(),
+    CoroutineErrorStrategy(http.HTTPErrorStrategy(status_code_attr='code')))
+
+
+def build_coroutine_call(api_spec, request_spec, transport):
+    """Like factory.build_call, but for an ITransport whose send() returns a
+    Future, and strategies which return Futures. The compiled method returns
+    a Future of the response.
+
+    The cache_strategy, hedge_strategy and batch_spec of a RequestSpec are
+    not supported for coroutine calls, and raise ValueError.
+    """
+    for field in ('cache_strategy', 'hedge_strategy', 'batch_spec'):
+        if getattr(request_spec, field):
+            raise ValueError(
+                "%s is not supported by coroutine clients: %s" %
+                (field, api_spec.name))
+
+    build       = transport.build
+    send        = transport.send
+    receive     = transport.receive
+    retry       = request_spec.retry_strategy.retry
+    handle      = strategy.for_name(
+        request_spec.error_strategy, api_spec.name).handle
+
+    default_timeout = request_spec.deadline
+
+    def perform(request, deadline):
+        attempt = retry if factory.is_repeatable(request) else factory.call_once
+        if deadline is None:
+            return attempt(lambda: handle(lambda: send(request)))
+        return attempt(
+            lambda: handle(lambda: send(request, deadline), deadline),
+            deadline)
+
+    if request_spec.concurrency_limiter:
+        perform = factory.with_concurrency_limit(
+            request_spec.concurrency_limiter, api_spec.name, perform)
+
+    @gen.coroutine
+    def call(**request_kwargs):
+        timeout = request_kwargs.pop('_deadline', default_timeout)
+        deadline = time.time() + timeout if timeout is not None else None
+        request = build(api_spec, request_kwargs)
+        response = yield perform(request, deadline)
+        raise gen.Return(receive(api_spec, response))
+    return call
+
+
+def build_client(client_mapping, transport, metrics=None):
+    """Build a client whose methods return Futures."""
+    return factory.build_client(
+        client_mapping, transport, call_builder=build_coroutine_call,
+        metrics=metrics)
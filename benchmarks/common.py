@@ -0,0 +1,17 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import timeit
+
+
+def time_per_call(func, number, repeat=3):
+    """Return the best time, in seconds, of a single call to func()."""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat, number)) / number
+
+
+def format_results(results):
+    """Return lines of `name  usec/op` for a dict of name to seconds."""
+    width = max(len(name) for name in results)
+    return ['%-*s %10.3f usec/op' % (width, name, seconds * 1e6)
+            for name, seconds in sorted(results.items())]
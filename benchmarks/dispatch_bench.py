@@ -0,0 +1,76 @@
+"""
+Microbenchmark of APIClient method dispatch.
+
+Compares the compiled call path from factory.build_client against the
+previous implementation, which resolved the ClientSpec and created the call
+closure in __getattr__ on every call. The transport and strategies do no work
+so only the dispatch overhead is measured.
+
+    python benchmarks/dispatch_bench.py
+"""
+import functools
+import timeit
+
+from apifactory import factory, schemas, spec, strategy
+
+
+class NullTransport(object):
+
+    def build(self, api_spec, request_data):
+        return request_data
+
+    def send(self, request):
+        return request
+
+    def receive(self, api_spec, response):
+        return response
+
+
+class GetattrAPIClient(object):
+    """The APIClient dispatch from apifactory 0.1.1."""
+
+    def __init__(self, client_mapping, transport):
+        self.client_mapping  = client_mapping
+        self.transport       = transport
+
+    def __getattr__(self, item):
+        if item not in self.client_mapping:
+            raise AttributeError(item)
+
+        api_spec, request_spec = self.client_mapping[item]
+        def make_call(**request_kwargs):
+            request = self.transport.build(api_spec, request_kwargs)
+            response = request_spec.retry_strategy.retry(
+                functools.partial(request_spec.error_strategy.handle,
+                    functools.partial(self.transport.send, request)))
+            return self.transport.receive(api_spec, response)
+
+        return make_call
+
+
+def build_client_mapping():
+    request_spec = spec.RequestSpec(
+        strategy.NoRetryStrategy(), strategy.NoErrorStrategy())
+    api_spec = spec.APISpec(
+        'get', 'GET', schemas.RawSchema, schemas.RawSchema)
+    return {'get': spec.ClientSpec(api_spec, request_spec)}
+
+
+def run(number=200000, repeat=5):
+    client_mapping = build_client_mapping()
+    clients = [
+        ('getattr', GetattrAPIClient(client_mapping, NullTransport())),
+        ('compiled', factory.build_client(client_mapping, NullTransport())),
+    ]
+    results = {}
+    for name, client in clients:
+        timer = timeit.Timer(lambda: client.get(id=1))
+        results[name] = min(timer.repeat(repeat, number)) / number
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    for name, seconds in sorted(results.items()):
+        print "%-10s %.3f usec/call" % (name, seconds * 1e6)
+    print "speedup    %.2fx" % (results['getattr'] / results['compiled'])
@@ -0,0 +1,49 @@
+"""
+Benchmark of the time to import the apifactory modules, which matters to
+short lived processes. Each import is timed in a new interpreter, less the
+time to start an interpreter which imports nothing.
+
+    python -m benchmarks.import_bench
+"""
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import format_results
+
+
+modules = [
+    'apifactory.http',
+    'apifactory.factory',
+    'apifactory.servlet',
+]
+
+
+def time_command(statement, env, number):
+    """Return the best time, in seconds, to run statement in a new python."""
+    command = [sys.executable, '-c', statement]
+    times = []
+    for _ in xrange(number):
+        start = time.time()
+        subprocess.check_call(command, env=env)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def run(number=20):
+    # The benchmarked modules are imported from this checkout
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')]))
+
+    startup = time_command('pass', env, number)
+    return dict(
+        ('import.%s' % module,
+         max(time_command('import %s' % module, env, number) - startup, 0))
+        for module in modules)
+
+
+if __name__ == "__main__":
+    print '\n'.join(format_results(run()))
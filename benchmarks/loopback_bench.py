@@ -0,0 +1,158 @@
+"""
+End-to-end throughput of clients against a local loopback http server, for
+the synchronous transports (with a pool of threads), the tornado transport
+(with many requests in flight on one IOLoop), and the http2 transport (with
+many requests in flight on one connection).
+
+The http2 numbers are measured against a different server (tests.h2_loopback,
+which uses the h2 package) than the HTTP/1.1 transports, and include the
+time that server spends in python. `http2` sends all the requests at once,
+`http2.sync` sends them from the same pool of threads as the synchronous
+transports, waiting for each response.
+
+    python -m benchmarks.loopback_bench
+"""
+import time
+
+from apifactory import factory, http, pool, schemas, spec, strategy
+from benchmarks.common import format_results
+from tests import loopback
+
+
+concurrency = 8
+
+
+class JsonSchema(object):
+
+    @classmethod
+    def serialize(cls, request_data):
+        return request_data
+
+    @classmethod
+    def deserialize(cls, response):
+        return http.JsonHttpResponse(response).body
+
+
+api_echo = http.GET('echo', schemas.RawSchema, JsonSchema)
+
+request_spec = spec.RequestSpec(
+    strategy.NoRetryStrategy(), http.HTTPErrorStrategy())
+
+
+def build_kwargs_list(count):
+    return [{'query': {'id': i}, 'body': None, 'headers': None}
+            for i in xrange(count)]
+
+
+def time_sync(transport, count):
+    """Return the seconds per request of `count` requests, sent by
+    `concurrency` threads.
+    """
+    client = factory.build_client(
+        {'echo': spec.ClientSpec(api_echo, request_spec)}, transport)
+    kwargs_list = build_kwargs_list(count)
+    start = time.time()
+    results = client.batch('echo', kwargs_list, concurrency)
+    elapsed = time.time() - start
+    errors = [result.error for result in results if result.error]
+    if errors:
+        raise errors[0]
+    return elapsed / count
+
+
+def time_tornado(server, count):
+    from tornado import gen, ioloop
+    from apifactory import tornado_http
+
+    transport = tornado_http.TornadoHTTPTransport(server.host, server.port)
+    client = tornado_http.build_client(
+        {'echo': spec.ClientSpec(api_echo, tornado_http.DEFAULT_GET)},
+        transport)
+
+    @gen.coroutine
+    def send_all():
+        yield [client.echo(**kwargs) for kwargs in build_kwargs_list(count)]
+
+    io_loop = ioloop.IOLoop()
+    io_loop.make_current()
+    try:
+        start = time.time()
+        io_loop.run_sync(send_all)
+        return (time.time() - start) / count
+    finally:
+        io_loop.clear_current()
+        io_loop.close(all_fds=True)
+
+
+def time_http2(count, sync=False):
+    from apifactory import http2
+    from tests import h2_loopback
+
+    server = h2_loopback.H2LoopbackServer().start()
+    transport = http2.HTTP2Transport(server.host, server.port, max_connections=1)
+    client = factory.build_client(
+        {'echo': spec.ClientSpec(api_echo, http.make_async(request_spec))},
+        transport)
+    try:
+        if sync:
+            return time_sync_futures(client, count)
+        start = time.time()
+        futures = [client.echo(**kwargs) for kwargs in build_kwargs_list(count)]
+        for future in futures:
+            future(timeout=30)
+        return (time.time() - start) / count
+    finally:
+        transport.close()
+        server.stop()
+
+
+def time_sync_futures(client, count):
+    call = client.echo
+    kwargs_list = build_kwargs_list(count)
+    start = time.time()
+    results = factory.call_batch(
+        lambda **kwargs: call(**kwargs)(timeout=30), kwargs_list, concurrency)
+    elapsed = time.time() - start
+    errors = [result.error for result in results if result.error]
+    if errors:
+        raise errors[0]
+    return elapsed / count
+
+
+def run(count=2000):
+    server = loopback.LoopbackServer().start()
+    connection_pool = pool.ConnectionPool(max_size=concurrency)
+    try:
+        results = {
+            'loopback.pooled': time_sync(
+                http.PooledHTTPTransport(server.host, server.port,
+                                         connection_pool=connection_pool),
+                count),
+        }
+        try:
+            import requests
+        except ImportError:
+            pass
+        else:
+            results['loopback.requests'] = time_sync(
+                http.HTTPTransport(server.host, server.port), count)
+        try:
+            results['loopback.tornado'] = time_tornado(server, count)
+        except ImportError:
+            pass
+        try:
+            results['loopback.http2'] = time_http2(count)
+            results['loopback.http2.sync'] = time_http2(count, sync=True)
+        except ImportError:
+            pass
+        return results
+    finally:
+        connection_pool.clear()
+        server.stop()
+
+
+if __name__ == "__main__":
+    results = run()
+    print '\n'.join(format_results(results))
+    for name, seconds in sorted(results.items()):
+        print '%s: %d requests/second' % (name, 1 / seconds)
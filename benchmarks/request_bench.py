@@ -0,0 +1,52 @@
+"""
+Benchmark of building requests and decoding responses: build_http_request,
+JsonHttpRequest and JsonHttpResponse.
+
+    python -m benchmarks.request_bench
+"""
+import json
+
+from apifactory import http, schemas, spec
+from benchmarks.common import format_results, time_per_call
+
+
+def build_body(item_count):
+    return [{'id': i, 'name': 'item %d' % i, 'tags': ['a', 'b'], 'active': True}
+            for i in xrange(item_count)]
+
+
+def run(number=20000, repeat=3):
+    api_spec = spec.APISpec('items/%(id)s', 'POST', schemas.RawSchema, None)
+    request_data = {
+        'path':     {'id': 7},
+        'query':    {'q': 'stars', 'limit': 10},
+        'body':     {'name': 'item', 'tags': ['a', 'b']},
+        'headers':  {'X-Request-Id': 'abc'},
+    }
+    http_request = http.build_http_request(api_spec, request_data)
+
+    results = {
+        'request.build_http_request': time_per_call(
+            lambda: http.build_http_request(api_spec, request_data),
+            number, repeat),
+        'request.json_http_request.data': time_per_call(
+            lambda: http.JsonHttpRequest(http_request).data, number, repeat),
+        'request.json_http_request.query': time_per_call(
+            lambda: http.JsonHttpRequest(http_request).query, number, repeat),
+    }
+
+    for item_count in (1, 100):
+        body = json.dumps(build_body(item_count))
+        response = http.HTTPResponse(200, {}, body)
+        key = 'request.json_http_response.items%d' % item_count
+        results[key + '.body'] = time_per_call(
+            lambda: http.JsonHttpResponse(response).body,
+            number / item_count, repeat)
+        results[key + '.iter_items'] = time_per_call(
+            lambda: list(http.JsonHttpResponse(response).iter_items()),
+            number / item_count, repeat)
+    return results
+
+
+if __name__ == "__main__":
+    print '\n'.join(format_results(run()))
@@ -0,0 +1,99 @@
+"""
+Run all of the benchmarks and write the results as json, so that they can be
+compared across commits.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json
+
+Each result is the time of one operation in seconds. With --compare, each
+result is printed with its ratio to the same result in an earlier run.
+"""
+import json
+import optparse
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks import (
+    dispatch_bench, import_bench, loopback_bench, request_bench, schema_bench)
+from benchmarks.common import format_results
+
+
+suites = [
+    ('dispatch', lambda quick: prefix('dispatch', dispatch_bench.run(
+        number=20000 if quick else 200000, repeat=3))),
+    ('schema', lambda quick: schema_bench.run(number=200 if quick else 2000)),
+    ('request', lambda quick: request_bench.run(
+        number=2000 if quick else 20000)),
+    ('loopback', lambda quick: loopback_bench.run(
+        count=200 if quick else 2000)),
+    ('import', lambda quick: import_bench.run(number=5 if quick else 20)),
+]
+
+
+def prefix(name, results):
+    return dict(('%s.%s' % (name, key), value)
+                for key, value in results.iteritems())
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.PIPE).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, quick=False):
+    results = {}
+    for name, suite in suites:
+        if names and name not in names:
+            continue
+        results.update(suite(quick))
+    return {
+        'commit':       get_commit(),
+        'python':       platform.python_version(),
+        'timestamp':    time.time(),
+        'results':      results,
+    }
+
+
+def compare(results, previous):
+    """Return lines of each result with its ratio to the previous result.
+    A ratio above 1 is slower.
+    """
+    lines = []
+    for line, (name, seconds) in zip(format_results(results),
+                                     sorted(results.items())):
+        if name in previous:
+            line += '  %.2fx' % (seconds / previous[name])
+        lines.append(line)
+    return lines
+
+
+def parse_args(args):
+    parser = optparse.OptionParser(usage='%prog [options] [suite ...]')
+    parser.add_option('--output', help='write the results to this file')
+    parser.add_option('--compare', help='compare to the results in this file')
+    parser.add_option('--quick', action='store_true',
+                      help='run fewer iterations')
+    return parser.parse_args(args)
+
+
+def main(args):
+    opts, names = parse_args(args)
+    report = run(names, opts.quick)
+    if opts.compare:
+        with open(opts.compare) as fh:
+            previous = json.load(fh)['results']
+        print '\n'.join(compare(report['results'], previous))
+    else:
+        print '\n'.join(format_results(report['results']))
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+"""
+Benchmark of HttpMetaSchema.serialize() and deserialize() with colander
+schemas of different widths, with and without compiled schemas.
+
+    python -m benchmarks.schema_bench
+"""
+import colander
+
+from apifactory import compiled, http
+from benchmarks.common import format_results, time_per_call
+
+
+widths = (5, 20, 50)
+
+
+def build_schemas(width):
+    """Return (query schema, body schema) with `width` fields in total, a
+    mix of strings, integers and booleans.
+    """
+    types = [colander.String, colander.Integer, colander.Boolean]
+    query = colander.SchemaNode(colander.Mapping())
+    body = colander.SchemaNode(colander.Mapping())
+    for i in xrange(width):
+        node = query if i % 2 else body
+        node.add(colander.SchemaNode(types[i % 3](), name='field%d' % i))
+    return query, body
+
+
+def build_request_data(width):
+    values = ['value', 12345, True]
+    return dict(('field%d' % i, values[i % 3]) for i in xrange(width))
+
+
+class Response(object):
+
+    def __init__(self, query, body):
+        self.query = query
+        self.body = body
+
+
+def run(number=2000, repeat=3):
+    results = {}
+    for width in widths:
+        query, body = build_schemas(width)
+        meta_schema = http.HttpMetaSchema(query=query, body=body)
+        schemas = [
+            ('colander', meta_schema),
+            ('compiled', compiled.compile_meta_schema(meta_schema)),
+        ]
+        request_data = build_request_data(width)
+        serialized = meta_schema.serialize(request_data)
+        response = Response(serialized['query'], serialized['body'])
+
+        for name, schema in schemas:
+            key = 'schema.%s.width%d' % (name, width)
+            results[key + '.serialize'] = time_per_call(
+                lambda: schema.serialize(request_data), number, repeat)
+            results[key + '.deserialize'] = time_per_call(
+                lambda: schema.deserialize(response), number, repeat)
+    return results
+
+
+if __name__ == "__main__":
+    print '\n'.join(format_results(run()))
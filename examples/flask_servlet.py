@@ -1,9 +1,8 @@
 """Example of building generic servlets with flask.
 """
 import functools
-import json
 
-from apifactory import http, factory, spec
+from apifactory import codec, compression, http, factory, spec
 
 from flask import request, Flask
 
@@ -46,15 +45,32 @@ api_add_translation = http.POST('translate/add', MultiIdSchema(), BoolSchema())
 
 app = Flask('example_flask')
 
+# Response bodies of at least 1KB are compressed for clients which accept gzip
+response_compression = compression.Compression('gzip', min_size=1024)
+
 # There is probably a better way to do this if I knew more about flask
 def build_route(api_spec):
+    body_codec = codec.get_codec(api_spec.codec or 'json')
+    body_compression = api_spec.compression or response_compression
+
     def builder(f):
 
         @functools.wraps(f)
         def servlet(*args, **kwargs):
-            data = json.loads(request.data) if api_spec.method == 'POST' else request.args
+            if api_spec.method == 'POST':
+                body = compression.decompress(
+                    request.get_data(), request.headers.get('Content-Encoding'))
+                data = body_codec.decode(body)
+            else:
+                data = request.args
             response = f(api_spec.request_schema.deserialize(data))
-            return json.dumps(api_spec.response_schema.serialize(response))
+            body, content_encoding = body_compression.compress_response(
+                body_codec.encode(api_spec.response_schema.serialize(response)),
+                request.headers.get('Accept-Encoding'))
+            headers = {'Content-Type': body_codec.content_type}
+            if content_encoding:
+                headers['Content-Encoding'] = content_encoding
+            return body, 200, headers
 
         url = '/%s' % api_spec.name
         app.add_url_rule(url, None, servlet, methods=[api_spec.method])
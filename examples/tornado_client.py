@@ -0,0 +1,34 @@
+"""An example of a non-blocking client using the tornado IOLoop. All of the
+requests are in flight at the same time.
+"""
+import colander
+from tornado import gen, ioloop
+
+from apifactory import http, spec, schemas, tornado_http
+
+
+class QuerySchema(colander.MappingSchema):
+    q = colander.SchemaNode(colander.String())
+
+
+query_schema = http.HttpMetaSchema(query=QuerySchema())
+
+api_search = http.GET('search', query_schema, schemas.RawSchema)
+
+
+transport = tornado_http.TornadoHTTPTransport('google.com', 80)
+client_mapping = {
+    'search': spec.ClientSpec(api_search, tornado_http.DEFAULT_GET)
+}
+
+http_client = tornado_http.build_client(client_mapping, transport)
+
+
+@gen.coroutine
+def main():
+    responses = yield [http_client.search(q=q) for q in ('stars', 'planets')]
+    for response in responses:
+        print "Found %s stars" % response.body.count('stars')
+
+
+ioloop.IOLoop.current().run_sync(main)
@@ -0,0 +1,68 @@
+"""Example of serving APISpecs with the apifactory WSGI servlet. This is the
+same service as flask_servlet.py, without a framework.
+"""
+from wsgiref import simple_server
+
+from apifactory import http, servlet, spec
+
+
+class IdSchema(object):
+
+    def serialize(self, request_data):
+        return request_data
+
+    def deserialize(self, request):
+        try:
+            return int(request.query['id'])
+        except (KeyError, ValueError), e:
+            raise http.HTTPBadRequest("Invalid id: %s" % e)
+
+
+class ResponseSchema(object):
+
+    def serialize(self, response):
+        return response
+
+    def deserialize(self, response):
+        return response
+
+
+class MultiIdSchema(object):
+
+    def serialize(self, from_id, to_id):
+        return {
+            'fromid': from_id,
+            'toid': to_id
+        }
+
+    def deserialize(self, request):
+        try:
+            return int(request.body['fromid']), int(request.body['toid'])
+        except (KeyError, TypeError, ValueError), e:
+            raise http.HTTPBadRequest("Invalid ids: %s" % e)
+
+
+api_translate = http.GET('translate', IdSchema(), ResponseSchema())
+api_add_translation = http.POST('translate/add', MultiIdSchema(), ResponseSchema())
+
+
+mapping = {}
+
+
+def translate(id):
+    return dict(id=mapping.get(id, 0))
+
+
+def add_translation((from_id, to_id)):
+    mapping[from_id] = to_id
+    return dict(bool=True)
+
+
+app = servlet.build_servlet([
+    spec.ViewSpec(api_translate, translate),
+    spec.ViewSpec(api_add_translation, add_translation),
+])
+
+
+if __name__ == "__main__":
+    simple_server.make_server('localhost', 5000, app).serve_forever()
@@ -0,0 +1,178 @@
+import time
+
+import mock
+from testify import TestCase, assert_equal, setup
+from testify.assertions import assert_raises
+
+from apifactory import balancer, factory, http, spec, strategy
+
+
+def build_response(status_code, host=None):
+    return mock.Mock(spec=['status_code', 'host'],
+                     status_code=status_code, host=host)
+
+
+def build_hosts(count):
+    return [balancer.Host(('host%s' % i, 80), None) for i in range(count)]
+
+
+class BalancerTestCase(TestCase):
+
+    @setup
+    def setup_hosts(self):
+        self.hosts = build_hosts(3)
+
+    def test_round_robin(self):
+        chooser = balancer.RoundRobin()
+        chosen = [chooser.choose(self.hosts) for _ in range(6)]
+        assert_equal(chosen, self.hosts * 2)
+
+    def test_least_outstanding(self):
+        self.hosts[0].outstanding = 2
+        self.hosts[1].outstanding = 1
+        self.hosts[2].outstanding = 3
+        assert_equal(balancer.LeastOutstanding().choose(self.hosts),
+                     self.hosts[1])
+
+    def test_power_of_two_choices(self):
+        self.hosts[0].outstanding = 5
+        self.hosts[1].outstanding = 5
+        self.hosts[2].outstanding = 0
+        chooser = balancer.PowerOfTwoChoices()
+        chosen = set(chooser.choose(self.hosts) for _ in range(50))
+        # The most loaded host only wins when it is paired with the other one
+        assert self.hosts[2] in chosen
+
+    def test_power_of_two_choices_one_host(self):
+        assert_equal(balancer.PowerOfTwoChoices().choose(self.hosts[:1]),
+                     self.hosts[0])
+
+
+class LoadBalancingTransportTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.transports = {}
+        def transport_factory(host, port):
+            transport = mock.create_autospec(http.PooledHTTPTransport)
+            transport.send.return_value = build_response(200)
+            self.transports[host] = transport
+            return transport
+        self.transport = balancer.LoadBalancingTransport(
+            [('a', 80), ('b', 80), ('c', 80)],
+            transport_factory=transport_factory,
+            eject_after=2,
+            eject_time=30)
+        self.request = self.transport.build(mock.Mock(), {})
+
+    def hosts_sent_to(self):
+        return sorted(host for host, transport in self.transports.items()
+                      for _ in range(transport.send.call_count))
+
+    def fail(self, host):
+        self.transports[host].send.return_value = build_response(503)
+
+    def test_build(self):
+        assert_equal(self.request.request,
+                     self.transports['a'].build.return_value)
+
+    def test_send_round_robin(self):
+        for _ in range(6):
+            self.transport.send(self.transport.build(mock.Mock(), {}))
+        assert_equal(self.hosts_sent_to(), ['a', 'a', 'b', 'b', 'c', 'c'])
+        assert_equal([host.outstanding for host in self.transport.hosts],
+                     [0, 0, 0])
+
+    def test_send_unwraps_request(self):
+        self.transport.send(self.request, 1234)
+        self.transports['a'].send.assert_called_with(self.request.request, 1234)
+
+    def test_retry_goes_to_different_host(self):
+        for _ in range(3):
+            self.transport.send(self.request)
+        assert_equal(self.hosts_sent_to(), ['a', 'b', 'c'])
+        assert_equal(sorted(host.address[0] for host in self.request.hosts),
+                     ['a', 'b', 'c'])
+
+    def test_eject_failing_host(self):
+        self.fail('a')
+        for _ in range(6):
+            self.transport.send(self.transport.build(mock.Mock(), {}))
+        # a fails on the 1st and 3rd request, and is ejected
+        assert_equal(self.hosts_sent_to(), ['a', 'a', 'b', 'b', 'c', 'c'])
+        assert self.transport.hosts[0].is_ejected(time.time())
+
+        for _ in range(4):
+            self.transport.send(self.transport.build(mock.Mock(), {}))
+        assert_equal(self.transports['a'].send.call_count, 2)
+
+    def test_ejected_host_returns(self):
+        self.fail('a')
+        host = self.transport.hosts[0]
+        for _ in range(6):
+            self.transport.send(self.transport.build(mock.Mock(), {}))
+        assert host.is_ejected(time.time())
+        assert not host.is_ejected(time.time() + 31)
+
+    def test_success_resets_failures(self):
+        host = self.transport.hosts[0]
+        self.transport.finish(host, False)
+        host.outstanding = 1
+        self.transport.finish(host, True)
+        assert_equal(host.failures, 0)
+
+    def test_send_exception_is_failure(self):
+        self.transports['a'].send.side_effect = strategy.DeadlineExceeded()
+        assert_raises(strategy.DeadlineExceeded,
+                      self.transport.send, self.request)
+        host = self.transport.hosts[0]
+        assert_equal((host.outstanding, host.failures), (0, 1))
+
+    def test_client_error_is_not_failure(self):
+        self.transports['a'].send.return_value = build_response(404)
+        self.transport.send(self.request)
+        assert_equal(self.transport.hosts[0].failures, 0)
+
+    def test_all_hosts_ejected(self):
+        for host in self.transport.hosts:
+            host.ejected_until = time.time() + 30
+        self.transport.send(self.request)
+        assert_equal(self.hosts_sent_to(), ['a'])
+
+    def test_send_future(self):
+        future = mock.Mock()
+        self.transports['a'].send.return_value = future
+        assert_equal(self.transport.send(self.request), future)
+        host = self.transport.hosts[0]
+        assert_equal(host.outstanding, 1)
+
+        (callback,), _ = future.add_done_callback.call_args
+        future.exception.return_value = None
+        future.result.return_value = build_response(503)
+        callback(future)
+        assert_equal((host.outstanding, host.failures), (0, 1))
+
+    def test_no_addresses(self):
+        assert_raises(ValueError, balancer.LoadBalancingTransport, [])
+
+
+class RetryClientTestCase(TestCase):
+
+    def test_retry_with_load_balancing(self):
+        transports = {}
+        def transport_factory(host, port):
+            transport = mock.create_autospec(http.PooledHTTPTransport)
+            status = 503 if host == 'down' else 200
+            transport.send.return_value = build_response(status, host)
+            transport.receive.side_effect = (
+                lambda api_spec, response: response.host)
+            transports[host] = transport
+            return transport
+        transport = balancer.LoadBalancingTransport(
+            [('down', 80), ('up', 80)], transport_factory=transport_factory)
+        request_spec = spec.RequestSpec(
+            http.HTTPRetryStrategy(retry_count=2), http.HTTPErrorStrategy())
+        client = factory.build_client(
+            {'get': spec.ClientSpec(mock.Mock(), request_spec)}, transport)
+        assert_equal(client.get(), 'up')
+        assert_equal(transports['down'].send.call_count, 1)
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import mock
+from testify import TestCase, assert_equal, assert_lte, setup
+from testify.assertions import assert_raises
+
+from apifactory import batching, factory, strategy
+from apifactory.spec import APISpec, BatchSpec, ClientSpec, RequestSpec
+
+
+def call_concurrently(func, kwargs_list):
+    """Call func(**kwargs) for each kwargs from a thread each. Returns the
+    results (or errors) in order.
+    """
+    results = [None] * len(kwargs_list)
+
+    def call(index, kwargs):
+        try:
+            results[index] = func(**kwargs)
+        except Exception, e:
+            results[index] = e
+    threads = [threading.Thread(target=call, args=item)
+               for item in enumerate(kwargs_list)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class CombineSplitTestCase(TestCase):
+
+    def test_collect_values(self):
+        combine = batching.collect_values('id', 'ids')
+        assert_equal(combine([{'id': 3}, {'id': 1}, {'id': 3}]),
+                     {'ids': [3, 1]})
+
+    def test_split_by_key(self):
+        split = batching.split_by_key('id', default=0)
+        assert_equal(split([{'id': 3}, {'id': 1}, {'id': 3}], {3: 30}),
+                     [30, 0, 30])
+
+
+class BatchingCallTestCase(TestCase):
+
+    @setup
+    def setup_call(self):
+        self.bulk_call = mock.Mock(
+            side_effect=lambda ids: dict((id, id * 10) for id in ids))
+        self.batch_spec = BatchSpec(None,
+                                    batching.collect_values('id', 'ids'),
+                                    batching.split_by_key('id'),
+                                    max_items=100,
+                                    window=0.05)
+        self.call = batching.BatchingCall(self.bulk_call, self.batch_spec)
+
+    def test_single_call(self):
+        assert_equal(self.call(id=2), 20)
+        self.bulk_call.assert_called_once_with(ids=[2])
+
+    def test_calls_are_batched(self):
+        results = call_concurrently(self.call, [{'id': i} for i in range(20)])
+        assert_equal(results, [i * 10 for i in range(20)])
+        assert_equal(self.bulk_call.call_count, 1)
+        _, kwargs = self.bulk_call.call_args
+        assert_equal(sorted(kwargs['ids']), range(20))
+
+    def test_max_items(self):
+        self.call.max_items = 5
+        self.call.window = 5
+        start = time.time()
+        results = call_concurrently(self.call, [{'id': i} for i in range(10)])
+        assert_lte(time.time() - start, 1)
+        assert_equal(results, [i * 10 for i in range(10)])
+        assert_equal(self.bulk_call.call_count, 2)
+
+    def test_bulk_call_error(self):
+        self.bulk_call.side_effect = strategy.ServiceNotAvailable()
+        results = call_concurrently(self.call, [{'id': i} for i in range(3)])
+        assert_equal(self.bulk_call.call_count, 1)
+        for result in results:
+            assert isinstance(result, strategy.ServiceNotAvailable)
+
+    def test_item_error(self):
+        self.call.split = lambda kwargs_list, result: [
+            KeyError(kwargs['id']) if kwargs['id'] == 1 else result[kwargs['id']]
+            for kwargs in kwargs_list]
+        results = call_concurrently(self.call, [{'id': i} for i in range(3)])
+        assert_equal(results[0], 0)
+        assert isinstance(results[1], KeyError)
+        assert_equal(results[2], 20)
+
+    def test_wrong_number_of_results(self):
+        self.call.split = lambda kwargs_list, result: []
+        assert_raises(ValueError, self.call, id=1)
+
+    def test_deadline(self):
+        self.bulk_call.side_effect = lambda **kwargs: time.sleep(0.5)
+        leader = threading.Thread(target=self.call, kwargs={'id': 1})
+        leader.start()
+        time.sleep(0.01)
+        assert_raises(strategy.DeadlineExceeded, self.call, id=2, _deadline=0.1)
+        leader.join()
+
+    def test_deadline_passed_to_bulk_call(self):
+        self.bulk_call.side_effect = None
+        self.call.split = lambda kwargs_list, result: [None]
+        self.call(id=1, _deadline=3)
+        _, kwargs = self.bulk_call.call_args
+        assert_equal(kwargs['ids'], [1])
+        # Less the time the call waited for the window
+        assert_lte(kwargs['_deadline'], 3 - self.call.window)
+        assert_lte(2, kwargs['_deadline'])
+
+    def test_deadline_passed_while_waiting(self):
+        assert_raises(strategy.DeadlineExceeded, self.call, id=1, _deadline=0.01)
+        assert_equal(self.bulk_call.mock_calls, [])
+
+    def test_dispatch_base_exception(self):
+        self.bulk_call.side_effect = KeyboardInterrupt()
+        batch = batching.Batch()
+        batch.calls.append({'id': 1})
+        self.call.dispatch(batch)
+        assert batch.done.is_set()
+        assert_raises(KeyboardInterrupt, batch.result, 0)
+
+
+class BatchedClientTestCase(TestCase):
+
+    def test_build_client(self):
+        api_single = APISpec('translate', 'GET', None, None)
+        api_bulk = APISpec('translate/multi', 'GET', None, None)
+        transport = mock.Mock()
+        transport.build.side_effect = lambda api_spec, data: (api_spec, data)
+        transport.send.side_effect = lambda request: request
+        transport.receive.side_effect = lambda api_spec, response: dict(
+            (id, id + 100) for id in response[1]['ids'])
+        batch_spec = BatchSpec(api_bulk,
+                               batching.collect_values('id', 'ids'),
+                               batching.split_by_key('id'),
+                               window=0.05)
+        request_spec = RequestSpec(strategy.NoRetryStrategy(),
+                                   strategy.NoErrorStrategy(),
+                                   batch_spec=batch_spec)
+        client = factory.build_client(
+            {'translate': ClientSpec(api_single, request_spec)}, transport)
+
+        results = client.batch('translate', [{'id': i} for i in range(10)])
+        assert_equal([result.value for result in results], range(100, 110))
+        assert_lte(transport.send.call_count, 2)
+        for (api_spec, _), _ in transport.build.call_args_list:
+            assert_equal(api_spec, api_bulk)
@@ -0,0 +1,82 @@
+import mock
+from testify import TestCase, assert_equal, setup
+from testify.assertions import assert_raises
+
+from apifactory import cache
+
+
+class LRUCacheTestCase(TestCase):
+
+    @setup
+    def setup_cache(self):
+        self.cache = cache.LRUCache(max_size=2)
+
+    def test_get_missing(self):
+        assert_equal(self.cache.get('one', 'default'), 'default')
+        assert_equal(self.cache.stats, cache.CacheStats(0, 1, 0))
+
+    def test_set_and_get(self):
+        self.cache.set('one', 1, 10)
+        assert_equal(self.cache.get('one'), 1)
+        assert_equal(self.cache.stats, cache.CacheStats(1, 0, 0))
+
+    @mock.patch('apifactory.cache.time.time', autospec=True)
+    def test_get_expired(self, mock_time):
+        mock_time.return_value = 100
+        self.cache.set('one', 1, 10)
+        mock_time.return_value = 110
+        assert_equal(self.cache.get('one'), None)
+        assert_equal(len(self.cache), 0)
+        assert_equal(self.cache.stats, cache.CacheStats(0, 1, 0))
+
+    def test_set_evicts_least_recently_used(self):
+        self.cache.set('one', 1, 10)
+        self.cache.set('two', 2, 10)
+        self.cache.get('one')
+        self.cache.set('three', 3, 10)
+        assert_equal(self.cache.get('two'), None)
+        assert_equal(self.cache.get('one'), 1)
+        assert_equal(self.cache.get('three'), 3)
+        assert_equal(self.cache.stats, cache.CacheStats(3, 1, 1))
+
+    def test_set_replaces(self):
+        self.cache.set('one', 1, 10)
+        self.cache.set('one', 2, 10)
+        assert_equal(self.cache.get('one'), 2)
+        assert_equal(len(self.cache), 1)
+
+    def test_clear(self):
+        self.cache.set('one', 1, 10)
+        self.cache.clear()
+        assert_equal(len(self.cache), 0)
+
+
+class CacheStrategyTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.cache = cache.LRUCache()
+        self.func = mock.Mock()
+        self.strategy = cache.CacheStrategy(self.cache, 30)
+
+    def test_fetch_miss(self):
+        assert_equal(self.strategy.fetch('request', self.func),
+                     self.func.return_value)
+        assert_equal(self.cache.get('request'), self.func.return_value)
+
+    def test_fetch_hit(self):
+        self.cache.set('request', 'response', 30)
+        assert_equal(self.strategy.fetch('request', self.func), 'response')
+        assert_equal(self.func.mock_calls, [])
+
+    def test_fetch_error_is_not_cached(self):
+        self.func.side_effect = [ValueError(), 'response']
+        assert_raises(ValueError, self.strategy.fetch, 'request', self.func)
+        assert_equal(self.strategy.fetch('request', self.func), 'response')
+
+    def test_fetch_not_cacheable(self):
+        self.strategy.key_func = lambda request: None
+        self.strategy.fetch('request', self.func)
+        self.strategy.fetch('request', self.func)
+        assert_equal(self.func.call_count, 2)
+        assert_equal(len(self.cache), 0)
@@ -0,0 +1,70 @@
+import mock
+from testify import TestCase, assert_equal, setup, teardown
+from testify.assertions import assert_raises
+
+from apifactory import codec, interfaces
+
+
+class CodecTestCase(TestCase):
+
+    def test_json_codec(self):
+        value = {'one': [1, 2.5, u'\xe9', None, True]}
+        encoded = codec.json_codec.encode(value)
+        assert isinstance(encoded, str)
+        assert_equal(codec.json_codec.decode(encoded), value)
+        assert_equal(codec.json_codec.content_type, 'application/json')
+
+
+class RegistryTestCase(TestCase):
+
+    @setup
+    def setup_registry(self):
+        self.registry = dict(codec._registry)
+
+    @teardown
+    def restore_registry(self):
+        codec._registry.clear()
+        codec._registry.update(self.registry)
+
+    def test_get_codec(self):
+        assert_equal(codec.get_codec('json'), codec.json_codec)
+
+    def test_get_codec_instance(self):
+        instance = mock.create_autospec(interfaces.ICodec)
+        assert_equal(codec.get_codec(instance), instance)
+
+    def test_get_codec_unknown(self):
+        assert_raises(ValueError, codec.get_codec, 'xml')
+
+    def test_register(self):
+        custom = codec.Codec('custom', 'text/plain', str, str)
+        assert_equal(codec.register(custom), custom)
+        assert_equal(codec.get_codec('custom'), custom)
+
+
+class FindJsonCodecTestCase(TestCase):
+
+    def test_find_json_codec_preference(self):
+        json_codec = codec.find_json_codec(['not_a_json_module', 'json'])
+        import json
+        assert_equal(json_codec.encode, json.dumps)
+        assert_equal(json_codec.name, 'json')
+
+    def test_find_json_codec_none_installed(self):
+        assert_raises(ImportError, codec.find_json_codec, ['not_a_json_module'])
+
+
+class LazyCodecTestCase(TestCase):
+
+    def test_loaded_on_first_use(self):
+        load = mock.Mock(return_value=codec.Codec('json', 'a/b', str, int))
+        lazy = codec.LazyCodec('json', 'application/json', load)
+        assert_equal(lazy.content_type, 'application/json')
+        assert_equal(load.mock_calls, [])
+        assert_equal(lazy.decode('3'), 3)
+        assert_equal(lazy.encode(3), '3')
+        assert_equal(load.call_count, 1)
+
+    def test_unknown_attribute(self):
+        lazy = codec.LazyCodec('json', 'application/json', mock.Mock())
+        assert_raises(AttributeError, getattr, lazy, 'other')
@@ -0,0 +1,137 @@
+import itertools
+
+import colander
+import mock
+from testify import TestCase, assert_equal, setup
+from testify.assertions import assert_raises
+
+from apifactory import compat, compiled, http, schemas
+
+
+def build_schema():
+    tag = colander.SchemaNode(colander.Mapping(), name='tag')
+    tag.add(colander.SchemaNode(colander.String(), name='label'))
+    tag.add(colander.SchemaNode(colander.Int(), name='weight', missing=0))
+
+    tags = colander.SchemaNode(colander.Sequence(), name='tags', missing=[])
+    tags.add(tag)
+
+    body = colander.SchemaNode(colander.Mapping())
+    body.add(colander.SchemaNode(colander.String(), name='name'))
+    body.add(colander.SchemaNode(colander.Int(), name='rank',
+             validator=colander.Range(0, 9999)))
+    body.add(colander.SchemaNode(colander.Bool(), name='active',
+             missing=compat.drop, default=True))
+    body.add(tags)
+    return body
+
+
+class CompileSchemaTestCase(TestCase):
+
+    @setup
+    def setup_schema(self):
+        self.schema = build_schema()
+        self.compiled = compiled.compile_schema(self.schema)
+
+    def assert_identical(self, method, value):
+        try:
+            expected = getattr(self.schema, method)(value)
+        except colander.Invalid:
+            assert_raises(colander.Invalid,
+                          getattr(self.compiled, method), value)
+            return
+        actual = getattr(self.compiled, method)(value)
+        assert compiled.is_identical(actual, expected), (actual, expected)
+
+    def test_compile_schema(self):
+        assert isinstance(self.compiled, compiled.CompiledSchema)
+        assert_equal(self.compiled.children, self.schema.children)
+
+    def test_serialize_identical(self):
+        names = [colander.null, 'Joe', u'Jo\xe9', 3]
+        ranks = [colander.null, 1, '12', 'x']
+        actives = [colander.null, True, False, 0]
+        tags = [colander.null, [], [{'label': 'a', 'weight': 2}, {}], 'bad']
+        for name, rank, active, tag in itertools.product(
+                names, ranks, actives, tags):
+            value = dict(name=name, rank=rank, active=active, tags=tag)
+            self.assert_identical('serialize', value)
+
+    def test_deserialize_identical(self):
+        names = [colander.null, '', 'Joe', u'Jo\xe9', 3]
+        ranks = [colander.null, '12', 12, '-1', 'x']
+        actives = [colander.null, 'true', 'false', '0', 'yes']
+        tags = [colander.null, [], [{'label': 'a', 'weight': '2'}, {}],
+                [{'label': 'a'}], 'bad']
+        for name, rank, active, tag in itertools.product(
+                names, ranks, actives, tags):
+            value = dict(name=name, rank=rank, active=active, tags=tag)
+            self.assert_identical('deserialize', value)
+
+    def test_invalid_raises_colander_error(self):
+        value = {'name': 'a', 'rank': 10000, 'tags': []}
+        assert_raises(colander.Invalid, self.compiled.deserialize, value)
+
+    def test_compile_schema_unsupported_type(self):
+        self.schema.add(colander.SchemaNode(colander.Float(), name='score'))
+        assert self.schema is compiled.compile_schema(self.schema)
+
+    def test_compile_schema_type_options(self):
+        bool_node = colander.SchemaNode(colander.Bool(), name='active')
+        bool_node.typ.false_choices = ('no',)
+        string_node = colander.SchemaNode(
+            colander.String(encoding='utf-8'), name='name')
+        for node in [bool_node, string_node]:
+            schema = colander.SchemaNode(colander.Mapping())
+            schema.add(node)
+            assert schema is compiled.compile_schema(schema)
+
+    def test_compile_schema_not_colander(self):
+        assert schemas.RawSchema is compiled.compile_schema(schemas.RawSchema)
+
+    def test_compile_schema_fails_verification(self):
+        with mock.patch.object(compiled, 'verify', return_value=False):
+            assert self.schema is compiled.compile_schema(self.schema)
+
+
+class VerifyTestCase(TestCase):
+
+    def test_verify(self):
+        assert compiled.verify(int, int, ['1', 2])
+
+    def test_verify_different_output(self):
+        assert not compiled.verify(str, unicode, ['1'])
+
+    def test_verify_compiled_accepts_invalid(self):
+        assert not compiled.verify(str, int, ['x'])
+
+    def test_verify_compiled_rejects_valid(self):
+        assert compiled.verify(int, str, ['x'])
+
+
+class CompileMetaSchemaTestCase(TestCase):
+
+    @setup
+    def setup_schema(self):
+        self.path_schema = colander.SchemaNode(colander.Mapping())
+        self.path_schema.add(colander.SchemaNode(colander.String(), name='id'))
+        self.meta_schema = http.HttpMetaSchema(
+            body=build_schema(), path=self.path_schema,
+            headers=schemas.EmptySchema)
+        self.compiled = compiled.compile_meta_schema(self.meta_schema)
+
+    def test_compile_meta_schema(self):
+        assert isinstance(self.compiled.schemas['body'], compiled.CompiledSchema)
+        assert isinstance(self.compiled.schemas['path'], compiled.CompiledSchema)
+        assert self.compiled.schemas['headers'] is schemas.EmptySchema
+
+    def test_serialize(self):
+        source = {'id': 3, 'name': 'Joe', 'rank': 7, 'extra': 9}
+        assert_equal(self.compiled.serialize(source),
+                     self.meta_schema.serialize(source))
+
+    def test_deserialize(self):
+        response = mock.Mock(body={'name': 'Joe', 'rank': '7'},
+                             path={'id': 3}, headers={})
+        assert_equal(self.compiled.deserialize(response),
+                     self.meta_schema.deserialize(response))
@@ -0,0 +1,103 @@
+import StringIO
+import zlib
+
+from testify import TestCase, assert_equal, setup
+from testify.assertions import assert_raises
+
+from apifactory import compression
+
+
+DATA = '{"items": [%s]}' % ', '.join(str(i) for i in range(1000))
+
+
+class EncodingTestCase(TestCase):
+
+    def test_round_trip(self):
+        for name, encoding in compression.encodings.items():
+            compressed = encoding.compress(DATA, 6)
+            assert len(compressed) < len(DATA)
+            assert_equal(compression.decompress(compressed, name), DATA)
+
+    def test_decompress_raw_deflate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(DATA) + compressor.flush()
+        assert_equal(compression.decompress(compressed, 'deflate'), DATA)
+
+    def test_decompress_unsupported(self):
+        assert_equal(compression.decompress(DATA, 'br'), DATA)
+        assert_equal(compression.get_decompressor(None), None)
+
+    def test_accept_encoding(self):
+        accepted = compression.get_accept_encoding().split(', ')
+        assert_equal(sorted(accepted), sorted(compression.encodings))
+
+
+class ChooseEncodingTestCase(TestCase):
+
+    def test_choose_encoding(self):
+        choose = compression.choose_encoding
+        assert_equal(choose('gzip, deflate', ['deflate', 'gzip']), 'deflate')
+        assert_equal(choose('deflate;q=0.5', ['gzip', 'deflate']), 'deflate')
+        assert_equal(choose('*', ['gzip']), 'gzip')
+
+    def test_choose_encoding_none(self):
+        choose = compression.choose_encoding
+        assert_equal(choose(None, ['gzip']), None)
+        assert_equal(choose('gzip;q=0', ['gzip']), None)
+        assert_equal(choose('br', ['gzip']), None)
+
+
+class CompressionTestCase(TestCase):
+
+    @setup
+    def setup_compression(self):
+        self.compression = compression.Compression('gzip', min_size=100)
+
+    def test_compress(self):
+        headers = {'Content-Type': 'application/json'}
+        body, compressed_headers = self.compression.compress(DATA, headers)
+        assert_equal(compressed_headers, {'Content-Type': 'application/json',
+                                          'Content-Encoding': 'gzip'})
+        assert_equal(compression.decompress(body, 'gzip'), DATA)
+        assert_equal(headers, {'Content-Type': 'application/json'})
+
+    def test_compress_below_threshold(self):
+        assert_equal(self.compression.compress('small', None), ('small', None))
+        assert_equal(self.compression.compress(None, {}), (None, {}))
+
+    def test_compress_response(self):
+        body, encoding = self.compression.compress_response(DATA, 'gzip')
+        assert_equal(encoding, 'gzip')
+        assert_equal(compression.decompress(body, 'gzip'), DATA)
+
+    def test_compress_response_not_accepted(self):
+        for accept_encoding in [None, 'deflate']:
+            assert_equal(
+                self.compression.compress_response(DATA, accept_encoding),
+                (DATA, None))
+
+    def test_unsupported_encoding(self):
+        assert_raises(ValueError, compression.Compression, 'br')
+
+
+class DecompressingBodyTestCase(TestCase):
+
+    def build_body(self, name='gzip'):
+        compressed = compression.encodings[name].compress(DATA, 6)
+        return compression.DecompressingBody(
+            StringIO.StringIO(compressed), compression.get_decompressor(name))
+
+    def test_read(self):
+        body = self.build_body()
+        chunks = iter(lambda: body.read(16), '')
+        assert_equal(''.join(chunks), DATA)
+        assert_equal(body.read(16), '')
+
+    def test_iter(self):
+        assert_equal(''.join(self.build_body('deflate')), DATA)
+
+    def test_close(self):
+        body = self.build_body()
+        body.close()
+        assert body.body.closed
+        assert_equal(body.read(), '')
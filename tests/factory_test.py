@@ -1,8 +1,11 @@
-from testify import TestCase, setup, assert_equal
+import threading
+import time
+
+from testify import TestCase, setup, assert_equal, assert_lt, assert_lte
 import mock
-from testify.assertions import assert_raises_and_contains
+from testify.assertions import assert_raises, assert_raises_and_contains
 
-from apifactory import interfaces, factory
+from apifactory import interfaces, factory, strategy
 from apifactory.spec import ClientSpec, APISpec, RequestSpec
 
 
@@ -54,4 +57,221 @@ class APIClientTestCase(TestCase):
         method_name = 'missing_method'
         assert_raises_and_contains(AttributeError,
             method_name,
-            getattr, self.client, method_name)
\ No newline at end of file
+            getattr, self.client, method_name)
+
+    def test_methods_are_compiled(self):
+        assert_equal(set(self.client_mapping) - set(vars(self.client)), set())
+        assert self.client.get_one is self.client.get_one
+
+
+class BuildCallTestCase(TestCase):
+
+    @setup
+    def setup_call(self):
+        self.api_spec = APISpec('one', 'GET',
+                                mock.create_autospec(interfaces.ISchema),
+                                mock.create_autospec(interfaces.ISchema))
+        self.request_spec = RequestSpec(
+            mock.create_autospec(interfaces.IRetryStrategy),
+            mock.create_autospec(interfaces.IErrorStrategy))
+        self.request_spec.retry_strategy.retry.side_effect = lambda f: f()
+        self.request_spec.error_strategy.handle.side_effect = lambda f: f()
+        self.transport = mock.create_autospec(interfaces.ITransport)
+
+    def test_build_call(self):
+        call = factory.build_call(self.api_spec, self.request_spec,
+                                  self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        self.transport.build.assert_called_with(self.api_spec, {'id': 3})
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value)
+        self.transport.receive.assert_called_with(
+            self.api_spec, self.transport.send.return_value)
+
+    @mock.patch('apifactory.factory.time.time', autospec=True)
+    def test_build_call_deadline(self, mock_time):
+        mock_time.return_value = 100
+        call = factory.build_call(self.api_spec, self.request_spec,
+                                  self.transport)
+        self.request_spec.retry_strategy.retry.side_effect = lambda f, d: f()
+        self.request_spec.error_strategy.handle.side_effect = lambda f, d: f()
+        call(id=3, _deadline=0.5)
+        self.transport.build.assert_called_with(self.api_spec, {'id': 3})
+        self.request_spec.retry_strategy.retry.assert_called_with(
+            mock.ANY, 100.5)
+        self.request_spec.error_strategy.handle.assert_called_with(
+            mock.ANY, 100.5)
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value, 100.5)
+
+    @mock.patch('apifactory.factory.time.time', autospec=True)
+    def test_build_call_default_deadline(self, mock_time):
+        mock_time.return_value = 100
+        request_spec = self.request_spec._replace(deadline=2)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        self.request_spec.retry_strategy.retry.side_effect = lambda f, d: f()
+        self.request_spec.error_strategy.handle.side_effect = lambda f, d: f()
+        call(id=3)
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value, 102)
+
+    def test_build_call_with_cache_strategy(self):
+        cache_strategy = mock.create_autospec(interfaces.ICacheStrategy)
+        cache_strategy.fetch.side_effect = lambda request, func: func()
+        request_spec = self.request_spec._replace(cache_strategy=cache_strategy)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        cache_strategy.fetch.assert_called_with(
+            self.transport.build.return_value, mock.ANY)
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value)
+
+    def test_build_call_cache_hit(self):
+        cache_strategy = mock.create_autospec(interfaces.ICacheStrategy)
+        request_spec = self.request_spec._replace(cache_strategy=cache_strategy)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        call(id=3)
+        assert_equal(self.transport.send.mock_calls, [])
+        self.transport.receive.assert_called_with(
+            self.api_spec, cache_strategy.fetch.return_value)
+
+    def test_build_call_with_hedge_strategy(self):
+        hedge_strategy = mock.create_autospec(interfaces.IHedgeStrategy)
+        hedge_strategy.hedge.side_effect = lambda func: func()
+        request_spec = self.request_spec._replace(hedge_strategy=hedge_strategy)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        assert_equal(hedge_strategy.hedge.call_count, 1)
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value)
+
+    def test_build_call_not_repeatable(self):
+        hedge_strategy = mock.create_autospec(interfaces.IHedgeStrategy)
+        request_spec = self.request_spec._replace(hedge_strategy=hedge_strategy)
+        self.transport.build.return_value = mock.Mock(repeatable=False)
+        self.transport.send.side_effect = strategy.ServiceNotAvailable()
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_raises(strategy.ServiceNotAvailable, call, id=3)
+        assert_equal(self.request_spec.retry_strategy.retry.mock_calls, [])
+        assert_equal(hedge_strategy.hedge.mock_calls, [])
+        self.transport.send.assert_called_once_with(
+            self.transport.build.return_value)
+
+    def test_build_call_hedge_strategy_not_idempotent(self):
+        hedge_strategy = mock.create_autospec(interfaces.IHedgeStrategy)
+        request_spec = self.request_spec._replace(hedge_strategy=hedge_strategy)
+        api_spec = self.api_spec._replace(method='POST')
+        call = factory.build_call(api_spec, request_spec, self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        assert_equal(hedge_strategy.hedge.mock_calls, [])
+        self.transport.send.assert_called_once_with(
+            self.transport.build.return_value)
+
+    def test_build_call_hedge_strategy_stream(self):
+        hedge_strategy = mock.create_autospec(interfaces.IHedgeStrategy)
+        request_spec = self.request_spec._replace(hedge_strategy=hedge_strategy)
+        api_spec = self.api_spec._replace(stream=True)
+        call = factory.build_call(api_spec, request_spec, self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        assert_equal(hedge_strategy.hedge.mock_calls, [])
+
+    def test_build_call_with_hedge_strategy_deadline(self):
+        hedge_strategy = mock.create_autospec(interfaces.IHedgeStrategy)
+        hedge_strategy.hedge.side_effect = lambda func, deadline: func()
+        request_spec = self.request_spec._replace(hedge_strategy=hedge_strategy)
+        self.request_spec.retry_strategy.retry.side_effect = lambda f, d: f()
+        self.request_spec.error_strategy.handle.side_effect = lambda f, d: f()
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        call(id=3, _deadline=5)
+        _, deadline = hedge_strategy.hedge.call_args[0]
+        self.transport.send.assert_called_with(
+            self.transport.build.return_value, deadline)
+
+    def test_build_call_with_concurrency_limiter(self):
+        limiter = mock.create_autospec(interfaces.IConcurrencyLimiter)
+        limiter.limit.side_effect = lambda name, func: func()
+        request_spec = self.request_spec._replace(concurrency_limiter=limiter)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_equal(call(id=3), self.transport.receive.return_value)
+        limiter.limit.assert_called_with('one', mock.ANY)
+
+    def test_build_call_concurrency_limit_exceeded(self):
+        limiter = strategy.AdaptiveConcurrencyLimiter(
+            lambda: strategy.AIMDLimit(initial_limit=1))
+        limiter.acquire('one')
+        request_spec = self.request_spec._replace(concurrency_limiter=limiter)
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_raises(strategy.ConcurrencyLimitExceeded, call, id=3)
+        assert_equal(self.transport.send.mock_calls, [])
+
+    def test_build_call_circuit_breaker_per_api_spec(self):
+        breaker = strategy.CircuitBreakerErrorStrategy(
+            self.request_spec.error_strategy, min_requests=1)
+        request_spec = self.request_spec._replace(error_strategy=breaker)
+        self.transport.send.side_effect = strategy.ServiceNotAvailable()
+        call = factory.build_call(self.api_spec, request_spec, self.transport)
+        assert_raises(strategy.ServiceNotAvailable, call, id=3)
+        assert_raises(strategy.CircuitOpen, call, id=3)
+
+        other_spec = self.api_spec._replace(name='two')
+        other_call = factory.build_call(other_spec, request_spec, self.transport)
+        self.transport.send.side_effect = None
+        assert_equal(other_call(id=3), self.transport.receive.return_value)
+        assert_equal(breaker.get_state('two'), strategy.CircuitBreaker.CLOSED)
+
+    def test_build_client_call_builder(self):
+        call_builder = mock.Mock()
+        client_mapping = {'one': ClientSpec(self.api_spec, self.request_spec)}
+        client = factory.build_client(
+            client_mapping, self.transport, call_builder=call_builder)
+        assert_equal(client.one, call_builder.return_value)
+        call_builder.assert_called_with(
+            self.api_spec, self.request_spec, self.transport)
+
+
+class CallBatchTestCase(TestCase):
+
+    def test_call_batch_in_order(self):
+        def func(id):
+            time.sleep(0.01 * (5 - id))
+            return id * 2
+        results = factory.call_batch(func, [dict(id=i) for i in range(5)], 5)
+        assert_equal(results, [factory.BatchResult(i * 2, None) for i in range(5)])
+
+    def test_call_batch_errors(self):
+        error = ValueError()
+        func = mock.Mock(side_effect=['one', error, 'three'])
+        results = factory.call_batch(func, [{}, {}, {}], concurrency=1)
+        assert_equal(results, [
+            factory.BatchResult('one', None),
+            factory.BatchResult(None, error),
+            factory.BatchResult('three', None),
+        ])
+
+    def test_call_batch_is_concurrent(self):
+        start = time.time()
+        factory.call_batch(lambda: time.sleep(0.1), [{}] * 20, concurrency=20)
+        assert_lt(time.time() - start, 1)
+
+    def test_call_batch_bounded_concurrency(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        def func():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+        factory.call_batch(func, [{}] * 20, concurrency=3)
+        assert_lte(running[1], 3)
+
+    def test_call_batch_empty(self):
+        assert_equal(factory.call_batch(mock.Mock(), []), [])
+
+    def test_batch(self):
+        client = factory.APIClient({}, mock.Mock())
+        client.translate = mock.Mock(return_value='value')
+        results = client.batch('translate', [dict(id=1)])
+        assert_equal(results, [factory.BatchResult('value', None)])
+        client.translate.assert_called_with(id=1)
@@ -0,0 +1,175 @@
+"""
+A local HTTP/2 (h2c, prior knowledge) server, run in background threads, for
+tests and benchmarks of the http2 transport.
+"""
+import itertools
+import json
+import socket
+import threading
+import urlparse
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+import h2.settings
+
+
+class H2EchoConnection(object):
+    """Serves one connection. Responds to each request with a json document
+    describing the request, like loopback.EchoHandler, including the `status`
+    and `delay` query parameters. Delayed responses do not delay the other
+    streams of the connection. The `content_encoding` query parameter is sent
+    as the content-encoding of the (uncompressed, so invalid) body.
+    """
+
+    def __init__(self, sock, connection_id, max_concurrent_streams):
+        self.sock           = sock
+        self.connection_id  = connection_id
+        self.lock           = threading.Lock()
+        self.requests       = {}
+        self.outbound       = {}
+        self.conn           = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding=None))
+        self.conn.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={
+                h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+                    max_concurrent_streams,
+            })
+
+    def serve(self):
+        with self.lock:
+            self.conn.initiate_connection()
+            self.flush()
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    return
+                with self.lock:
+                    for event in self.conn.receive_data(data):
+                        self.handle_event(event)
+                    self.flush()
+        except socket.error:
+            pass
+        finally:
+            self.sock.close()
+
+    def handle_event(self, event):
+        if isinstance(event, h2.events.RequestReceived):
+            self.requests[event.stream_id] = dict(event.headers), []
+        elif isinstance(event, h2.events.DataReceived):
+            self.conn.acknowledge_received_data(
+                event.flow_controlled_length, event.stream_id)
+            self.requests[event.stream_id][1].append(event.data)
+        elif isinstance(event, h2.events.StreamEnded):
+            self.start_response(event.stream_id)
+        elif isinstance(event, h2.events.StreamReset):
+            self.outbound.pop(event.stream_id, None)
+        elif isinstance(event, h2.events.WindowUpdated):
+            for stream_id in list(self.outbound):
+                self.send_body(stream_id)
+
+    def start_response(self, stream_id):
+        headers, chunks = self.requests.pop(stream_id)
+        url = urlparse.urlparse(headers[':path'])
+        query = dict(urlparse.parse_qsl(url.query))
+        body = json.dumps({
+            'path':         url.path,
+            'method':       headers[':method'],
+            'query':        query,
+            'data':         ''.join(chunks),
+            'headers':      dict((name, value) for name, value in headers.items()
+                                 if not name.startswith(':')),
+            'connection':   self.connection_id,
+        })
+        response_headers = [
+            (':status', query.get('status', '200')),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(body))),
+        ]
+        if 'content_encoding' in query:
+            response_headers.append(
+                ('content-encoding', query['content_encoding']))
+        delay = float(query.get('delay', 0))
+        if delay:
+            threading.Timer(delay, self.respond_later,
+                            (stream_id, response_headers, body)).start()
+        else:
+            self.respond(stream_id, response_headers, body)
+
+    def respond_later(self, stream_id, headers, body):
+        with self.lock:
+            try:
+                self.respond(stream_id, headers, body)
+                self.flush()
+            except (h2.exceptions.StreamClosedError, socket.error):
+                pass
+
+    def respond(self, stream_id, headers, body):
+        self.conn.send_headers(stream_id, headers)
+        self.outbound[stream_id] = body
+        self.send_body(stream_id)
+
+    def send_body(self, stream_id):
+        body = self.outbound[stream_id]
+        while body:
+            size = min(self.conn.local_flow_control_window(stream_id),
+                       self.conn.max_outbound_frame_size)
+            if size <= 0:
+                self.outbound[stream_id] = body
+                return
+            chunk, body = body[:size], body[size:]
+            self.conn.send_data(stream_id, chunk, end_stream=not body)
+        del self.outbound[stream_id]
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+
+class H2LoopbackServer(object):
+
+    def __init__(self, max_concurrent_streams=100):
+        self.max_concurrent_streams = max_concurrent_streams
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+        self.connection_ids = itertools.count()
+        self.connections = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except socket.error:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = H2EchoConnection(
+                sock, next(self.connection_ids), self.max_concurrent_streams)
+            self.connections.append(connection)
+            thread = threading.Thread(target=connection.serve)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        for connection in self.connections:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
@@ -0,0 +1,205 @@
+import json
+import time
+import zlib
+
+import mock
+from testify import TestCase, assert_equal, assert_lte, setup, teardown
+from testify.assertions import assert_raises
+
+from apifactory import factory, http, http2, schemas, spec, strategy
+from tests import h2_loopback
+
+
+class ResponseFutureTestCase(TestCase):
+
+    @setup
+    def setup_future(self):
+        self.future = http2.ResponseFuture()
+
+    def test_result(self):
+        self.future.set_result('response')
+        assert_equal(self.future(), 'response')
+        assert_equal(self.future.exception(), None)
+        assert self.future.done()
+
+    def test_exception(self):
+        self.future.set_exception(
+            http2.build_error(strategy.ServiceNotAvailable))
+        assert_raises(strategy.ServiceNotAvailable, self.future)
+        assert isinstance(self.future.exception(), strategy.ServiceNotAvailable)
+
+    def test_callbacks(self):
+        callback = mock.Mock()
+        self.future.add_done_callback(callback)
+        assert_equal(callback.mock_calls, [])
+        self.future.set_result('response')
+        callback.assert_called_once_with(self.future)
+
+        late_callback = mock.Mock()
+        self.future.add_done_callback(late_callback)
+        late_callback.assert_called_once_with(self.future)
+
+    def test_timeout(self):
+        self.future.on_timeout = mock.Mock()
+        assert_raises(strategy.DeadlineExceeded, self.future, timeout=0.01)
+        self.future.on_timeout.assert_called_once_with()
+        # A response which arrives afterwards is ignored
+        self.future.set_result('response')
+        assert_raises(strategy.DeadlineExceeded, self.future)
+
+    def test_deadline(self):
+        future = http2.ResponseFuture(time.time() + 0.01)
+        start = time.time()
+        assert_raises(strategy.DeadlineExceeded, future, timeout=5)
+        assert_lte(time.time() - start, 1)
+
+    def test_finished_after_deadline(self):
+        future = http2.ResponseFuture(time.time() - 1)
+        future.set_result('response')
+        assert_equal(future(), 'response')
+        assert_equal(future.exception(), None)
+
+    def test_callback_errors_are_isolated(self):
+        self.future.add_done_callback(mock.Mock(side_effect=ValueError()))
+        callback = mock.Mock()
+        self.future.add_done_callback(callback)
+        self.future.set_result('response')
+        callback.assert_called_once_with(self.future)
+        self.future.add_done_callback(mock.Mock(side_effect=ValueError()))
+
+    def test_exception_does_not_raise(self):
+        future = http2.ResponseFuture(time.time() - 1,
+                                      on_timeout=mock.Mock(side_effect=IOError()))
+        assert isinstance(future.exception(), strategy.DeadlineExceeded)
+
+
+class HTTP2TransportTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.server = h2_loopback.H2LoopbackServer().start()
+        self.transport = http2.HTTP2Transport(
+            self.server.host, self.server.port, connect_timeout=5)
+
+    @teardown
+    def teardown_server(self):
+        self.transport.close()
+        self.server.stop()
+
+    def send(self, path='what', method='GET', query=None, data=None,
+             codec=None, deadline=None):
+        request = http.HTTPRequest(path, method, query, data, None, codec=codec)
+        return self.transport.send(request, deadline)
+
+    def test_send(self):
+        response = self.send(query={'q': 'stars'})(timeout=5)
+        assert_equal(response.status_code, 200)
+        assert_equal(response.headers['content-type'], 'application/json')
+        body = json.loads(response.body)
+        assert_equal(body['path'], '/what')
+        assert_equal(body['query'], {'q': 'stars'})
+
+    def test_send_codec(self):
+        response = self.send(method='POST', data={'one': '1'}, codec='json')
+        body = json.loads(response(timeout=5).body)
+        assert_equal(body['method'], 'POST')
+        assert_equal(json.loads(body['data']), {'one': '1'})
+        assert_equal(body['headers']['content-type'], 'application/json')
+
+    def test_send_large_body(self):
+        # Larger than the initial flow control window
+        data = 'x' * (200 * 1024)
+        response = self.send(method='POST', data=data)(timeout=5)
+        assert_equal(json.loads(response.body)['data'], data)
+
+    def test_send_raw_bodies(self):
+        for data in [iter(['one', 'two']), memoryview('onetwo')]:
+            response = self.send(method='POST', data=data)(timeout=5)
+            assert_equal(json.loads(response.body)['data'], 'onetwo')
+
+    def test_late_response_with_done_callback(self):
+        late = self.send(query={'delay': 0.1}, deadline=time.time() + 0.02)
+        errors = []
+        late.add_done_callback(lambda future: errors.append(future.exception()))
+        other = self.send(query={'delay': 0.2})
+        assert_equal(other(timeout=5).status_code, 200)
+        assert_equal(errors, [None])
+        assert_equal(late().status_code, 200)
+        assert_equal(len(self.transport.connections), 1)
+
+    def test_send_corrupt_compressed_body(self):
+        future = self.send(query={'content_encoding': 'gzip'})
+        assert_raises(zlib.error, future, timeout=5)
+        # The connection is still usable
+        assert_equal(self.send()(timeout=5).status_code, 200)
+        assert_equal(len(self.transport.connections), 1)
+        assert not self.transport.connections[0].closed
+
+    def test_send_multiplexed(self):
+        futures = [self.send(query={'id': i, 'delay': 0.1}) for i in range(50)]
+        start = time.time()
+        bodies = [json.loads(future(timeout=5).body) for future in futures]
+        assert_lte(time.time() - start, 1)
+        assert_equal([int(body['query']['id']) for body in bodies], range(50))
+        assert_equal(set(body['connection'] for body in bodies), set([0]))
+        assert_equal(len(self.transport.connections), 1)
+
+    def test_send_opens_connections(self):
+        self.transport.max_streams = 1
+        futures = [self.send(query={'delay': 0.1}) for _ in range(4)]
+        connections = set(json.loads(future(timeout=5).body)['connection']
+                          for future in futures)
+        assert_equal(connections, set([0, 1]))
+
+    def test_send_error_status(self):
+        response = self.send(query={'status': 503})(timeout=5)
+        assert_equal(response.status_code, 503)
+
+    def test_send_deadline(self):
+        future = self.send(query={'delay': 0.5}, deadline=time.time() + 0.05)
+        assert_raises(strategy.DeadlineExceeded, future, timeout=5)
+        # The connection is still usable
+        assert_equal(self.send()(timeout=5).status_code, 200)
+
+    def test_send_deadline_passed(self):
+        assert_raises(strategy.DeadlineExceeded,
+                      self.send, deadline=time.time() - 1)
+
+    def test_connection_closed(self):
+        future = self.send(query={'delay': 1})
+        self.server.stop()
+        assert_raises(Exception, future, timeout=5)
+        assert self.transport.connections[0].closed
+
+    def test_client(self):
+        api_spec = http.GET('items', schemas.RawSchema, schemas.RawSchema)
+        client = factory.build_client(
+            {'items': spec.ClientSpec(api_spec, http.make_async(http.DEFAULT_GET))},
+            self.transport)
+        future = client.items(query={'q': 'x'}, body=None, headers=None)
+        response = future(timeout=5)
+        assert_equal(json.loads(response.body)['query'], {'q': 'x'})
+
+
+class HTTP2StreamLimitTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.server = h2_loopback.H2LoopbackServer(
+            max_concurrent_streams=2).start()
+        self.transport = http2.HTTP2Transport(
+            self.server.host, self.server.port, connect_timeout=5)
+
+    @teardown
+    def teardown_server(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_send_over_stream_limit(self):
+        futures = [
+            self.transport.send(http.HTTPRequest(
+                'what', 'GET', {'id': i, 'delay': 0.05}, None, None))
+            for i in range(6)]
+        bodies = [json.loads(future(timeout=5).body) for future in futures]
+        assert_equal([int(body['query']['id']) for body in bodies], range(6))
+        assert_equal(len(self.transport.connections), 1)
@@ -1,10 +1,246 @@
 import colander
+import httplib
+import json
 import mock
-from testify import TestCase, assert_equal, setup
+import socket
+import StringIO
+import subprocess
+import sys
+import threading
+import time
+import requests
+from testify import TestCase, assert_equal, assert_lte, setup, teardown
 from testify.assertions import assert_raises
 
-from apifactory import http, interfaces, schemas, compat
-from apifactory import spec
+from apifactory import http, interfaces, schemas, compat, strategy, factory
+from apifactory import spec, pool, cache, compression
+from apifactory import codec as codec_module
+from tests import loopback
+
+
+class BuildRequestKeyTestCase(TestCase):
+
+    def test_build_request_key(self):
+        left = http.HTTPRequest('a', 'GET', {'q': 'x', 'id': [1, 2]}, None, None)
+        right = http.HTTPRequest('a', 'GET', {'id': [1, 2], 'q': 'x'}, None, {})
+        assert_equal(http.build_request_key(left), http.build_request_key(right))
+        hash(http.build_request_key(left))
+
+    def test_build_request_key_different_query(self):
+        left = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, None)
+        right = http.HTTPRequest('a', 'GET', {'q': 'y'}, None, None)
+        assert http.build_request_key(left) != http.build_request_key(right)
+
+    def test_build_request_key_not_get(self):
+        request = http.HTTPRequest('a', 'POST', None, {'one': 1}, None)
+        assert_equal(http.build_request_key(request), None)
+
+    def test_build_request_key_stream(self):
+        request = http.HTTPRequest('a', 'GET', None, None, None, True)
+        assert_equal(http.build_request_key(request), None)
+
+    def test_build_cache_strategy(self):
+        response_cache = cache.LRUCache()
+        cache_strategy = http.build_cache_strategy(response_cache, 30)
+        request = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, None)
+        cache_strategy.fetch(request, lambda: 'response')
+        assert_equal(cache_strategy.fetch(request, None), 'response')
+        assert_equal(response_cache.stats, cache.CacheStats(1, 1, 0))
+
+
+class BuildFlightKeyTestCase(TestCase):
+
+    def test_build_flight_key_equal_requests(self):
+        left = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, {'h': '1'})
+        right = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, {'h': '1'})
+        assert_equal(http.build_flight_key(left), http.build_flight_key(right))
+
+    def test_build_flight_key_different_headers(self):
+        left = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, {'h': '1'})
+        right = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, {'h': '2'})
+        assert http.build_flight_key(left) != http.build_flight_key(right)
+
+    def test_build_flight_key_not_idempotent(self):
+        request = http.HTTPRequest('a', 'POST', None, None, None)
+        assert_equal(http.build_flight_key(request), None)
+
+    def test_build_flight_key_stream(self):
+        request = http.HTTPRequest('a', 'GET', None, None, None, True)
+        assert_equal(http.build_flight_key(request), None)
+
+    def test_build_flight_key_unhashable(self):
+        request = http.HTTPRequest('a', 'PUT', None, {'a': {'b': 1}}, None)
+        assert_equal(http.build_flight_key(request), None)
+
+
+class SingleFlightTransportTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.wrapped = mock.create_autospec(interfaces.ITransport)
+        self.transport = http.SingleFlightTransport(self.wrapped)
+        self.request = http.HTTPRequest('a', 'GET', {'q': 'x'}, None, None)
+
+    def send_concurrently(self, count):
+        results = factory.call_batch(
+            self.transport.send,
+            [dict(request=self.request)] * count,
+            concurrency=count)
+        return results
+
+    def test_send_collapses_concurrent_requests(self):
+        def send(request):
+            time.sleep(0.1)
+            return 'response'
+        self.wrapped.send.side_effect = send
+        results = self.send_concurrently(10)
+        assert_equal([r.value for r in results], ['response'] * 10)
+        assert_equal(self.wrapped.send.call_count, 1)
+        assert_equal(self.transport.stats, http.SingleFlightStats(10, 9))
+        assert_equal(self.transport.in_flight, {})
+
+    def test_send_shares_exception(self):
+        error = strategy.ServiceNotAvailable()
+        def send(request):
+            time.sleep(0.1)
+            raise error
+        self.wrapped.send.side_effect = send
+        results = self.send_concurrently(5)
+        assert_equal([r.error for r in results], [error] * 5)
+        assert_equal(self.wrapped.send.call_count, 1)
+
+    def test_send_shares_base_exception(self):
+        started = threading.Event()
+        release = threading.Event()
+        def send(request):
+            started.set()
+            release.wait(5)
+            raise KeyboardInterrupt()
+        self.wrapped.send.side_effect = send
+        leader_errors = []
+        def lead():
+            try:
+                self.transport.send(self.request)
+            except KeyboardInterrupt, e:
+                leader_errors.append(e)
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        threading.Timer(0.05, release.set).start()
+        assert_raises(KeyboardInterrupt, self.transport.send, self.request)
+        leader.join()
+        assert_equal(len(leader_errors), 1)
+
+    def test_send_sequential_requests_are_not_collapsed(self):
+        self.transport.send(self.request)
+        self.transport.send(self.request)
+        assert_equal(self.wrapped.send.call_count, 2)
+        assert_equal(self.transport.stats, http.SingleFlightStats(2, 0))
+
+    def test_send_deadline(self):
+        started = threading.Event()
+        def send(request, deadline):
+            started.set()
+            time.sleep(0.2)
+        self.wrapped.send.side_effect = send
+        leader = threading.Thread(target=self.transport.send,
+                                  args=(self.request, time.time() + 5))
+        leader.start()
+        started.wait(5)
+        assert_raises(strategy.DeadlineExceeded, self.transport.send,
+                      self.request, time.time() + 0.05)
+        leader.join()
+        assert_equal(self.wrapped.send.call_count, 1)
+
+    def test_send_not_idempotent(self):
+        request = self.request._replace(method='POST')
+        assert_equal(self.transport.send(request),
+                     self.wrapped.send.return_value)
+        assert_equal(self.transport.stats, http.SingleFlightStats(0, 0))
+
+    def test_build_and_receive_are_delegated(self):
+        assert_equal(self.transport.build, self.wrapped.build)
+        assert_equal(self.transport.receive, self.wrapped.receive)
+
+
+class SendCheckedTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.transport = mock.create_autospec(interfaces.ITransport)
+        self.transport.send.return_value = mock.Mock(spec=['status_code'])
+        self.transport.send.return_value.status_code = 200
+        self.finish = mock.Mock()
+
+    def send(self, deadline=None):
+        return http.send_checked(self.transport, 'request', deadline,
+                                 http.HTTPErrorStrategy(), self.finish)
+
+    def test_send_checked(self):
+        assert_equal(self.send(5), self.transport.send.return_value)
+        self.transport.send.assert_called_with('request', 5)
+        self.finish.assert_called_once_with(True)
+
+    def test_send_checked_unavailable(self):
+        self.transport.send.return_value.status_code = 503
+        self.send()
+        self.finish.assert_called_once_with(False)
+
+    def test_send_checked_error(self):
+        self.transport.send.side_effect = socket.error()
+        assert_raises(socket.error, self.send)
+        self.finish.assert_called_once_with(False)
+
+    def test_send_checked_future(self):
+        future = mock.Mock(spec=['add_done_callback', 'exception', 'result'])
+        future.exception.return_value = None
+        future.result.return_value = self.transport.send.return_value
+        self.transport.send.return_value = future
+        self.send()
+        assert_equal(self.finish.mock_calls, [])
+        (callback,), _ = future.add_done_callback.call_args
+        callback(future)
+        self.finish.assert_called_once_with(True)
+
+
+class ConcurrencyLimitedTransportTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.wrapped = mock.create_autospec(interfaces.ITransport)
+        self.wrapped.send.return_value = mock.Mock(
+            spec=['status_code'], status_code=200)
+        self.limiter = strategy.AdaptiveConcurrencyLimiter(
+            lambda: strategy.AIMDLimit(initial_limit=2, max_limit=2))
+        self.transport = http.ConcurrencyLimitedTransport(
+            self.wrapped, self.limiter)
+        self.api_spec = spec.APISpec('one', 'GET', None, None)
+        self.request = self.transport.build(self.api_spec, {})
+
+    def test_send(self):
+        response = self.transport.send(self.request, 1234)
+        assert_equal(response, self.wrapped.send.return_value)
+        self.wrapped.send.assert_called_with(
+            self.wrapped.build.return_value, 1234)
+        assert_equal(self.limiter.in_flight['one'], 0)
+
+    def test_send_rejected(self):
+        self.limiter.acquire('one')
+        self.limiter.acquire('one')
+        assert_raises(strategy.ConcurrencyLimitExceeded,
+                      self.transport.send, self.request)
+        assert_equal(self.wrapped.send.mock_calls, [])
+
+    def test_unavailable_response_is_dropped(self):
+        self.wrapped.send.return_value.status_code = 503
+        self.transport.send(self.request)
+        assert_equal(self.limiter.get_limit('one'), 1)
+
+    def test_send_error_is_dropped(self):
+        self.wrapped.send.side_effect = socket.error()
+        assert_raises(socket.error, self.transport.send, self.request)
+        assert_equal(self.limiter.get_limit('one'), 1)
+        assert_equal(self.limiter.in_flight['one'], 0)
 
 
 class HTTPTransportTestCase(TestCase):
@@ -37,17 +273,57 @@ class HTTPTransportTestCase(TestCase):
         url = self.transport.build_url(path)
         assert_equal(url, 'http://localhost:8080/what')
 
-    @mock.patch('apifactory.http.requests.request', autospec=True)
+    @mock.patch('requests.request', autospec=True)
     def test_send(self, mock_request):
-        http_request = mock.create_autospec(http.HTTPRequest, path='what')
+        http_request = http.HTTPRequest(
+            'what', 'POST', {'q': 'a'}, {'one': 1}, {'X-Id': '1'})
         response = self.transport.send(http_request)
         assert_equal(response, mock_request.return_value)
         mock_request.assert_called_with(
-            http_request.method,
+            'POST',
             'http://localhost:8080/what',
-            params=http_request.query,
-            data=http_request.data,
-            headers=http_request.headers)
+            params={'q': 'a'},
+            data='one=1',
+            headers={'X-Id': '1',
+                     'Content-Type': 'application/x-www-form-urlencoded'})
+
+    @mock.patch('requests.request', autospec=True)
+    def test_send_stream(self, mock_request):
+        http_request = mock.create_autospec(
+            http.HTTPRequest, path='what', stream=True, compression=None)
+        self.transport.send(http_request)
+        _, kwargs = mock_request.call_args
+        assert_equal(kwargs['stream'], True)
+
+    @mock.patch('requests.request', autospec=True)
+    def test_send_deadline(self, mock_request):
+        http_request = mock.create_autospec(
+            http.HTTPRequest, path='what', compression=None)
+        self.transport.send(http_request, time.time() + 5)
+        _, kwargs = mock_request.call_args
+        assert_lte(kwargs['timeout'], 5)
+
+    @mock.patch('requests.request', autospec=True)
+    def test_send_timeout(self, mock_request):
+        mock_request.side_effect = requests.Timeout()
+        http_request = mock.create_autospec(
+            http.HTTPRequest, path='what', compression=None)
+        assert_raises(strategy.DeadlineExceeded, self.transport.send,
+                      http_request, time.time() + 5)
+
+    def test_send_deadline_passed(self):
+        http_request = mock.create_autospec(http.HTTPRequest, path='what')
+        assert_raises(strategy.DeadlineExceeded, self.transport.send,
+                      http_request, time.time() - 1)
+
+    @mock.patch('requests.request', autospec=True)
+    def test_send_codec(self, mock_request):
+        http_request = http.HTTPRequest(
+            'what', 'POST', None, {'one': 1}, None, codec='json')
+        self.transport.send(http_request)
+        _, kwargs = mock_request.call_args
+        assert_equal(kwargs['data'], '{"one": 1}')
+        assert_equal(kwargs['headers'], {'Content-Type': 'application/json'})
 
     def test_receive(self):
         response = mock.Mock()
@@ -56,6 +332,379 @@ class HTTPTransportTestCase(TestCase):
         assert_equal(output, api_spec.response_schema.deserialize.return_value)
         api_spec.response_schema.deserialize.assert_called_with(response)
 
+    def test_receive_codec(self):
+        transport = http.HTTPTransport(self.host, self.port, codec='json')
+        response = mock.Mock(spec=['content'], content='{"one": 1}')
+        transport.receive(self.api_spec, response)
+        (decoded,), _ = self.schema.deserialize.call_args
+        assert_equal(decoded.body, {'one': 1})
+
+    def test_get_codec(self):
+        codec = mock.create_autospec(interfaces.ICodec)
+        transport = http.HTTPTransport(self.host, self.port, codec=codec)
+        assert_equal(transport.get_codec(None), codec)
+        assert_equal(transport.get_codec('json'), codec_module.json_codec)
+        assert_equal(self.transport.get_codec(None), None)
+
+
+class PooledHTTPTransportTestCase(TestCase):
+
+    @setup
+    def setup_transport(self):
+        self.server = loopback.LoopbackServer().start()
+        self.pool = pool.ConnectionPool(max_size=2)
+        self.transport = http.PooledHTTPTransport(
+            self.server.host, self.server.port, connection_pool=self.pool)
+
+    @teardown
+    def teardown_server(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def send(self, path='what', method='GET', query=None, data=None, codec=None):
+        request = http.HTTPRequest(path, method, query, data, None, codec=codec)
+        response = self.transport.send(request)
+        return response, json.loads(response.body)
+
+    def test_send(self):
+        response, body = self.send(query={'q': 'stars'})
+        assert_equal(response.status_code, 200)
+        assert_equal(response.headers['content-type'], 'application/json')
+        assert_equal(body['path'], '/what')
+        assert_equal(body['query'], {'q': 'stars'})
+
+    def test_send_form_data(self):
+        _, body = self.send(method='POST', data={'one': '1'})
+        assert_equal(body['data'], 'one=1')
+
+    def test_send_codec(self):
+        _, body = self.send(method='POST', data={'one': '1'}, codec='json')
+        assert_equal(json.loads(body['data']), {'one': '1'})
+
+    def test_send_reuses_connection(self):
+        _, first = self.send()
+        _, second = self.send()
+        assert_equal(first['client'], second['client'])
+        assert_equal(self.pool.stats, pool.PoolStats(1, 1, 0, 0))
+
+    def test_send_reconnects_stale_connection(self):
+        self.send()
+        for conn, _ in self.pool.idle[self.server.host, self.server.port]:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        response, _ = self.send()
+        assert_equal(response.status_code, 200)
+        assert_equal(self.pool.stats, pool.PoolStats(1, 2, 0, 0))
+
+    def test_send_reconnect_deadline(self):
+        self.send()
+        for conn, _ in self.pool.idle[self.server.host, self.server.port]:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        request = http.HTTPRequest('what', 'GET', {'delay': 0.2}, None, None)
+        assert_raises(strategy.DeadlineExceeded,
+                      self.transport.send, request, time.time() + 0.05)
+
+    def test_send_deadline(self):
+        request = http.HTTPRequest('what', 'GET', {'delay': 0.2}, None, None)
+        assert_raises(strategy.DeadlineExceeded,
+                      self.transport.send, request, time.time() + 0.05)
+        assert_equal(self.pool.in_use[self.server.host, self.server.port], 0)
+
+    def test_send_deadline_resets_timeout(self):
+        self.transport.send(
+            http.HTTPRequest('what', 'GET', None, None, None), time.time() + 5)
+        response, _ = self.send(query={'delay': 0.1})
+        assert_equal(response.status_code, 200)
+
+    def test_send_pool_timeout(self):
+        self.transport.pool_timeout = 0.01
+        for _ in range(2):
+            self.pool.acquire(self.server.host, self.server.port)
+        request = http.HTTPRequest('what', 'GET', None, None, None)
+        assert_raises(pool.PoolTimeout, self.transport.send, request)
+        assert_raises(strategy.DeadlineExceeded,
+                      self.transport.send, request, time.time() + 0.01)
+
+    def test_send_default_pool(self):
+        transport = http.PooledHTTPTransport('localhost', 80)
+        assert transport.pool is pool.get_default_pool()
+
+    def test_send_stream(self):
+        request = http.HTTPRequest('what', 'GET', {'items': 3}, None, None, True)
+        response = self.transport.send(request)
+        key = self.server.host, self.server.port
+        assert isinstance(response.body, http.StreamingBody)
+        assert_equal(self.pool.in_use[key], 1)
+
+        items = http.JsonStreamSchema().deserialize(response)
+        assert_equal(list(items), [{'id': 0}, {'id': 1}, {'id': 2}])
+        assert_equal(self.pool.in_use[key], 0)
+        assert_equal(len(self.pool.idle[key]), 1)
+
+    def test_send_stream_closed_early(self):
+        request = http.HTTPRequest('what', 'GET', {'items': 3}, None, None, True)
+        response = self.transport.send(request)
+        response.body.close()
+        key = self.server.host, self.server.port
+        assert_equal(self.pool.in_use[key], 0)
+        assert not self.pool.idle.get(key)
+
+    def test_send_stream_abandoned(self):
+        self.pool.max_size = 1
+        request = http.HTTPRequest(
+            'what', 'GET', {'items': 5000}, None, None, True)
+        response = self.transport.send(request)
+        items = http.JsonStreamSchema(chunk_size=256).deserialize(response)
+        assert_equal(next(items), {'id': 0})
+        del items
+
+        self.transport.pool_timeout = 1
+        response, _ = self.send()
+        assert_equal(response.status_code, 200)
+
+    def test_send_stream_error_status(self):
+        request = http.HTTPRequest(
+            'what', 'GET', {'status': 503}, None, None, True)
+        response = self.transport.send(request)
+        assert_equal(response.status_code, 503)
+        assert_equal(json.loads(response.body)['path'], '/what')
+        assert_equal(self.pool.in_use[self.server.host, self.server.port], 0)
+
+    def test_send_accept_encoding(self):
+        _, body = self.send()
+        assert_equal(body['headers']['accept-encoding'],
+                     compression.get_accept_encoding())
+
+    def test_send_compressed_response(self):
+        for encoding in compression.encodings:
+            response, body = self.send(query={'encoding': encoding})
+            assert 'content-encoding' not in response.headers
+            assert_equal(response.headers.get('content-length'), None)
+            assert_equal(body['query'], {'encoding': encoding})
+
+    def test_pop_decompressor(self):
+        headers = {'content-encoding': 'gzip', 'content-length': '10'}
+        assert http.pop_decompressor(headers)
+        assert_equal(headers, {})
+        headers = {'content-encoding': 'br', 'content-length': '10'}
+        assert_equal(http.pop_decompressor(headers), None)
+        assert_equal(len(headers), 2)
+
+    def test_send_stream_compressed_response(self):
+        request = http.HTTPRequest(
+            'what', 'GET', {'items': 5000, 'encoding': 'gzip'}, None, None, True)
+        response = self.transport.send(request)
+        assert isinstance(response.body, compression.DecompressingBody)
+        items = list(http.JsonStreamSchema(chunk_size=256).deserialize(response))
+        assert_equal(len(items), 5000)
+        assert_equal(items[-1], {'id': 4999})
+        key = self.server.host, self.server.port
+        assert_equal(len(self.pool.idle[key]), 1)
+
+    def test_send_compressed_request(self):
+        self.transport.compression = compression.Compression(min_size=10)
+        _, body = self.send(method='POST', data={'one': '1' * 20})
+        assert_equal(body['headers']['content-encoding'], 'gzip')
+        assert_equal(body['data'], 'one=' + '1' * 20)
+
+    def test_send_small_request_not_compressed(self):
+        self.transport.compression = compression.Compression(min_size=100)
+        _, body = self.send(method='POST', data={'one': '1'})
+        assert 'content-encoding' not in body['headers']
+        assert_equal(body['data'], 'one=1')
+
+    def test_send_generator_body(self):
+        body = (chunk for chunk in ['one', 'two', 'three'])
+        response, echo = self.send(method='POST', data=body, codec='json')
+        assert_equal(response.status_code, 200)
+        assert_equal(echo['data'], 'onetwothree')
+        assert_equal(echo['chunks'], [3, 3, 5])
+        assert_equal(echo['headers']['transfer-encoding'], 'chunked')
+        assert 'content-type' not in echo['headers']
+
+    def test_send_file_body(self):
+        _, echo = self.send(method='PUT', data=StringIO.StringIO('a' * 100000))
+        assert_equal(echo['data'], 'a' * 100000)
+        assert_equal(echo['chunks'], [64 * 1024, 100000 - 64 * 1024])
+
+    def test_send_buffer_body(self):
+        data = memoryview(bytearray('one two three'))[4:]
+        _, echo = self.send(method='POST', data=data, codec='json')
+        assert_equal(echo['data'], 'two three')
+        assert_equal(echo['chunks'], None)
+        assert_equal(echo['headers']['content-length'], '9')
+
+    def test_send_stream_body_not_retried(self):
+        self.send()
+        for conn, _ in self.pool.idle[self.server.host, self.server.port]:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        body = iter(['one'])
+        assert_raises((socket.error, httplib.HTTPException),
+                      self.send, method='POST', data=body)
+
+    def test_call_with_stream_body_not_retried(self):
+        query_schema = colander.SchemaNode(colander.Mapping())
+        query_schema.add(colander.SchemaNode(colander.String(), name='status'))
+        meta_schema = http.HttpMetaSchema(
+            body=schemas.RawBodySchema(), query=query_schema)
+        api_upload = http.POST('upload', meta_schema, schemas.RawSchema)
+        send = mock.Mock(wraps=self.transport.send)
+        with mock.patch.object(self.transport, 'send', send):
+            client = factory.build_client(
+                {'upload': spec.ClientSpec(api_upload, http.DEFAULT_GET)},
+                self.transport)
+        body = (chunk for chunk in ['abc', 'def'])
+        assert_raises(strategy.ServiceNotAvailable,
+                      client.upload, body=body, status='503')
+        assert_equal(send.call_count, 1)
+
+
+class RawBodyTestCase(TestCase):
+
+    def test_is_raw_body(self):
+        for body in ['a', bytearray('a'), buffer('a'), memoryview('a'),
+                     StringIO.StringIO('a'), iter(['a']), (c for c in 'a')]:
+            assert http.is_raw_body(body), body
+        for body in [None, {'a': 1}, ['a'], u'a']:
+            assert not http.is_raw_body(body), body
+
+    def test_is_stream_body(self):
+        assert http.is_stream_body(StringIO.StringIO('a'))
+        assert http.is_stream_body(iter(['a']))
+        assert not http.is_stream_body('a')
+        assert not http.is_stream_body(['a'])
+
+    def test_iter_body_chunks(self):
+        chunks = http.iter_body_chunks(StringIO.StringIO('abcde'), chunk_size=2)
+        assert_equal(list(chunks), ['ab', 'cd', 'e'])
+
+    def test_encode_body_raw(self):
+        codec = codec_module.get_codec('json')
+        body = iter(['a'])
+        assert_equal(http.encode_body(body, None, codec), (body, None))
+
+    def test_build_http_request_unchanged(self):
+        meta_schema = http.HttpMetaSchema(
+            body=schemas.RawBodySchema(), query=schemas.EmptySchema)
+        api_spec = spec.APISpec('upload', 'POST', meta_schema, meta_schema)
+        body = (chunk for chunk in ['a', 'b'])
+        request = http.build_http_request(api_spec, {'body': body})
+        assert request.data is body
+        assert_equal(request.query, {})
+
+    @mock.patch('requests.request', autospec=True)
+    def test_http_transport_send_unchanged(self, mock_request):
+        body = memoryview('abc')
+        request = http.HTTPRequest('what', 'POST', None, body, None, codec='json')
+        http.HTTPTransport('localhost', 80).send(request)
+        _, kwargs = mock_request.call_args
+        assert kwargs['data'] is body
+
+    def test_repeatable(self):
+        assert http.HTTPRequest('a', 'POST', None, 'body', None).repeatable
+        assert http.HTTPRequest('a', 'GET', None, None, None).repeatable
+        request = http.HTTPRequest('a', 'POST', None, iter(['body']), None)
+        assert not request.repeatable
+        assert not request._replace(path='b').repeatable
+
+    def test_compress_raw_body(self):
+        compressor = compression.Compression(min_size=1)
+        body = memoryview('a' * 10)
+        assert_equal(compressor.compress(body, {}), (body, {}))
+
+
+class LazyImportTestCase(TestCase):
+
+    def test_import_does_not_load_optional_dependencies(self):
+        output = subprocess.check_output([sys.executable, '-c',
+            'import sys, apifactory.http; '
+            'print [name for name in ("colander", "requests", "json", '
+            '"simplejson", "ujson", "msgpack", "zstandard") '
+            'if name in sys.modules]'])
+        assert_equal(output.strip(), '[]')
+
+    def test_meta_schema_without_colander_schemas(self):
+        meta_schema = http.HttpMetaSchema(
+            body=schemas.RawBodySchema(), query=schemas.EmptySchema)
+        assert_equal(meta_schema.serialize({'body': 'abc'}),
+                     {'body': 'abc', 'query': {}})
+
+
+class HTTPRetryStrategyTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.func = mock.Mock()
+        self.sleep_patcher = mock.patch('apifactory.http.time.sleep',
+                                        autospec=True)
+        self.mock_sleep = self.sleep_patcher.start()
+
+    @teardown
+    def teardown_patches(self):
+        self.sleep_patcher.stop()
+
+    def test_retry_success(self):
+        self.func.side_effect = [strategy.ServiceNotAvailable(), 'response']
+        retry_strategy = http.HTTPRetryStrategy()
+        assert_equal(retry_strategy.retry(self.func), 'response')
+        assert_equal(self.func.call_count, 2)
+        assert_equal(self.mock_sleep.mock_calls, [])
+
+    def test_retry_raises_last_error(self):
+        errors = [strategy.ServiceNotAvailable(i) for i in range(3)]
+        self.func.side_effect = errors
+        retry_strategy = http.HTTPRetryStrategy(retry_count=3)
+        try:
+            retry_strategy.retry(self.func)
+        except strategy.ServiceNotAvailable, e:
+            assert e is errors[2]
+        else:
+            assert False, "ServiceNotAvailable not raised"
+        assert_equal(self.func.call_count, 3)
+
+    def test_retry_other_errors_are_not_retried(self):
+        self.func.side_effect = http.HTTPNotFound()
+        retry_strategy = http.HTTPRetryStrategy()
+        assert_raises(http.HTTPNotFound, retry_strategy.retry, self.func)
+        assert_equal(self.func.call_count, 1)
+
+    def test_retry_backoff(self):
+        self.func.side_effect = [strategy.ServiceNotAvailable()] * 2 + ['ok']
+        backoff = strategy.ExponentialBackoff(0.1, jitter=False)
+        retry_strategy = http.HTTPRetryStrategy(backoff=backoff)
+        assert_equal(retry_strategy.retry(self.func), 'ok')
+        assert_equal(self.mock_sleep.mock_calls, [mock.call(0.1), mock.call(0.2)])
+
+    @mock.patch('apifactory.http.time.time', autospec=True)
+    def test_retry_deadline(self, mock_time):
+        mock_time.side_effect = [100, 100.5, 101.5]
+        self.func.side_effect = [strategy.ServiceNotAvailable()] * 3
+        backoff = strategy.ExponentialBackoff(0.5, jitter=False)
+        retry_strategy = http.HTTPRetryStrategy(backoff=backoff, deadline=1.5)
+        assert_raises(strategy.ServiceNotAvailable,
+                      retry_strategy.retry, self.func)
+        assert_equal(self.func.call_count, 2)
+
+    @mock.patch('apifactory.http.time.time', autospec=True)
+    def test_retry_call_deadline(self, mock_time):
+        mock_time.return_value = 100
+        self.func.side_effect = [strategy.ServiceNotAvailable()] * 3
+        backoff = strategy.ExponentialBackoff(0.5, jitter=False)
+        retry_strategy = http.HTTPRetryStrategy(backoff=backoff, deadline=10)
+        assert_raises(strategy.ServiceNotAvailable,
+                      retry_strategy.retry, self.func, 100.2)
+        assert_equal(self.func.call_count, 1)
+
+    def test_retry_budget(self):
+        budget = strategy.RetryBudget(ratio=0.1, max_tokens=1)
+        self.func.side_effect = strategy.ServiceNotAvailable()
+        retry_strategy = http.HTTPRetryStrategy(budget=budget)
+        assert_raises(strategy.ServiceNotAvailable,
+                      retry_strategy.retry, self.func)
+        assert_equal(self.func.call_count, 2)
+        assert_raises(strategy.ServiceNotAvailable,
+                      retry_strategy.retry, self.func)
+        assert_equal(self.func.call_count, 3)
+
 
 class AsyncTestCase(TestCase):
 
@@ -76,6 +725,30 @@ class AsyncTestCase(TestCase):
         assert_equal(future(), self.wrapped.handle.return_value)
         assert_equal(self.wrapped.handle.call_count, 1)
 
+    def test_for_name(self):
+        breaker = strategy.CircuitBreakerErrorStrategy(self.wrapped)
+        bound = http.Async(breaker).for_name('one')
+        assert isinstance(bound, http.Async)
+        assert bound.wrapped is breaker.for_name('one')
+        assert_equal(self.async.for_name('one').wrapped, self.wrapped)
+
+
+class MakeAsyncTestCase(TestCase):
+
+    def test_make_async(self):
+        retry_strategy = mock.create_autospec(interfaces.IRetryStrategy)
+        error_strategy = mock.create_autospec(interfaces.IErrorStrategy)
+        cache_strategy = mock.create_autospec(interfaces.ICacheStrategy)
+        request_spec = spec.RequestSpec(
+            retry_strategy, error_strategy, cache_strategy, 0.2)
+        async_spec = http.make_async(request_spec)
+        assert isinstance(async_spec.retry_strategy, http.Async)
+        assert async_spec.retry_strategy.wrapped is retry_strategy
+        assert async_spec.error_strategy.wrapped is error_strategy
+        assert_equal(
+            async_spec._replace(retry_strategy=None, error_strategy=None),
+            request_spec._replace(retry_strategy=None, error_strategy=None))
+
 
 class FilterDictTestCase(TestCase):
 
@@ -84,6 +757,14 @@ class FilterDictTestCase(TestCase):
         assert_equal(http.filter_dict(seq), {1:2, 3:4})
 
 
+class BuildKeyToFieldTestCase(TestCase):
+
+    def test_build_key_to_field(self):
+        field_to_keys = {'body': ['one', 'three'], 'path': ['two'], 'query': []}
+        expected = {'one': 'body', 'three': 'body', 'two': 'path'}
+        assert_equal(http.build_key_to_field(field_to_keys), expected)
+
+
 class GetColanderKeysTestCase(TestCase):
 
     def test_get_colander_keys_validates_keys(self):
@@ -140,7 +821,145 @@ class HttpMetaSchemaTestCase(TestCase):
         }
         assert_equal(output, expected)
 
+    def test_serialize_field_without_keys(self):
+        meta_schema = http.HttpMetaSchema(
+            body=self.body_schema, query=schemas.EmptySchema)
+        output = meta_schema.serialize({'one': 1, 'two': 2})
+        assert_equal(output, {'body': {'one': '1'}, 'query': {}})
+
+    def test_serialize_does_not_rebuild_routing(self):
+        with mock.patch.object(self.meta_schema, 'field_to_key_mapper') as mapper:
+            self.meta_schema.serialize({'one': 1, 'two': 2})
+        assert_equal(mapper.mock_calls, [])
+
     def test_verify_schema_uniqueness_not_unique(self):
         self.path_schema.add(colander.SchemaNode(colander.String(), name='one'))
         assert_raises(http.SchemaValueError,
               http.HttpMetaSchema, body=self.body_schema, path=self.path_schema)
+
+
+class JsonHttpResponseTestCase(TestCase):
+
+    def test_body(self):
+        response = http.JsonHttpResponse(mock.Mock(body='{"one": 1}'))
+        assert_equal(response.body, {'one': 1})
+
+    def test_body_decoded_once(self):
+        codec = mock.create_autospec(interfaces.ICodec)
+        response = http.JsonHttpResponse(mock.Mock(body='{"one": 1}'), codec)
+        assert response.body is response.body
+        codec.decode.assert_called_once_with('{"one": 1}')
+
+    def test_body_content(self):
+        response = mock.Mock(spec=['content'], content='{"one": 1}')
+        assert_equal(http.JsonHttpResponse(response).body, {'one': 1})
+
+    def test_getattr(self):
+        response = http.JsonHttpResponse(mock.Mock(status_code=200))
+        assert_equal(response.status_code, 200)
+
+    def test_iter_items_read(self):
+        body = StringIO.StringIO('[{"id": 1}, {"id": 2}]')
+        response = http.JsonHttpResponse(body)
+        assert_equal(list(response.iter_items(chunk_size=3)),
+                     [{'id': 1}, {'id': 2}])
+
+    def test_iter_items_iter_content(self):
+        chunks = ['[1, ', '2]']
+        response = http.JsonHttpResponse(
+            mock.Mock(iter_content=mock.Mock(return_value=chunks)))
+        assert_equal(list(response.iter_items()), [1, 2])
+        response.iter_content.assert_called_with(64 * 1024)
+
+    def test_iter_items_body(self):
+        response = http.JsonHttpResponse(mock.Mock(spec=['body'], body='[1]'))
+        assert_equal(list(response.iter_items()), [1])
+
+    def test_iter_items_closes_body(self):
+        body = mock.Mock(spec=['read', 'close'])
+        body.read.side_effect = ['[1, 2]', ' \n', '']
+        items = http.JsonHttpResponse(
+            mock.Mock(spec=['body'], body=body)).iter_items()
+        assert_equal(list(items), [1, 2])
+        assert_equal(body.read.call_count, 3)
+        body.close.assert_called_once_with()
+
+    def test_iter_items_closes_abandoned_body(self):
+        body = StringIO.StringIO('[1, 2]')
+        items = http.JsonHttpResponse(body).iter_items(chunk_size=3)
+        assert_equal(next(items), 1)
+        items.close()
+        assert body.closed
+
+
+class JsonStreamSchemaTestCase(TestCase):
+
+    def test_deserialize(self):
+        response = mock.Mock(spec=['body'], body='[1, 2]')
+        items = http.JsonStreamSchema().deserialize(response)
+        assert_equal(list(items), [1, 2])
+
+    def test_deserialize_item_schema(self):
+        item_schema = colander.SchemaNode(colander.Mapping())
+        item_schema.add(colander.SchemaNode(colander.Int(), name='id'))
+        response = mock.Mock(spec=['body'], body='[{"id": "1"}, {"id": "2"}]')
+        items = http.JsonStreamSchema(item_schema).deserialize(response)
+        assert_equal(next(items), {'id': 1})
+        assert_equal(list(items), [{'id': 2}])
+
+    def test_get_stream(self):
+        request_schema = mock.create_autospec(interfaces.ISchema)
+        request_schema.serialize.return_value = {}
+        api_spec = http.GET(
+            'export', request_schema, http.JsonStreamSchema(), stream=True)
+        assert api_spec.stream
+        request = http.build_http_request(api_spec, {})
+        assert request.stream
+
+
+class IterJsonListTestCase(TestCase):
+
+    def split(self, text, size):
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def test_iter_json_list_any_chunk_size(self):
+        items = [1, -12.5, "a \"quoted\", string", u"\xe9", [], [1, [2]],
+                 {"a": {"b": None}}, True, False, None, 1234567]
+        text = ' \n' + json.dumps(items, indent=1) + ' '
+        for size in range(1, len(text) + 1):
+            assert_equal(list(http.iter_json_list(self.split(text, size))), items)
+
+    def test_iter_json_list_utf8_split(self):
+        text = json.dumps([u'\xe9\u4e2d'], ensure_ascii=False).encode('utf8')
+        chunks = self.split(text, 1)
+        assert_equal(list(http.iter_json_list(chunks)), [u'\xe9\u4e2d'])
+
+    def test_iter_json_list_empty(self):
+        assert_equal(list(http.iter_json_list(['[', ' ', ']'])), [])
+
+    def test_iter_json_list_is_incremental(self):
+        def chunks():
+            yield '[1, 2,'
+            raise AssertionError("Read too far")
+        items = http.iter_json_list(chunks())
+        assert_equal(next(items), 1)
+
+    def test_iter_json_list_not_a_list(self):
+        assert_raises(ValueError, list, http.iter_json_list(['{"a": 1}']))
+
+    def test_iter_json_list_truncated(self):
+        assert_raises(ValueError, list, http.iter_json_list(['[1, 2']))
+
+    def test_iter_json_list_invalid(self):
+        assert_raises(ValueError, list, http.iter_json_list(['[1 2]']))
+        assert_raises(ValueError, list, http.iter_json_list(['[1, ]']))
+
+    def test_read_more_doubles_buffer(self):
+        chunks = iter(['e', '', 'f', 'g', 'h', 'i'])
+        assert_equal(http.read_more(chunks, 'xabcd', 1), 'abcdefgh')
+        assert_equal(http.read_more(chunks, 'abcdefgh', 8), 'i')
+        assert_raises(ValueError, http.read_more, chunks, 'ab', 0)
+
+    def test_read_more_end_of_chunks(self):
+        chunks = iter(['e', 'f'])
+        assert_equal(http.read_more(chunks, 'abcd', 0), 'abcdef')
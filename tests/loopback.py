@@ -0,0 +1,101 @@
+"""
+A local http server, run in a background thread, for tests which need to
+make real requests.
+"""
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+from apifactory import compression
+
+
+class EchoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Responds with a json document describing the request. The status code
+    of the response can be set with a `status` query parameter, and a delay
+    before responding with a `delay` query parameter. With an `items` query
+    parameter the response is instead a json list of that many items. With an
+    `encoding` query parameter the response body is compressed with that
+    encoding. A compressed request body is decompressed before it is echoed,
+    and a chunked one is dechunked, with its chunk sizes echoed as `chunks`.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would
+    # delay until the client acknowledges the headers
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = list(self.read_chunks())
+        else:
+            chunks = None
+            length = int(self.headers.get('Content-Length') or 0)
+        data = compression.decompress(
+            ''.join(chunks) if chunks is not None else self.rfile.read(length),
+            self.headers.get('Content-Encoding'))
+        body = json.dumps({
+            'path':     url.path,
+            'method':   self.command,
+            'query':    query,
+            'data':     data,
+            'chunks':   chunks and [len(chunk) for chunk in chunks],
+            'headers':  dict(self.headers),
+            'client':   self.client_address[1],
+        })
+        if 'items' in query:
+            body = json.dumps([{'id': i} for i in xrange(int(query['items']))])
+        time.sleep(float(query.get('delay', 0)))
+        self.send_response(int(query.get('status', 200)))
+        self.send_header('Content-Type', 'application/json')
+        if 'encoding' in query:
+            encoding = compression.encodings[query['encoding']]
+            body = encoding.compress(body, 6)
+            self.send_header('Content-Encoding', encoding.name)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_chunks(self):
+        while True:
+            size = int(self.rfile.readline().split(';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return
+            yield self.rfile.read(size)
+            self.rfile.readline()
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients which time out close the connection before the response
+        pass
+
+
+class LoopbackServer(object):
+
+    def __init__(self, handler_class=EchoHandler):
+        self.server = ThreadedHTTPServer(('127.0.0.1', 0), handler_class)
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,120 @@
+import mock
+from testify import TestCase, assert_equal, assert_lte, setup
+from testify.assertions import assert_raises
+
+from apifactory import factory, http, interfaces, metrics, spec, strategy
+
+
+def build_response(status_code):
+    return mock.Mock(spec=['status_code'], status_code=status_code)
+
+
+class HistogramTestCase(TestCase):
+
+    @setup
+    def setup_histogram(self):
+        self.histogram = metrics.Histogram(significant_bits=8)
+
+    def test_small_values_are_exact(self):
+        for value in range(256):
+            self.histogram.record(value)
+        assert_equal(len(self.histogram.counts), 256)
+        assert_equal(self.histogram.value_at_percentile(50), 127)
+        assert_equal(self.histogram.value_at_percentile(100), 255)
+
+    def test_large_values_error(self):
+        values = [1000, 12345, 999999, 123456789]
+        for value in values:
+            histogram = metrics.Histogram(significant_bits=8)
+            histogram.record(value)
+            histogram.record(value + 1000000000)
+            reported = histogram.value_at_percentile(50)
+            assert_lte(abs(reported - value), value / 128.0)
+
+    def test_memory_is_bounded(self):
+        for value in xrange(0, 1000000, 7):
+            self.histogram.record(value)
+        assert_lte(len(self.histogram.counts), 256 * 13)
+
+    def test_stats(self):
+        for value in [10, 20, 30, 40]:
+            self.histogram.record(value)
+        assert_equal(self.histogram.count, 4)
+        assert_equal(self.histogram.mean, 25.0)
+        assert_equal((self.histogram.min, self.histogram.max), (10, 40))
+        assert_equal(self.histogram.value_at_percentile(75), 30)
+        assert_equal(self.histogram.value_at_percentile(0), 10)
+
+    def test_empty(self):
+        assert_equal(self.histogram.value_at_percentile(50), None)
+        assert_equal(self.histogram.mean, None)
+
+
+class MetricsRecorderTestCase(TestCase):
+
+    def test_snapshot(self):
+        recorder = metrics.MetricsRecorder()
+        recorder.record_latency('one', 'send', 0.002)
+        recorder.record_latency('one', 'send', 0.004)
+        recorder.record_retry('one')
+        recorder.record_error('one', 'ServiceNotAvailable')
+        recorder.add_in_flight('two', 1)
+        snapshot = recorder.snapshot()
+        send = snapshot['one']['latency']['send']
+        assert_equal((send['count'], send['min'], send['max']), (2, 2000, 4000))
+        assert_equal(snapshot['one']['retries'], 1)
+        assert_equal(snapshot['one']['errors'], {'ServiceNotAvailable': 1})
+        assert_equal(snapshot['two']['in_flight'], 1)
+        assert_equal(snapshot['two']['latency'], {})
+
+
+class InstrumentedClientTestCase(TestCase):
+
+    @setup
+    def setup_client(self):
+        self.recorder = metrics.MetricsRecorder()
+        self.transport = mock.create_autospec(interfaces.ITransport)
+        self.transport.send.return_value = build_response(200)
+        self.transport.receive.return_value = 'result'
+        api_spec = spec.APISpec('one', 'GET', None, None)
+        request_spec = spec.RequestSpec(http.HTTPRetryStrategy(retry_count=3),
+                                        http.HTTPErrorStrategy())
+        self.client = factory.build_client(
+            {'one': spec.ClientSpec(api_spec, request_spec)},
+            self.transport,
+            metrics=self.recorder)
+
+    def test_call_phases(self):
+        assert_equal(self.client.one(), 'result')
+        snapshot = self.recorder.snapshot()['one']
+        assert_equal(sorted(snapshot['latency']),
+                     ['call', 'deserialize', 'send', 'serialize'])
+        assert_equal(snapshot['in_flight'], 0)
+        assert_equal(snapshot['retries'], 0)
+
+    def test_retries_and_errors(self):
+        self.transport.send.return_value = build_response(503)
+        assert_raises(strategy.ServiceNotAvailable, self.client.one)
+        snapshot = self.recorder.snapshot()['one']
+        assert_equal(snapshot['retries'], 2)
+        assert_equal(snapshot['latency']['send']['count'], 3)
+        assert_equal(snapshot['errors'], {'ServiceNotAvailable': 1})
+        assert_equal(snapshot['in_flight'], 0)
+
+    def test_future(self):
+        future = mock.Mock()
+        call_builder = lambda api_spec, request_spec, transport: (
+            lambda **kwargs: future)
+        client = factory.build_client(
+            {'one': spec.ClientSpec(spec.APISpec('one', 'GET', None, None),
+                                    http.DEFAULT_GET)},
+            self.transport, call_builder=call_builder, metrics=self.recorder)
+        assert_equal(client.one(), future)
+        assert_equal(self.recorder.in_flight['one'], 1)
+
+        (callback,), _ = future.add_done_callback.call_args
+        future.exception.return_value = strategy.DeadlineExceeded()
+        callback(future)
+        snapshot = self.recorder.snapshot()['one']
+        assert_equal(snapshot['in_flight'], 0)
+        assert_equal(snapshot['errors'], {'DeadlineExceeded': 1})
@@ -0,0 +1,80 @@
+import threading
+
+import mock
+from testify import TestCase, assert_equal, setup
+from testify.assertions import assert_raises
+
+from apifactory import pool
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    @setup
+    def setup_pool(self):
+        self.connection_class = mock.Mock()
+        self.connection_class.side_effect = lambda host, port: mock.Mock()
+        self.pool = pool.ConnectionPool(max_size=2, idle_timeout=30,
+                                        connection_class=self.connection_class)
+
+    def test_acquire_new_connection(self):
+        conn = self.pool.acquire('localhost', 80)
+        self.connection_class.assert_called_with('localhost', 80)
+        assert_equal(self.pool.stats, pool.PoolStats(0, 1, 0, 0))
+        assert conn
+
+    def test_acquire_reuses_released_connection(self):
+        conn = self.pool.acquire('localhost', 80)
+        self.pool.release('localhost', 80, conn)
+        assert_equal(self.pool.acquire('localhost', 80), conn)
+        assert_equal(self.pool.stats, pool.PoolStats(1, 1, 0, 0))
+
+    def test_acquire_pools_per_host(self):
+        conn = self.pool.acquire('localhost', 80)
+        self.pool.release('localhost', 80, conn)
+        assert conn is not self.pool.acquire('localhost', 81)
+        assert_equal(self.pool.stats, pool.PoolStats(0, 2, 0, 0))
+
+    def test_acquire_timeout_when_full(self):
+        self.pool.acquire('localhost', 80)
+        self.pool.acquire('localhost', 80)
+        assert_raises(pool.PoolTimeout,
+                      self.pool.acquire, 'localhost', 80, timeout=0.01)
+        assert_equal(self.pool.stats.waits, 1)
+
+    def test_acquire_waits_for_release(self):
+        conns = [self.pool.acquire('localhost', 80) for _ in range(2)]
+        timer = threading.Timer(0.01, self.pool.release,
+                                ('localhost', 80, conns[0]))
+        timer.start()
+        assert_equal(self.pool.acquire('localhost', 80, timeout=5), conns[0])
+        assert_equal(self.pool.stats, pool.PoolStats(1, 2, 1, 0))
+
+    def test_discard_frees_slot(self):
+        conns = [self.pool.acquire('localhost', 80) for _ in range(2)]
+        self.pool.discard('localhost', 80, conns[0])
+        conns[0].close.assert_called_with()
+        self.pool.acquire('localhost', 80, timeout=0)
+        assert_equal(self.pool.stats.new_connections, 3)
+
+    @mock.patch('apifactory.pool.time.time', autospec=True)
+    def test_idle_connections_are_evicted(self, mock_time):
+        mock_time.return_value = 100
+        conn = self.pool.acquire('localhost', 80)
+        self.pool.release('localhost', 80, conn)
+        mock_time.return_value = 131
+        assert conn is not self.pool.acquire('localhost', 80)
+        conn.close.assert_called_with()
+        assert_equal(self.pool.stats, pool.PoolStats(0, 2, 0, 1))
+
+    def test_clear(self):
+        conn = self.pool.acquire('localhost', 80)
+        self.pool.release('localhost', 80, conn)
+        self.pool.clear()
+        conn.close.assert_called_with()
+        assert_equal(self.pool.idle, {})
+
+
+class GetDefaultPoolTestCase(TestCase):
+
+    def test_get_default_pool_is_shared(self):
+        assert pool.get_default_pool() is pool.get_default_pool()
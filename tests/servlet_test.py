@@ -0,0 +1,295 @@
+import json
+import StringIO
+import threading
+from wsgiref import simple_server, util
+
+import colander
+import mock
+from testify import TestCase, assert_equal, setup, teardown
+from testify.assertions import assert_raises
+
+from apifactory import codec, compression, factory, http, pool, servlet, spec
+from apifactory import strategy
+
+
+def build_environ(path, method='GET', query='', body='', content_type=''):
+    environ = {
+        'PATH_INFO':        path,
+        'REQUEST_METHOD':   method,
+        'QUERY_STRING':     query,
+        'CONTENT_LENGTH':   str(len(body)),
+        'CONTENT_TYPE':     content_type,
+        'wsgi.input':       StringIO.StringIO(body),
+    }
+    util.setup_testing_defaults(environ)
+    return environ
+
+
+class QuerySchema(colander.MappingSchema):
+    q = colander.SchemaNode(colander.String())
+
+
+class PathSchema(colander.MappingSchema):
+    id = colander.SchemaNode(colander.Int())
+
+
+class BodySchema(colander.MappingSchema):
+    name = colander.SchemaNode(colander.String())
+
+
+class ItemSchema(object):
+
+    def serialize(self, response):
+        return response
+
+    def deserialize(self, response):
+        # The transport has a codec, so the body is already decoded
+        return response.body
+
+
+api_search = http.GET('search', http.HttpMetaSchema(query=QuerySchema()),
+                      ItemSchema())
+api_get = http.GET('items/%(id)s', http.HttpMetaSchema(path=PathSchema()),
+                   ItemSchema())
+api_add = http.POST('items', http.HttpMetaSchema(body=BodySchema()),
+                    ItemSchema())
+
+
+def search(request):
+    return {'q': request['q']}
+
+
+def get_item(request):
+    if request['id'] == 404:
+        raise http.HTTPNotFound("No item")
+    if request['id'] == 503:
+        raise strategy.ServiceNotAvailable()
+    return {'id': request['id']}
+
+
+def add_item(request):
+    return {'added': request['name']}
+
+
+view_specs = [
+    spec.ViewSpec(api_search, search),
+    spec.ViewSpec(api_get, get_item),
+    spec.ViewSpec(api_add, add_item),
+]
+
+
+class ParseQueryTestCase(TestCase):
+
+    def test_parse_query(self):
+        assert_equal(servlet.parse_query('a=1&b=&a=2&a=3&c=4'),
+                     {'a': ['1', '2', '3'], 'b': '', 'c': '4'})
+
+
+class BuildPathPatternTestCase(TestCase):
+
+    def test_build_path_pattern_static(self):
+        assert_equal(servlet.build_path_pattern('items/all'), None)
+
+    def test_build_path_pattern(self):
+        pattern = servlet.build_path_pattern('users/%(user)s/items/%(id)d.json')
+        match = pattern.match('users/bob/items/12.json')
+        assert_equal(match.groupdict(), {'user': 'bob', 'id': '12'})
+        assert_equal(pattern.match('users/bob/items/12xjson'), None)
+        assert_equal(pattern.match('users/bob/items/12.json/more'), None)
+
+
+class ServletRequestTestCase(TestCase):
+
+    def test_headers(self):
+        environ = build_environ('a', content_type='application/json')
+        environ['HTTP_X_REQUEST_ID'] = 'abc'
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert_equal(request.headers['X-Request-Id'], 'abc')
+        assert_equal(request.headers['Content-Type'], 'application/json')
+
+    def test_query_and_headers_parsed_once(self):
+        environ = build_environ('a', query='one=1')
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert request.query is request.query
+        assert request.headers is request.headers
+        assert_equal(request.query, {'one': '1'})
+
+    def test_body_read_once(self):
+        environ = build_environ('a', body='{"one": 1}')
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert request.body is request.body
+        assert_equal(request.body, {'one': 1})
+
+    def test_body_form_data(self):
+        environ = build_environ('a', body='one=1',
+                               content_type=servlet.FORM_CONTENT_TYPE)
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert_equal(request.body, {'one': '1'})
+
+    def test_body_empty(self):
+        request = servlet.ServletRequest(build_environ('a'), {}, None)
+        assert_equal(request.body, None)
+
+    def test_body_compressed(self):
+        body = compression.encodings['gzip'].compress('{"one": 1}', 6)
+        environ = build_environ('a', body=body)
+        environ['HTTP_CONTENT_ENCODING'] = 'gzip'
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert_equal(request.body, {'one': 1})
+
+    def test_body_unsupported_encoding(self):
+        environ = build_environ('a', body='{"one": 1}')
+        environ['HTTP_CONTENT_ENCODING'] = 'br'
+        request = servlet.ServletRequest(environ, {}, codec.json_codec)
+        assert_raises(http.HTTPBadRequest, lambda: request.body)
+
+
+class ServletTestCase(TestCase):
+
+    @setup
+    def setup_servlet(self):
+        self.app = servlet.build_servlet(view_specs)
+
+    def call(self, *args, **kwargs):
+        start_response = mock.Mock()
+        body = ''.join(self.app(build_environ(*args, **kwargs), start_response))
+        (status, headers), _ = start_response.call_args
+        return status, dict(headers), body
+
+    def test_static_route(self):
+        status, headers, body = self.call('/search', query='q=stars')
+        assert_equal(status, '200 OK')
+        assert_equal(headers['Content-Type'], 'application/json')
+        assert_equal(json.loads(body), {'q': 'stars'})
+
+    def test_path_params(self):
+        _, _, body = self.call('/items/12')
+        assert_equal(json.loads(body), {'id': 12})
+
+    def test_post_body(self):
+        _, _, body = self.call('/items', 'POST', body='{"name": "thing"}')
+        assert_equal(json.loads(body), {'added': 'thing'})
+
+    def test_not_found(self):
+        status, _, _ = self.call('/missing')
+        assert_equal(status, '404 Not Found')
+
+    def test_method_not_allowed(self):
+        status, headers, _ = self.call('/items', 'DELETE')
+        assert_equal(status, '405 Method Not Allowed')
+        assert_equal(headers['Allow'], 'POST')
+
+    def test_invalid_request(self):
+        status, _, body = self.call('/search')
+        assert_equal(status, '400 Bad Request')
+        assert_equal(json.loads(body)['error'], 'Invalid')
+
+    def test_invalid_body(self):
+        status, _, _ = self.call('/items', 'POST', body='{not json')
+        assert_equal(status, '400 Bad Request')
+
+    def test_handler_errors(self):
+        assert_equal(self.call('/items/404')[0], '404 Not Found')
+        assert_equal(self.call('/items/503')[0], '503 Service Unavailable')
+
+    def test_codec(self):
+        text = codec.Codec('text', 'text/plain', repr, None)
+        app = servlet.build_servlet(view_specs, codec=text)
+        start_response = mock.Mock()
+        body = app(build_environ('/items/3'), start_response)
+        assert_equal(body, ["{'id': 3}"])
+
+    def test_compile_schemas(self):
+        app = servlet.build_servlet(view_specs, compile_schemas=True)
+        start_response = mock.Mock()
+        body = app(build_environ('/search', query='q=x'), start_response)
+        assert_equal(json.loads(body[0]), {'q': 'x'})
+
+    def test_compressed_response(self):
+        self.app = servlet.build_servlet(
+            view_specs, compression=compression.Compression(min_size=1))
+        environ = build_environ('/items/3')
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip, deflate'
+        start_response = mock.Mock()
+        body = ''.join(self.app(environ, start_response))
+        (_, headers), _ = start_response.call_args
+        headers = dict(headers)
+        assert_equal(headers['Content-Encoding'], 'gzip')
+        assert_equal(headers['Content-Length'], str(len(body)))
+        assert_equal(headers['Vary'], 'Accept-Encoding')
+        assert_equal(json.loads(compression.decompress(body, 'gzip')),
+                     {'id': 3})
+
+    def test_response_not_compressed_without_accept_encoding(self):
+        self.app = servlet.build_servlet(
+            view_specs, compression=compression.Compression(min_size=1))
+        _, headers, body = self.call('/items/3')
+        assert 'Content-Encoding' not in headers
+        assert_equal(headers['Vary'], 'Accept-Encoding')
+        assert_equal(json.loads(body), {'id': 3})
+
+    def test_response_without_compression_does_not_vary(self):
+        _, headers, _ = self.call('/items/3')
+        assert 'Vary' not in headers
+
+    def test_duplicate_route(self):
+        try:
+            servlet.build_servlet(view_specs + view_specs[:1])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected ValueError")
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class ClientServletTestCase(TestCase):
+    """The same APISpecs drive a client and the servlet."""
+
+    @setup
+    def setup_server(self):
+        self.server = simple_server.make_server(
+            '127.0.0.1', 0, servlet.build_servlet(view_specs),
+            handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.pool = pool.ConnectionPool()
+        transport = http.PooledHTTPTransport(
+            '127.0.0.1', self.server.server_port, connection_pool=self.pool,
+            codec='json')
+        request_spec = spec.RequestSpec(http.HTTPRetryStrategy(retry_count=1),
+                                        http.HTTPErrorStrategy())
+        self.client = factory.build_client({
+            'search':   spec.ClientSpec(api_search, request_spec),
+            'get':      spec.ClientSpec(api_get, request_spec),
+            'add':      spec.ClientSpec(api_add, request_spec),
+        }, transport)
+
+    @teardown
+    def teardown_server(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_calls(self):
+        assert_equal(self.client.search(q='stars'), {'q': 'stars'})
+        assert_equal(self.client.get(id=7), {'id': 7})
+        assert_equal(self.client.add(name='thing'), {'added': 'thing'})
+
+    def test_calls_compressed(self):
+        compress = compression.Compression(min_size=1)
+        self.server.set_app(servlet.build_servlet(view_specs, compression=compress))
+        transport = http.PooledHTTPTransport(
+            '127.0.0.1', self.server.server_port, connection_pool=self.pool,
+            codec='json', compression=compress)
+        client = factory.build_client({
+            'add': spec.ClientSpec(api_add, http.DEFAULT_GET),
+        }, transport)
+        assert_equal(client.add(name='thing'), {'added': 'thing'})
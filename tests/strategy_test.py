@@ -0,0 +1,437 @@
+import Queue
+import threading
+import time
+
+import mock
+from testify import TestCase, assert_equal, assert_lte, setup, teardown
+from testify.assertions import assert_raises
+
+from apifactory import interfaces, strategy
+
+
+class RemainingTestCase(TestCase):
+
+    def test_remaining_no_deadline(self):
+        assert_equal(strategy.remaining(None), None)
+
+    @mock.patch('apifactory.strategy.time.time', autospec=True)
+    def test_remaining(self, mock_time):
+        mock_time.return_value = 100
+        assert_equal(strategy.remaining(100.5), 0.5)
+
+    @mock.patch('apifactory.strategy.time.time', autospec=True)
+    def test_remaining_passed(self, mock_time):
+        mock_time.return_value = 100
+        assert_raises(strategy.DeadlineExceeded, strategy.remaining, 100)
+
+
+class ExponentialBackoffTestCase(TestCase):
+
+    def test_delay(self):
+        backoff = strategy.ExponentialBackoff(0.1, max_delay=0.5, jitter=False)
+        delays = [backoff.delay(attempt) for attempt in range(4)]
+        assert_equal(delays, [0.1, 0.2, 0.4, 0.5])
+
+    @mock.patch('apifactory.strategy.random.uniform', autospec=True)
+    def test_delay_jitter(self, mock_uniform):
+        backoff = strategy.ExponentialBackoff(0.1, max_delay=0.5)
+        assert_equal(backoff.delay(1), mock_uniform.return_value)
+        mock_uniform.assert_called_with(0, 0.2)
+
+
+class RetryBudgetTestCase(TestCase):
+
+    @setup
+    def setup_budget(self):
+        self.budget = strategy.RetryBudget(ratio=0.5, max_tokens=2)
+
+    def test_withdraw_until_empty(self):
+        assert_equal([self.budget.withdraw() for _ in range(3)],
+                     [True, True, False])
+
+    def test_deposit(self):
+        self.budget.withdraw()
+        self.budget.withdraw()
+        self.budget.deposit()
+        assert not self.budget.withdraw()
+        self.budget.deposit()
+        assert self.budget.withdraw()
+
+    def test_deposit_capped(self):
+        for _ in range(10):
+            self.budget.deposit()
+        assert_equal(self.budget.tokens, 2)
+
+
+class RollingWindowTestCase(TestCase):
+
+    @setup
+    def setup_window(self):
+        self.window = strategy.RollingWindow(window=10, bucket_count=10)
+
+    def test_totals(self):
+        self.window.add(100.1, False)
+        self.window.add(100.2, True)
+        self.window.add(103, True)
+        assert_equal(self.window.totals(104), (3, 2))
+
+    def test_totals_expire(self):
+        self.window.add(100, True)
+        self.window.add(105, False)
+        assert_equal(self.window.totals(109.5), (2, 1))
+        assert_equal(self.window.totals(110.5), (1, 0))
+        assert_equal(self.window.totals(130), (0, 0))
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.wrapped = mock.create_autospec(interfaces.IErrorStrategy)
+        self.wrapped.handle.side_effect = lambda func: func()
+        self.strategy = strategy.CircuitBreaker(
+            'name', self.wrapped, failure_ratio=0.5, min_requests=4,
+            window=10, reset_timeout=5)
+        self.time_patcher = mock.patch('apifactory.strategy.time.time',
+                                       autospec=True, return_value=100)
+        self.mock_time = self.time_patcher.start()
+
+    @teardown
+    def teardown_patches(self):
+        self.time_patcher.stop()
+
+    def fail(self, error=strategy.ServiceNotAvailable):
+        func = mock.Mock(side_effect=error())
+        assert_raises(error, self.strategy.handle, func)
+
+    def succeed(self):
+        return self.strategy.handle(lambda: 'response')
+
+    def open_circuit(self):
+        for _ in range(4):
+            self.fail()
+        assert_equal(self.strategy.state, self.strategy.OPEN)
+
+    def test_handle_closed(self):
+        assert_equal(self.succeed(), 'response')
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+
+    def test_handle_opens_on_failure_ratio(self):
+        self.succeed()
+        self.succeed()
+        self.fail()
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+        self.fail()
+        assert_equal(self.strategy.state, self.strategy.OPEN)
+
+    def test_handle_deadline(self):
+        self.wrapped.handle.side_effect = lambda func, deadline: func()
+        assert_equal(self.strategy.handle(lambda: 'response', 200), 'response')
+        self.wrapped.handle.assert_called_with(mock.ANY, 200)
+
+    def test_handle_client_errors_are_not_failures(self):
+        for _ in range(4):
+            self.fail(strategy.ClientError)
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+
+    def test_handle_other_errors_are_failures(self):
+        for _ in range(4):
+            self.fail(IOError)
+        assert_equal(self.strategy.state, self.strategy.OPEN)
+
+    def test_handle_open_fails_fast(self):
+        self.open_circuit()
+        func = mock.Mock()
+        assert_raises(strategy.CircuitOpen, self.strategy.handle, func)
+        assert_equal(func.mock_calls, [])
+
+    def test_handle_half_open_probe_success(self):
+        self.open_circuit()
+        self.mock_time.return_value = 105
+        assert_equal(self.succeed(), 'response')
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+        self.fail()
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+
+    def test_handle_half_open_probe_failure(self):
+        self.open_circuit()
+        self.mock_time.return_value = 105
+        self.fail()
+        assert_equal(self.strategy.state, self.strategy.OPEN)
+        assert_raises(strategy.CircuitOpen, self.succeed)
+
+    def test_handle_half_open_single_probe(self):
+        self.open_circuit()
+        self.mock_time.return_value = 105
+        def probe():
+            assert_raises(strategy.CircuitOpen, self.succeed)
+            return 'probe'
+        assert_equal(self.strategy.handle(probe), 'probe')
+        assert_equal(self.strategy.state, self.strategy.CLOSED)
+
+
+class CircuitBreakerErrorStrategyTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.wrapped = mock.create_autospec(interfaces.IErrorStrategy)
+        self.wrapped.handle.side_effect = lambda func: func()
+        self.strategy = strategy.CircuitBreakerErrorStrategy(
+            self.wrapped, min_requests=2)
+
+    def fail(self, circuit):
+        func = mock.Mock(side_effect=strategy.ServiceNotAvailable())
+        assert_raises(strategy.ServiceNotAvailable, circuit.handle, func)
+
+    def test_for_name_is_shared(self):
+        assert self.strategy.for_name('one') is self.strategy.for_name('one')
+        assert self.strategy.for_name('one') is not self.strategy.for_name('two')
+
+    def test_circuits_are_separate(self):
+        for _ in range(2):
+            self.fail(self.strategy.for_name('one'))
+        assert_equal(self.strategy.get_state('one'), strategy.CircuitBreaker.OPEN)
+        assert_equal(self.strategy.get_state('two'),
+                     strategy.CircuitBreaker.CLOSED)
+        assert_equal(self.strategy.for_name('two').handle(lambda: 'ok'), 'ok')
+
+    def test_handle_without_name(self):
+        assert_equal(self.strategy.handle(lambda: 'ok'), 'ok')
+        assert_equal(self.strategy.circuits.keys(), [None])
+
+    def test_for_name_of_other_strategy(self):
+        assert_equal(strategy.for_name(self.wrapped, 'one'), self.wrapped)
+
+
+class LatencyWindowTestCase(TestCase):
+
+    def test_add(self):
+        window = strategy.LatencyWindow(percentile=90, size=10, update_every=5)
+        for latency in range(4):
+            window.add(latency)
+        assert_equal(window.value, None)
+        for latency in range(4, 20):
+            window.add(latency)
+        # The percentile of the last 10 samples, after the 20th sample
+        assert_equal(window.value, 19)
+
+
+class HedgingStrategyTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.strategy = strategy.HedgingStrategy(initial_delay=0.02)
+        self.calls = []
+        self.release = threading.Event()
+
+    def slow_then_fast(self):
+        """The first call waits until released, later calls return."""
+        self.calls.append(time.time())
+        if len(self.calls) == 1:
+            self.release.wait(1)
+            return 'slow'
+        return 'fast'
+
+    def test_hedge_fast_response(self):
+        assert_equal(self.strategy.hedge(lambda: 'one'), 'one')
+        assert_equal(self.strategy.hedges, 0)
+
+    def test_hedge_slow_response(self):
+        start = time.time()
+        assert_equal(self.strategy.hedge(self.slow_then_fast), 'fast')
+        self.release.set()
+        assert_equal(len(self.calls), 2)
+        assert self.calls[1] - start >= 0.02
+        assert_equal(self.strategy.hedges, 1)
+
+    def test_hedge_budget(self):
+        self.strategy.budget.tokens = 0
+        self.release.set()
+        assert_equal(self.strategy.hedge(self.slow_then_fast), 'slow')
+        assert_equal(len(self.calls), 1)
+
+    def test_hedge_error(self):
+        def fail():
+            raise strategy.ServiceNotAvailable()
+        assert_raises(strategy.ServiceNotAvailable, self.strategy.hedge, fail)
+
+    def test_hedge_first_fails_after_hedge(self):
+        def func():
+            self.calls.append(1)
+            if len(self.calls) == 1:
+                time.sleep(0.05)
+                raise strategy.ServiceNotAvailable()
+            time.sleep(0.1)
+            return 'hedge'
+        assert_equal(self.strategy.hedge(func), 'hedge')
+
+    def test_hedge_both_fail(self):
+        def func():
+            self.calls.append(1)
+            time.sleep(0.05)
+            raise ValueError(len(self.calls))
+        assert_raises(ValueError, self.strategy.hedge, func)
+        assert_equal(len(self.calls), 2)
+
+    def test_hedge_deadline(self):
+        self.release.set()
+        func = lambda: time.sleep(0.2)
+        assert_raises(strategy.DeadlineExceeded,
+                      self.strategy.hedge, func, time.time() + 0.05)
+
+    def test_hedge_no_time_for_hedge(self):
+        self.release.set()
+        result = self.strategy.hedge(self.slow_then_fast, time.time() + 0.01)
+        assert_equal(result, 'slow')
+        assert_equal(len(self.calls), 1)
+
+    def test_hedge_reuses_workers(self):
+        workers = self.strategy.workers
+        for _ in range(20):
+            assert_equal(self.strategy.hedge(lambda: 'one'), 'one')
+            # The worker is busy until the result has been returned
+            while workers.busy:
+                time.sleep(0.001)
+        assert_equal(workers.workers, 1)
+
+    def test_delay_from_latencies(self):
+        self.strategy.latencies.value = 0.5
+        assert_equal(self.strategy.delay, 0.5)
+        self.strategy.latencies.value = 0
+        assert_equal(self.strategy.delay, self.strategy.min_delay)
+
+
+class WorkerPoolTestCase(TestCase):
+
+    def test_submit_max_workers(self):
+        pool = strategy.WorkerPool(2)
+        release = threading.Event()
+        done = Queue.Queue()
+        for i in range(4):
+            pool.submit(lambda i: release.wait(1) and done.put(i), i)
+        assert_equal(pool.workers, 2)
+        release.set()
+        assert_equal(sorted(done.get(timeout=1) for _ in range(4)), range(4))
+        assert_equal(pool.workers, 2)
+
+
+class AIMDLimitTestCase(TestCase):
+
+    @setup
+    def setup_limit(self):
+        self.limit = strategy.AIMDLimit(
+            initial_limit=10, min_limit=2, max_limit=11, latency_threshold=1)
+
+    def test_increase(self):
+        self.limit.update(0.1, 5, False)
+        assert_equal(self.limit.limit, 11)
+        self.limit.update(0.1, 11, False)
+        assert_equal(self.limit.limit, 11)
+
+    def test_no_increase_when_underused(self):
+        self.limit.update(0.1, 4, False)
+        assert_equal(self.limit.limit, 10)
+
+    def test_decrease(self):
+        self.limit.update(0.1, 10, True)
+        assert_equal(self.limit.limit, 9)
+        self.limit.update(2, 10, False)
+        assert_equal(self.limit.limit, 8.1)
+
+    def test_min_limit(self):
+        for _ in range(50):
+            self.limit.update(0.1, 10, True)
+        assert_equal(self.limit.limit, 2)
+
+
+class GradientLimitTestCase(TestCase):
+
+    @setup
+    def setup_limit(self):
+        self.limit = strategy.GradientLimit(initial_limit=16, smoothing=1.0)
+
+    def test_increase_at_min_latency(self):
+        self.limit.update(0.01, 16, False)
+        assert_equal(self.limit.limit, 20)
+
+    def test_decrease_when_queueing(self):
+        self.limit.update(0.01, 16, False)
+        self.limit.update(0.1, 20, False)
+        assert_lte(self.limit.limit, 15)
+
+    def test_decrease_when_dropped(self):
+        self.limit.update(0.01, 16, True)
+        assert_equal(self.limit.limit, 12)
+
+    def test_reset_min_latency(self):
+        limit = strategy.GradientLimit(reset_every=2)
+        limit.update(0.01, 1, False)
+        limit.update(0.5, 1, False)
+        assert_equal(limit.min_latency, 0.5)
+
+
+class AdaptiveConcurrencyLimiterTestCase(TestCase):
+
+    @setup
+    def setup_limiter(self):
+        self.limiter = strategy.AdaptiveConcurrencyLimiter(
+            lambda: strategy.AIMDLimit(initial_limit=2, max_limit=2))
+
+    def test_limit(self):
+        assert_equal(self.limiter.limit('one', lambda: 'response'), 'response')
+        assert_equal(self.limiter.in_flight['one'], 0)
+
+    def test_rejects_over_limit(self):
+        self.limiter.acquire('one')
+        self.limiter.acquire('one')
+        func = mock.Mock()
+        assert_raises(strategy.ConcurrencyLimitExceeded,
+                      self.limiter.limit, 'one', func)
+        assert_equal(func.mock_calls, [])
+        assert_equal(self.limiter.rejected['one'], 1)
+        # Each name has its own limit
+        assert_equal(self.limiter.limit('two', lambda: 'response'), 'response')
+
+    def test_dropped_call_lowers_limit(self):
+        def fail():
+            raise strategy.ServiceNotAvailable()
+        assert_raises(strategy.ServiceNotAvailable,
+                      self.limiter.limit, 'one', fail)
+        assert_equal(self.limiter.get_limit('one'), 1)
+        assert_equal(self.limiter.in_flight['one'], 0)
+
+    def test_client_error_is_not_dropped(self):
+        def fail():
+            raise strategy.ClientError()
+        assert_raises(strategy.ClientError, self.limiter.limit, 'one', fail)
+        assert_equal(self.limiter.get_limit('one'), 2)
+
+    def test_future(self):
+        future = mock.Mock()
+        assert_equal(self.limiter.limit('one', lambda: future), future)
+        assert_equal(self.limiter.in_flight['one'], 1)
+
+        (callback,), _ = future.add_done_callback.call_args
+        future.exception.return_value = strategy.DeadlineExceeded()
+        callback(future)
+        assert_equal(self.limiter.in_flight['one'], 0)
+        assert_equal(self.limiter.get_limit('one'), 1)
+
+    def test_concurrent_calls(self):
+        started, release = threading.Event(), threading.Event()
+        def slow():
+            started.set()
+            release.wait(1)
+        threads = [threading.Thread(target=self.limiter.limit, args=('one', slow))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(1)
+        while self.limiter.in_flight['one'] < 2:
+            time.sleep(0.001)
+        assert_raises(strategy.ConcurrencyLimitExceeded,
+                      self.limiter.limit, 'one', slow)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert_equal(self.limiter.in_flight['one'], 0)
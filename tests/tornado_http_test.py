@@ -0,0 +1,233 @@
+import json
+import time
+
+import mock
+from testify import TestCase, assert_equal, assert_lt, setup, teardown
+from testify.assertions import assert_raises
+from tornado import gen, httpserver, ioloop, testing, web
+
+from apifactory import balancer, codec, http, interfaces, metrics, schemas
+from apifactory import spec, strategy
+from apifactory import tornado_http
+
+
+class EchoHandler(web.RequestHandler):
+
+    @gen.coroutine
+    def handle(self, path):
+        delay = float(self.get_argument('delay', 0))
+        if delay:
+            yield gen.sleep(delay)
+        self.set_status(int(self.get_argument('status', 200)))
+        self.write({
+            'path': path,
+            'method': self.request.method,
+            'query': dict((k, self.get_argument(k))
+                          for k in self.request.arguments),
+            'data': self.request.body,
+            'content_type': self.request.headers.get('Content-Type'),
+        })
+
+    get = post = handle
+
+
+class JsonSchema(object):
+
+    @classmethod
+    def serialize(cls, request_data):
+        return request_data
+
+    @classmethod
+    def deserialize(cls, response):
+        return http.JsonHttpResponse(response).body
+
+
+class TornadoTestCase(TestCase):
+
+    @setup
+    def setup_server(self):
+        self.io_loop = ioloop.IOLoop()
+        self.io_loop.make_current()
+        sock, self.port = testing.bind_unused_port()
+        self.server = httpserver.HTTPServer(
+            web.Application([(r'/(.*)', EchoHandler)]))
+        self.server.add_sockets([sock])
+        self.transport = tornado_http.TornadoHTTPTransport(
+            '127.0.0.1', self.port)
+
+    @teardown
+    def teardown_server(self):
+        self.server.stop()
+        self.io_loop.clear_current()
+        self.io_loop.close(all_fds=True)
+
+    def run_sync(self, func):
+        return self.io_loop.run_sync(func, timeout=5)
+
+
+class TornadoHTTPTransportTestCase(TornadoTestCase):
+
+    def test_build_url(self):
+        assert_equal(self.transport.build_url('what', 'q=1'),
+                     'http://127.0.0.1:%s/what?q=1' % self.port)
+
+    def test_send(self):
+        request = http.HTTPRequest('what', 'GET', {'q': 'stars'}, None, None)
+        response = self.run_sync(lambda: self.transport.send(request))
+        assert_equal(response.code, 200)
+        body = json.loads(response.body)
+        assert_equal(body['path'], 'what')
+        assert_equal(body['query'], {'q': 'stars'})
+
+    def test_send_json_body(self):
+        request = http.HTTPRequest('what', 'POST', None, {'one': 1}, None)
+        response = self.run_sync(lambda: self.transport.send(request))
+        body = json.loads(response.body)
+        assert_equal(json.loads(body['data']), {'one': 1})
+        assert_equal(body['content_type'], 'application/json')
+
+    def test_send_codec(self):
+        encoded = codec.Codec('text', 'text/plain', repr, None)
+        transport = tornado_http.TornadoHTTPTransport(
+            '127.0.0.1', self.port, codec=encoded)
+        request = http.HTTPRequest('what', 'POST', None, {'one': 1}, None)
+        response = self.run_sync(lambda: transport.send(request))
+        body = json.loads(response.body)
+        assert_equal(body['data'], "{'one': 1}")
+        assert_equal(body['content_type'], 'text/plain')
+
+    def test_send_generator_body(self):
+        data = (chunk for chunk in ['one', 'two'])
+        request = http.HTTPRequest('what', 'POST', None, data, None)
+        response = self.run_sync(lambda: self.transport.send(request))
+        body = json.loads(response.body)
+        assert_equal(body['data'], 'onetwo')
+        assert body['content_type'] != 'application/json'
+
+    def test_send_buffer_body(self):
+        data = memoryview('one two')[4:]
+        request = http.HTTPRequest('what', 'POST', None, data, None)
+        response = self.run_sync(lambda: self.transport.send(request))
+        assert_equal(json.loads(response.body)['data'], 'two')
+
+    def test_send_error_status(self):
+        request = http.HTTPRequest('what', 'GET', {'status': 503}, None, None)
+        response = self.run_sync(lambda: self.transport.send(request))
+        assert_equal(response.code, 503)
+
+
+class LoadBalancingTransportTestCase(TornadoTestCase):
+
+    def test_send_error_status_ejects_host(self):
+        transport = balancer.LoadBalancingTransport(
+            [('127.0.0.1', self.port)], tornado_http.TornadoHTTPTransport,
+            eject_after=1)
+        request = http.HTTPRequest('what', 'GET', {'status': 503}, None, None)
+        response = self.run_sync(lambda: transport.send(request))
+        assert_equal(response.code, 503)
+        host, = transport.hosts
+        assert host.is_ejected(time.time())
+
+
+class CoroutineClientTestCase(TornadoTestCase):
+
+    @setup
+    def setup_client(self):
+        api_search = http.GET('search', schemas.RawSchema, JsonSchema)
+        self.client = tornado_http.build_client(
+            {'search': spec.ClientSpec(api_search, tornado_http.DEFAULT_GET)},
+            self.transport)
+
+    def search(self, **kwargs):
+        return self.client.search(body=None, headers=None, **kwargs)
+
+    def test_call(self):
+        response = self.run_sync(lambda: self.search(query={'q': 'stars'}))
+        assert_equal(response['query'], {'q': 'stars'})
+
+    def test_calls_are_concurrent(self):
+        start = time.time()
+        responses = self.run_sync(lambda: gen.multi(
+            [self.search(query={'id': i, 'delay': 0.2}) for i in range(50)]))
+        assert_lt(time.time() - start, 2)
+        assert_equal([r['query']['id'] for r in responses],
+                     [str(i) for i in range(50)])
+
+    def test_call_deadline(self):
+        future = lambda: self.search(query={'delay': 1}, _deadline=0.05)
+        assert_raises(strategy.ServiceNotAvailable, self.run_sync, future)
+
+    def test_call_not_found(self):
+        future = lambda: self.search(query={'status': 404})
+        assert_raises(http.HTTPNotFound, self.run_sync, future)
+
+    def test_call_metrics(self):
+        recorder = metrics.MetricsRecorder()
+        api_search = http.GET('search', schemas.RawSchema, JsonSchema)
+        client = tornado_http.build_client(
+            {'search': spec.ClientSpec(api_search, tornado_http.DEFAULT_GET)},
+            self.transport,
+            metrics=recorder)
+        self.run_sync(lambda: client.search(
+            query={'delay': 0.05}, body=None, headers=None))
+        snapshot = recorder.snapshot()['search']
+        assert_equal(snapshot['in_flight'], 0)
+        # Sends are timed until the response arrives
+        assert snapshot['latency']['send']['min'] >= 50000
+        assert snapshot['latency']['call']['min'] >= 50000
+
+
+class BuildCoroutineCallTestCase(TestCase):
+
+    def test_unsupported_request_spec_fields(self):
+        api_search = http.GET('search', schemas.RawSchema, JsonSchema)
+        transport = mock.create_autospec(interfaces.ITransport)
+        for field in ('cache_strategy', 'hedge_strategy', 'batch_spec'):
+            request_spec = tornado_http.DEFAULT_GET._replace(
+                **{field: mock.Mock()})
+            assert_raises(ValueError, tornado_http.build_coroutine_call,
+                          api_search, request_spec, transport)
+
+
+class CoroutineErrorStrategyTestCase(TestCase):
+
+    def test_handle(self):
+        wrapped = mock.create_autospec(interfaces.IErrorStrategy)
+        wrapped.handle.side_effect = lambda f: f()
+        error_strategy = tornado_http.CoroutineErrorStrategy(wrapped)
+        future = error_strategy.handle(lambda: gen.maybe_future('response'))
+        assert_equal(future.result(), 'response')
+        assert_equal(wrapped.handle.call_count, 1)
+
+
+class CoroutineRetryStrategyTestCase(TestCase):
+
+    @setup
+    def setup_strategy(self):
+        self.retry_strategy = tornado_http.CoroutineRetryStrategy(retry_count=3)
+        self.func = mock.Mock()
+
+    def test_retry_success(self):
+        self.func.side_effect = [
+            strategy.ServiceNotAvailable(), gen.maybe_future('response')]
+        future = self.retry_strategy.retry(self.func)
+        assert_equal(future.result(), 'response')
+        assert_equal(self.func.call_count, 2)
+
+    @mock.patch('apifactory.tornado_http.gen.sleep', autospec=True)
+    def test_retry_backoff(self, mock_sleep):
+        mock_sleep.return_value = gen.maybe_future(None)
+        self.retry_strategy.backoff = strategy.ExponentialBackoff(
+            0.1, jitter=False)
+        self.func.side_effect = [
+            strategy.ServiceNotAvailable(), gen.maybe_future('response')]
+        future = self.retry_strategy.retry(self.func)
+        assert_equal(future.result(), 'response')
+        mock_sleep.assert_called_with(0.1)
+
+    def test_retry_failure_raises_last_error(self):
+        error = strategy.ServiceNotAvailable('last')
+        self.func.side_effect = [strategy.ServiceNotAvailable()] * 2 + [error]
+        future = self.retry_strategy.retry(self.func)
+        assert_equal(future.exception(), error)
+        assert_equal(self.func.call_count, 3)